@@ -10,10 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
 
-from tickets.apps import TicketsConfig
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -33,7 +34,9 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    # admin modules are discovered in resolver/urls.py, so commands that
+    # never load the URLconf skip importing them
+    'django.contrib.admin.apps.SimpleAdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -49,14 +52,76 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
-    ]
+    ],
+    # token buckets for write endpoints (tickets/throttling.py): burst/refill period
+    'DEFAULT_THROTTLE_RATES': {
+        'ticket_writes': '30/min',
+        'comment_writes': '60/min',
+        'feedback_writes': '20/min',
+    },
+    # reverse proxies in front of the app that append to X-Forwarded-For; 0 means
+    # none, so anonymous clients are identified by REMOTE_ADDR (throttles, idempotency)
+    'NUM_PROXIES': 0,
 }
 
+# Faster wire formats (tickets/renderers.py), each used when its optional library is
+# installed: orjson replaces DRF's JSON encoder/decoder, msgpack adds application/msgpack
+if find_spec('orjson'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'tickets.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] = [
+        'tickets.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ]
+if find_spec('msgpack'):
+    REST_FRAMEWORK.setdefault('DEFAULT_RENDERER_CLASSES', [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]).append('tickets.renderers.MessagePackRenderer')
+    REST_FRAMEWORK.setdefault('DEFAULT_PARSER_CLASSES', [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ]).append('tickets.renderers.MessagePackParser')
+
+# Write admission control (tickets/throttling.py), per process:
+# in-flight writes allowed, seconds a write may queue, Retry-After when shed
+TICKET_WRITE_CONCURRENCY = 8
+TICKET_WRITE_QUEUE_TIMEOUT = 2.0
+TICKET_WRITE_RETRY_AFTER = 1
+
+# how long a stored Idempotency-Key response is replayed (tickets/idempotency.py),
+# and how long a key may stay in flight before a retry may take it over
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_IN_FLIGHT_LEASE = timedelta(minutes=5)
+
+# duplicate ticket detection (tickets/dedup.py): minimum estimated similarity
+# of title + description, and how far back to look for the original
+TICKET_DUPLICATE_THRESHOLD = 0.6
+TICKET_DUPLICATE_WINDOW = timedelta(days=7)
+
+# closed tickets untouched this long are moved to the archive tables
+# by `manage.py archive_tickets` (tickets/archive.py)
+TICKET_ARCHIVE_AFTER = timedelta(days=90)
+
+# Live ticket events (tickets/events.py)
+# dotted path to a broker class; None keeps fan-out in-process
+TICKET_EVENTS_BROKER = None
+# seconds between SSE keep-alive comments on idle connections
+TICKET_EVENTS_KEEPALIVE = 15
+
 
 AUTH_USER_MODEL = "tickets.CustomUser"
 
 MIDDLEWARE = [
+    # first, so every query of the request is timed
+    'tickets.slowlog.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # before anything that reads or rewrites the response body
+    'tickets.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -65,6 +130,28 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# smaller API responses are sent uncompressed (tickets/middleware.py)
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+
+# Slow-query log (tickets/slowlog.py): statements slower than this are logged and
+# aggregated for `manage.py slow_queries`; None turns the recorder off
+SLOW_QUERY_THRESHOLD_MS = 200
+# capture EXPLAIN (EXPLAIN QUERY PLAN on SQLite) the first time a SELECT shape is slow
+SLOW_QUERY_EXPLAIN = True
+
+# lookup maps of tickets/lookups.py are rebuilt at least this often (seconds), even if
+# a change slipped past the signals that invalidate them
+LOOKUP_MAP_TTL = 300
+
+# Multi-tenancy (tickets/tenancy.py): API requests are scoped to the user's organization.
+# This header, or the subdomain of TENANT_BASE_DOMAIN (acme.resolver.example.com -> acme),
+# may name it too and must then match; superusers use it to pick one. Requests without an
+# organization are rejected as soon as one exists (TENANT_REQUIRED = None), always (True)
+# or never (False, unscoped).
+TENANT_HEADER = 'X-Organization'
+TENANT_BASE_DOMAIN = None
+TENANT_REQUIRED = None
+
 ROOT_URLCONF = 'resolver.urls'
 
 TEMPLATES = [
@@ -95,6 +182,23 @@ DATABASES = {
     }
 }
 
+# Shared cache. Technicians' section sets (tickets/permissions.py), lookup-map versions
+# (tickets/lookups.py), throttle buckets and organization slugs are invalidated through
+# it, so every worker process must use the same cache; Django's default local-memory
+# cache is per process, and the `tickets.E001` check rejects it. Redis when REDIS_URL
+# is set (needs the `redis` package), otherwise files shared by the workers of one host,
+# kept inside this checkout so other checkouts (and their test runs) do not share them.
+if os.environ.get('REDIS_URL'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+    }}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -114,6 +218,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+# The first entry hashes new passwords; compare them with
+# `python manage.py benchmark_hashers`.
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# worker processes used to hash passwords in bulk user imports
+PROVISIONING_HASH_WORKERS = 1
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
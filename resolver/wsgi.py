@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'resolver.settings')
 
 application = get_wsgi_application()
+
+# load the serializers' lookup maps (tickets/lookups.py) before the first request
+from tickets.lookups import warm  # noqa: E402
+
+warm()
@@ -1,9 +1,102 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .models import *
 
 
 
+# Admin helpers for large tables
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Free-text list filter: renders a search box instead of a dropdown of
+    every related row, and filters with a single indexed lookup.
+    """
+    template = 'admin/tickets/input_filter.html'
+    lookup = None
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value().strip()})
+
+    def choices(self, changelist):
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'placeholder': self.placeholder,
+            'hidden_params': [(k, v) for k, v in changelist.params.items()
+                              if k != self.parameter_name],
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class RaisedByFilter(InputFilter):
+    title = 'raised by'
+    parameter_name = 'raised_by'
+    lookup = 'raised_by__username'
+    placeholder = 'username'
+
+
+class AssignedToFilter(InputFilter):
+    title = 'assigned to'
+    parameter_name = 'assigned_to'
+    lookup = 'assigned_to__username'
+    placeholder = 'username'
+
+
+class AuthorFilter(InputFilter):
+    title = 'author'
+    parameter_name = 'author'
+    lookup = 'author__username'
+    placeholder = 'username'
+
+
+class TicketNoFilter(InputFilter):
+    title = 'ticket'
+    parameter_name = 'ticket_no'
+    lookup = 'ticket__ticket_no'
+    placeholder = 'TKT-000001'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner's row estimate for an unfiltered PostgreSQL table
+    instead of COUNT(*), which scans the whole table. Filtered querysets
+    and other databases keep the exact count.
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [self.object_list.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 until the table has been analyzed
+            if row and row[0] >= 0:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for tables with millions of rows."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 # Register your models here.
 
 @admin.register(CustomUser)
@@ -20,33 +113,67 @@ class CustomUserAdmin(UserAdmin):
     search_fields = ("username", "email", "role")
     ordering = ("username",)
 
+# register organizations (tenants)
+@admin.register(Organization)
+class OrganizationAdmin(admin.ModelAdmin):
+    list_display = ("name", "slug")
+    prepopulated_fields = {"slug": ("name",)}
+    search_fields = ("name", "slug")
+
 # register section
 @admin.register(Section)
 class SectionAdmin(admin.ModelAdmin):
     list_display = ("name", "description")
+    search_fields = ("name",)
 
 # register facilities
 @admin.register(Facility)
 class FacilityAdmin(admin.ModelAdmin):
     list_display = ("name", "type", "status", "location")
     list_filter = ("type", "status")
+    search_fields = ("name",)
 
 # register tickets
 @admin.register(Ticket)
-class TicketAdmin(admin.ModelAdmin):
+class TicketAdmin(LargeTableAdmin):
     list_display = ("ticket_no", "title", "description", "section", "facility", "raised_by", "status", "assigned_to", "created_at", "updated_at")
-    list_filter = ("section", "facility", "status", "raised_by", "assigned_to")
-    search_fields = ("title", "facility", "status", "assigned_to__username", "raised_by__username")
+    list_select_related = ("section", "facility", "raised_by", "assigned_to")
+    list_filter = ("status", "section", RaisedByFilter, AssignedToFilter)
+    # case-sensitive exact/prefix lookups: "=" and "^" compare UPPER(...) with LIKE,
+    # which no B-tree index serves. On PostgreSQL, db_index/unique CharFields also get
+    # a varchar_pattern_ops index, so the prefix LIKE on title is indexed too.
+    search_fields = ("ticket_no__exact", "title__startswith",
+                     "assigned_to__username__exact", "raised_by__username__exact")
+    autocomplete_fields = ("section", "facility", "raised_by", "assigned_to")
 
 # register comments
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ("author", "text", "created_at", "ticket")
-    list_filter = ("author", "ticket")
-    search_fields = ("author__username", "text", "ticket__title")
+    list_select_related = ("author", "ticket")
+    list_filter = (AuthorFilter, TicketNoFilter)
+    # comment text is not searched: a substring match scans the whole table
+    search_fields = ("author__username__exact", "ticket__ticket_no__exact", "ticket__title__startswith")
+    autocomplete_fields = ("author", "ticket")
 
 # register feedback
 @admin.register(Feedback)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(LargeTableAdmin):
     list_display = ("rated_by", "rating", "created_at", "ticket")
-    search_fields = ("rated_by__username", "ticket__title")
\ No newline at end of file
+    list_select_related = ("rated_by", "ticket")
+    search_fields = ("rated_by__username__exact", "ticket__ticket_no__exact", "ticket__title__startswith")
+    autocomplete_fields = ("rated_by", "ticket")
+
+# register SLA escalation ladders
+@admin.register(EscalationPolicy)
+class EscalationPolicyAdmin(admin.ModelAdmin):
+    list_display = ("section", "notify_after", "reassign_after", "escalate_after")
+    autocomplete_fields = ("section",)
+
+# register the slow-query log (tickets/slowlog.py)
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ("fingerprint", "calls", "total_ms", "max_ms", "source", "caller", "last_seen")
+    ordering = ("-total_ms",)
+    search_fields = ("sql", "source", "caller")
+    readonly_fields = [field.name for field in SlowQuery._meta.fields]
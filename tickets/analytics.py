@@ -0,0 +1,182 @@
+"""
+Vectorized ticket analytics.
+
+Columns are pulled from the database in bulk with ``values_list`` and kept
+as NumPy arrays; every statistic below is computed with array operations
+(sorting, ``bincount``, ``cumsum``) rather than Python loops over model
+instances, so the cost is dominated by the column fetch.
+
+- resolution time percentiles per section and per technician
+- daily open-ticket backlog
+- feedback rating histograms per section and per technician
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Feedback, Ticket, TicketLog
+
+PERCENTILES = (50, 90, 95)
+RATING_BINS = np.arange(0.5, 6.0, 1.0)  # five 1-star-wide buckets
+NO_GROUP = -1
+DAY = 86400
+
+
+def _epoch(values):
+    return np.fromiter((v.timestamp() for v in values), dtype=np.float64, count=len(values))
+
+
+def _ids(values):
+    return np.fromiter((NO_GROUP if v is None else v for v in values),
+                       dtype=np.int64, count=len(values))
+
+
+def load_tickets(queryset=None):
+    """
+    Return ticket columns as arrays: ``id``, ``section``, ``assignee``
+    (NO_GROUP when unassigned), ``created``, ``resolved`` and ``done``
+    (epoch seconds; NaN while unresolved, respectively while neither
+    resolved nor closed). ``done`` is when the ticket left the backlog:
+    tickets may be closed without ever being resolved. Two queries in total.
+    """
+    queryset = (Ticket.objects.all() if queryset is None else queryset).order_by('id')
+    rows = list(queryset.values_list('id', 'section_id', 'assigned_to_id', 'created_at'))
+    ids, sections, assignees, created = zip(*rows) if rows else ((), (), (), ())
+    frame = {
+        'id': np.array(ids, dtype=np.int64),
+        'section': np.array(sections, dtype=np.int64),
+        'assignee': _ids(assignees),
+        'created': _epoch(created),
+        'resolved': np.full(len(rows), np.nan),
+        'done': np.full(len(rows), np.nan),
+    }
+
+    # first time each ticket was moved to 'resolved', and to either
+    # 'resolved' or 'closed', per the audit log
+    to_resolved = Q(action__endswith=' to resolved')
+    to_done = to_resolved | Q(action__endswith=' to closed')
+    moves = list(
+        TicketLog.objects.filter(to_done, ticket__in=queryset.values('id'))
+        .values('ticket_id')
+        .annotate(resolved=Min('timestamp', filter=to_resolved), done=Min('timestamp'))
+        .values_list('ticket_id', 'resolved', 'done')
+    )
+    if moves:
+        ticket_ids, resolved, done = zip(*moves)
+        positions = np.searchsorted(frame['id'], np.array(ticket_ids, dtype=np.int64))
+        frame['resolved'][positions] = [np.nan if at is None else at.timestamp()
+                                        for at in resolved]
+        frame['done'][positions] = _epoch(done)
+    return frame
+
+
+def load_ratings(queryset=None):
+    """Return ``section``, ``assignee`` and ``rating`` arrays for feedback."""
+    tickets = Ticket.objects.all() if queryset is None else queryset
+    rows = list(
+        Feedback.objects.filter(ticket__in=tickets.values('id'))
+        .values_list('ticket__section_id', 'ticket__assigned_to_id', 'rating')
+    )
+    sections, assignees, ratings = zip(*rows) if rows else ((), (), ())
+    return {
+        'section': np.array(sections, dtype=np.int64),
+        'assignee': _ids(assignees),
+        'rating': np.array(ratings, dtype=np.float64),
+    }
+
+
+def grouped_percentiles(values, groups, percentiles=PERCENTILES):
+    """
+    Linear-interpolated percentiles of ``values`` per distinct ``groups``
+    entry, ignoring NaNs. Returns ``(keys, counts, table)`` where ``table``
+    has one row per key and one column per percentile.
+    """
+    mask = ~np.isnan(values)
+    values, groups = values[mask], groups[mask]
+    if not len(values):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, len(percentiles)))
+
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    keys, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+
+    # fractional rank of each percentile inside each group's sorted run
+    rank = starts[:, None] + (counts[:, None] - 1) * (np.asarray(percentiles) / 100.0)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.ceil(rank).astype(np.int64)
+    weight = rank - lower
+    table = values[lower] * (1 - weight) + values[upper] * weight
+    return keys, counts, table
+
+
+def daily_backlog(created, done, start, end):
+    """
+    Open tickets at the end of each day in ``[start, end)`` (epoch
+    seconds, day aligned); a ticket leaves at its ``done`` time (see
+    ``load_tickets``). Returns ``(day_starts, open_counts)``.
+    """
+    days = int((end - start) // DAY)
+    opened_before = np.count_nonzero(created < start) - np.count_nonzero(done < start)
+
+    def per_day(stamps):
+        stamps = stamps[(stamps >= start) & (stamps < end)]
+        return np.bincount(((stamps - start) // DAY).astype(np.int64), minlength=days)
+
+    # NaN never compares true, so unfinished tickets never leave the backlog
+    backlog = opened_before + np.cumsum(per_day(created) - per_day(done))
+    return start + np.arange(days) * DAY, backlog
+
+
+def grouped_histograms(values, groups, bins=RATING_BINS):
+    """Histogram of ``values`` per group: ``(keys, counts[n_groups, n_bins])``."""
+    n_bins = len(bins) - 1
+    keys, group_index = np.unique(groups, return_inverse=True)
+    bin_index = np.clip(np.digitize(values, bins) - 1, 0, n_bins - 1)
+    flat = np.bincount(group_index * n_bins + bin_index, minlength=len(keys) * n_bins)
+    return keys, flat.reshape(len(keys), n_bins)
+
+
+def _percentile_rows(keys, counts, table, key_name):
+    return [
+        {key_name: None if key == NO_GROUP else int(key), 'tickets': int(count),
+         **{f'p{p}_hours': round(float(v) / 3600, 2) for p, v in zip(PERCENTILES, row)}}
+        for key, count, row in zip(keys, counts, table)
+    ]
+
+
+def _histogram_rows(keys, counts, key_name):
+    return [
+        {key_name: None if key == NO_GROUP else int(key), 'ratings': row.tolist()}
+        for key, row in zip(keys, counts)
+    ]
+
+
+def summarize(queryset=None, days=30):
+    """JSON-ready summary used by the API endpoint and management command."""
+    tickets = load_tickets(queryset)
+    ratings = load_ratings(queryset)
+    seconds = tickets['resolved'] - tickets['created']
+
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = (today + timedelta(days=1)).timestamp()
+    day_starts, backlog = daily_backlog(
+        tickets['created'], tickets['done'], end - days * DAY, end)
+
+    return {
+        'tickets': int(len(tickets['id'])),
+        'resolution_by_section': _percentile_rows(
+            *grouped_percentiles(seconds, tickets['section']), 'section'),
+        'resolution_by_technician': _percentile_rows(
+            *grouped_percentiles(seconds, tickets['assignee']), 'assigned_to'),
+        'backlog': [
+            {'date': datetime.fromtimestamp(day, tz=dt_timezone.utc).date().isoformat(),
+             'open': int(count)}
+            for day, count in zip(day_starts, backlog)
+        ],
+        'rating_histogram_by_section': _histogram_rows(
+            *grouped_histograms(ratings['rating'], ratings['section']), 'section'),
+        'rating_histogram_by_technician': _histogram_rows(
+            *grouped_histograms(ratings['rating'], ratings['assignee']), 'assigned_to'),
+    }
@@ -0,0 +1,70 @@
+"""
+Archival of finished tickets.
+
+``archive_closed`` moves tickets that have been ``closed`` for longer than
+``settings.TICKET_ARCHIVE_AFTER`` out of the live tables, ``batch_size``
+tickets per transaction. Each batch copies the tickets and their comments,
+feedback and logs into the ``Archived*`` tables and deletes the originals,
+so the live ``Ticket`` table only holds active work. Ids and ticket numbers
+are kept, and the API falls back to the archive when a ticket is looked up
+by id or number (see ``TicketDetailView``).
+
+Deleting a ticket through the API archives it the same way, with reason
+``deleted``, rather than destroying its history.
+
+Only models are imported here so the cron command starts quickly.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    ArchivedComment, ArchivedFeedback, ArchivedTicket, ArchivedTicketLog,
+    Comment, Feedback, Ticket, TicketLog,
+)
+
+BATCH_SIZE = 500
+
+TICKET_FIELDS = ['id', 'organization_id', 'ticket_no', 'title', 'description', 'section_id', 'facility_id',
+                 'raised_by_id', 'status', 'created_at', 'updated_at', 'assigned_to_id',
+                 'escalated_to_id', 'version']
+# live model -> (archive model, columns copied)
+DEPENDENTS = [
+    (Comment, ArchivedComment, ['id', 'ticket_id', 'text', 'author_id', 'created_at']),
+    (Feedback, ArchivedFeedback,
+     ['id', 'ticket_id', 'rated_by_id', 'rating', 'comment', 'created_at']),
+    (TicketLog, ArchivedTicketLog,
+     ['id', 'ticket_id', 'action', 'performed_by_id', 'timestamp']),
+]
+
+
+def archive_tickets(queryset, reason):
+    """Move the tickets in ``queryset`` and their dependents to the archive, atomically."""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().values(*TICKET_FIELDS))
+        if not rows:
+            return 0
+        ids = [row['id'] for row in rows]
+        ArchivedTicket.objects.bulk_create(
+            [ArchivedTicket(**row, archived_at=now, archive_reason=reason) for row in rows])
+        for model, archive_model, fields in DEPENDENTS:
+            archive_model.objects.bulk_create(
+                [archive_model(**row) for row in
+                 model.objects.filter(ticket_id__in=ids).order_by().values(*fields)])
+        # dependents go with the tickets through ON DELETE CASCADE
+        Ticket.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_closed(older_than=None, batch_size=BATCH_SIZE):
+    """Archive tickets closed (last updated) more than ``older_than`` ago; returns the count."""
+    cutoff = timezone.now() - (older_than or settings.TICKET_ARCHIVE_AFTER)
+    due = Ticket.objects.filter(status='closed', updated_at__lt=cutoff)
+    archived = 0
+    while True:
+        batch = list(due.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return archived
+        # re-checked under the row locks: a ticket reopened meanwhile stays live
+        archived += archive_tickets(due.filter(id__in=batch), reason='closed')
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# caches that each worker process holds on its own
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    """Invalidation of cached permissions and lookups only reaches other workers through a shared cache."""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f"The default cache ({backend}) is not shared between worker processes.",
+            hint="Configure Redis, Memcached, a database or a file cache in CACHES; "
+                 "see resolver/settings.py.",
+            id='tickets.E001',
+        )]
+    return []
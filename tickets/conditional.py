@@ -0,0 +1,122 @@
+"""
+Conditional request support (ETag / Last-Modified) for ticket endpoints.
+
+Validators are computed with a single indexed query, before the serializer
+runs, so unchanged resources answer 304 Not Modified without loading or
+serializing any rows. A ticket's ETag is its ``version``; lists use
+``updated_at``. ``If-Match`` on PUT/PATCH gives clients optimistic
+concurrency: a stale ETag answers 412, and the version it matched is the
+one the compare-and-swap UPDATE requires (``services.save_ticket_changes``),
+so a write landing between the check and the update answers 409 instead
+of being overwritten. The ETag names the ticket state, not the bytes, so
+the weakened ``W/`` form that compressed responses carry is accepted in
+``If-Match`` too.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def _timestamp(value):
+    return int(value.timestamp() * 1_000_000)
+
+
+class ConditionalResponseMixin:
+    """Shared plumbing: evaluate preconditions, then stamp the validators."""
+
+    def get_validators(self):
+        """Return ``(etag, last_modified)``; ``(None, None)`` skips the check."""
+        raise NotImplementedError
+
+    def representation(self):
+        """
+        ETag suffix for non-JSON renderings (e.g. ``-msgpack``): each wire
+        format of the same data is a distinct representation.
+        """
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if renderer is None or renderer.format == 'json':
+            return ''
+        return f"-{renderer.format}"
+
+    def conditional(self, handler, request, *args, **kwargs):
+        if_match = request.META.get('HTTP_IF_MATCH')
+        if if_match:
+            # strong comparison would reject the W/ tag of a compressed GET
+            request.META['HTTP_IF_MATCH'] = if_match.replace('W/', '')
+        etag, last_modified = self.get_validators()
+        if etag is not None:
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        response = handler(request, *args, **kwargs)
+
+        if request.method not in ('GET', 'HEAD'):
+            # validators changed with the write; hand the client the new ones
+            etag, last_modified = self.get_validators()
+        if etag is not None and 200 <= response.status_code < 300:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class ConditionalDetailMixin(ConditionalResponseMixin):
+    """ETag for a single ticket, derived from its ``version``."""
+
+    # the version the validators were computed from, and whether If-Match named it
+    validated_version = None
+    if_match = False
+
+    def get_validators(self):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        row = (self.get_queryset()
+               .filter(**{self.lookup_field: lookup})
+               .values_list('version', 'updated_at')
+               .first())
+        if row is None:
+            return None, None
+        self.validated_version, updated_at = row
+        etag = f"{lookup}-v{self.validated_version}{self.representation()}"
+        return quote_etag(etag), updated_at.timestamp()
+
+    def matched_version(self):
+        """The version ``If-Match`` was checked against, or None without one."""
+        return self.validated_version if self.if_match else None
+
+    def conditional(self, handler, request, *args, **kwargs):
+        self.if_match = bool(request.META.get('HTTP_IF_MATCH'))
+        return super().conditional(handler, request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return self.conditional(super().get, request, *args, **kwargs)
+
+    def put(self, request, *args, **kwargs):
+        return self.conditional(super().put, request, *args, **kwargs)
+
+    def patch(self, request, *args, **kwargs):
+        return self.conditional(super().patch, request, *args, **kwargs)
+
+
+class ConditionalListMixin(ConditionalResponseMixin):
+    """
+    ETag for a (filtered) ticket list: the newest ``updated_at`` plus the
+    row count, so creates, edits and deletes all change it.
+    """
+
+    def get_validators(self):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        stats = queryset.aggregate(last=Max('updated_at'), count=Count('id'))
+        if stats['last'] is None:
+            return None, None
+        digest = hashlib.md5(
+            f"{self.request.GET.urlencode()}|{stats['count']}|{_timestamp(stats['last'])}".encode(),
+            usedforsecurity=False,
+        ).hexdigest()
+        return quote_etag(digest + self.representation()), stats['last'].timestamp()
+
+    def get(self, request, *args, **kwargs):
+        return self.conditional(super().get, request, *args, **kwargs)
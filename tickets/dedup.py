@@ -0,0 +1,80 @@
+"""
+Near-duplicate detection for new tickets.
+
+Each ticket stores a MinHash signature of its title and description
+(``Ticket.signature``): 64 minimum hashes over character 4-gram shingles,
+packed as little-endian uint32. The fraction of positions where two
+signatures agree estimates the Jaccard similarity of their shingle sets,
+so "Leaking pipe in block A" and "pipe leaking, block A" match while
+unrelated reports on the same facility do not.
+
+A new report is compared against the signatures of recent unfinished
+tickets for the same facility and section, fetched with one query on the
+``(organization, facility, section, created_at)`` index and scored in one
+vectorized NumPy pass. The query always names the facility's
+organization, so callers without a current tenant (single-tenant
+deployments, workers) use that index too.
+"""
+import re
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Ticket
+
+NUM_HASHES = 64
+SHINGLE_SIZE = 4
+# tickets that are still being worked on can absorb duplicate reports
+ACTIVE_STATUSES = ('open', 'assigned', 'in_progress', 'pending')
+
+_PRIME = (1 << 31) - 1
+# fixed seed: stored signatures are only comparable under the same hash family
+_rng = np.random.default_rng(1729)
+_A = _rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64)
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def shingles(text):
+    """Character shingles of the text, lowercased with punctuation folded to spaces."""
+    text = _NON_WORD.sub(' ', text.lower()).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(title, description):
+    """MinHash signature of a report, as bytes for ``Ticket.signature``."""
+    grams = shingles(f"{title} {description or ''}")
+    hashes = np.fromiter((zlib.crc32(g.encode()) for g in grams),
+                         dtype=np.uint64, count=len(grams)) % _PRIME
+    # (a * h + b) mod p for every hash function at once; a, h < 2**31 cannot overflow
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype('<u4').tobytes()
+
+
+def similarity(sig, others):
+    """Estimated Jaccard similarity of ``sig`` to each signature in ``others``."""
+    if not others:
+        return np.empty(0)
+    matrix = np.frombuffer(b''.join(others), dtype='<u4').reshape(len(others), NUM_HASHES)
+    return (matrix == np.frombuffer(sig, dtype='<u4')).mean(axis=1)
+
+
+def find_duplicate(facility, section_id, sig):
+    """Return the id of the most similar recent active ticket, or None."""
+    since = timezone.now() - settings.TICKET_DUPLICATE_WINDOW
+    candidates = list(Ticket.objects.filter(
+        # tickets share their facility's organization; naming it matches the index
+        organization_id=facility.organization_id,
+        facility_id=facility.id, section_id=section_id, created_at__gte=since,
+        status__in=ACTIVE_STATUSES, signature__isnull=False,
+    ).values_list('id', 'signature'))
+    if not candidates:
+        return None
+    scores = similarity(sig, [bytes(s) for _, s in candidates])
+    best = int(scores.argmax())
+    if scores[best] >= settings.TICKET_DUPLICATE_THRESHOLD:
+        return candidates[best][0]
+    return None
@@ -0,0 +1,219 @@
+"""
+SLA escalation ladders.
+
+A section's ``EscalationPolicy`` has up to three steps, each measured from
+ticket creation:
+
+- ``notify``: log and publish an ``sla_notify`` event for the assignee
+- ``reassign``: move the ticket to the least-loaded other technician of
+  its section (``open`` tickets become ``assigned``, through the
+  transition table)
+- ``escalate``: set ``escalated_to`` to the least-loaded manager
+
+``schedule`` writes one ``EscalationTimer`` row per step when a ticket is
+created. ``reschedule`` rebuilds a section's timers when its policy is
+saved or deleted (see ``signals.py``), which also covers tickets created
+before the policy existed; steps a ticket's log shows as already fired are
+not repeated. ``run_due`` pops the timers whose ``fire_at`` has passed, through
+the ``fire_at`` index, in batches. It applies each step to the whole batch
+with bulk UPDATEs and one bulk insert of TicketLog rows. Timers of tickets
+that were resolved or closed meanwhile are simply dropped. Work therefore
+grows with the number of due timers, not with the number of open tickets.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import transitions
+from .events import publish_ticket_event
+from .models import CustomUser, EscalationPolicy, EscalationTimer, Ticket, TicketLog
+
+BATCH_SIZE = 500
+STEPS = ('notify', 'reassign', 'escalate')
+# a ladder only runs while someone still has to act on the ticket
+ACTIVE_STATUSES = ('open', 'assigned', 'in_progress', 'pending')
+# how each step's TicketLog entry starts; tells reschedule which steps fired
+LOG_ACTIONS = {
+    'notify': "SLA: no resolution yet",
+    'reassign': "SLA: reassigned",
+    'escalate': "SLA: escalated",
+}
+
+
+def _delays(policy):
+    """``(step, delay)`` for the steps ``policy`` uses, in ladder order."""
+    return [(step, getattr(policy, f'{step}_after')) for step in STEPS
+            if getattr(policy, f'{step}_after') is not None]
+
+
+def schedule(ticket):
+    """Create the timers of ``ticket``'s section ladder, if it has one."""
+    policy = EscalationPolicy.objects.filter(section_id=ticket.section_id).first()
+    if policy is None:
+        return []
+    timers = [EscalationTimer(ticket=ticket, step=step, fire_at=ticket.created_at + delay)
+              for step, delay in _delays(policy)]
+    return EscalationTimer.objects.bulk_create(timers)
+
+
+def reschedule(section_id):
+    """
+    Replace the timers of the section's active tickets with ones from its
+    current policy (none if it has no policy), skipping steps that already
+    fired. Steps whose time has passed fire on the worker's next run.
+    Returns the number of timers written.
+    """
+    policy = EscalationPolicy.objects.filter(section_id=section_id).first()
+    with transaction.atomic():
+        EscalationTimer.objects.filter(ticket__section_id=section_id).delete()
+        if policy is None:
+            return 0
+        active = Ticket.objects.filter(section_id=section_id, status__in=ACTIVE_STATUSES)
+        fired = defaultdict(set)
+        for ticket_id, action in TicketLog.objects.filter(
+                ticket__in=active, action__startswith="SLA: ").values_list('ticket_id', 'action'):
+            fired[ticket_id].update(step for step, prefix in LOG_ACTIONS.items()
+                                    if action.startswith(prefix))
+        delays = _delays(policy)
+        timers = [EscalationTimer(ticket_id=ticket_id, step=step, fire_at=created_at + delay)
+                  for ticket_id, created_at in active.values_list('id', 'created_at')
+                  for step, delay in delays if step not in fired[ticket_id]]
+        EscalationTimer.objects.bulk_create(timers, batch_size=BATCH_SIZE)
+    return len(timers)
+
+
+def _pick(loads, exclude=None):
+    """Least-loaded user id in ``{user id: active tickets}``, counted as one more ticket."""
+    candidates = [pk for pk in loads if pk != exclude]
+    if not candidates:
+        return None
+    pk = min(candidates, key=lambda k: (loads[k], k))
+    loads[pk] += 1
+    return pk
+
+
+def _notify(tickets, now):
+    logs = [TicketLog(ticket_id=t.id, action=f"{LOG_ACTIONS['notify']}, assignee notified")
+            for t in tickets]
+    return logs, {t.id: 'sla_notify' for t in tickets}
+
+
+def _reassign(tickets, now):
+    """Spread the batch over each section's technicians, least loaded first."""
+    new_assignee, names = {}, {}
+    for section_id in {t.section_id for t in tickets}:
+        technicians = CustomUser.objects.filter(
+            role='technician', is_active=True, sections_specialized_in=section_id,
+        ).annotate(load=Count('assigned_tickets', filter=Q(
+            assigned_tickets__status__in=ACTIVE_STATUSES)))
+        loads = {}
+        for technician in technicians:
+            loads[technician.pk] = technician.load
+            names[technician.pk] = technician.username
+        for ticket in tickets:
+            if ticket.section_id == section_id:
+                pk = _pick(loads, exclude=ticket.assigned_to_id)
+                if pk is not None:
+                    new_assignee[ticket.id] = pk
+
+    # an open ticket that gets an assignee moves on to 'assigned'; the others
+    # keep their status. Each UPDATE re-checks the source status.
+    groups, logs = defaultdict(list), []
+    for ticket in tickets:
+        if ticket.id not in new_assignee:
+            continue
+        target = ticket.status
+        if ticket.status == 'open':
+            target = transitions.validate('open', 'assigned', has_assignee=True).target
+            logs.append(TicketLog(ticket_id=ticket.id,
+                                  action=f"Status changed from open to {target}"))
+        groups[new_assignee[ticket.id], ticket.status, target].append(ticket.id)
+    for (user_id, source, target), ids in groups.items():
+        Ticket.objects.filter(id__in=ids, status=source).update(
+            assigned_to_id=user_id, status=target,
+            updated_at=now, version=F('version') + 1)
+
+    logs += [TicketLog(ticket_id=ticket_id,
+                       action=f"{LOG_ACTIONS['reassign']} to {names[user_id]}")
+             for ticket_id, user_id in new_assignee.items()]
+    return logs, {ticket_id: 'sla_reassigned' for ticket_id in new_assignee}
+
+
+def _escalate(tickets, now):
+    """Each ticket goes to a manager of its own organization, least loaded first."""
+    by_manager, names = defaultdict(list), {}
+    for organization_id in {t.organization_id for t in tickets}:
+        managers = CustomUser.unscoped.filter(
+            role='manager', is_active=True, organization_id=organization_id,
+        ).annotate(load=Count('escalated_tickets', filter=Q(
+            escalated_tickets__status__in=ACTIVE_STATUSES)))
+        loads = {}
+        for manager in managers:
+            loads[manager.pk] = manager.load
+            names[manager.pk] = manager.username
+        for ticket in tickets:
+            if ticket.organization_id == organization_id and ticket.escalated_to_id is None:
+                pk = _pick(loads)
+                if pk is not None:
+                    by_manager[pk].append(ticket.id)
+    for manager_id, ids in by_manager.items():
+        Ticket.objects.filter(id__in=ids).update(
+            escalated_to_id=manager_id, updated_at=now, version=F('version') + 1)
+
+    logs = [TicketLog(ticket_id=ticket_id,
+                      action=f"{LOG_ACTIONS['escalate']} to {names[manager_id]}")
+            for manager_id, ids in by_manager.items() for ticket_id in ids]
+    return logs, {log.ticket_id: 'sla_escalated' for log in logs}
+
+
+APPLY = {'notify': _notify, 'reassign': _reassign, 'escalate': _escalate}
+
+
+def run_batch(batch_size=BATCH_SIZE, now=None):
+    """
+    Pop up to ``batch_size`` due timers and apply them in one transaction.
+    Returns ``(timers popped, {step: tickets changed})``.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        timers = list(EscalationTimer.objects.select_for_update(skip_locked=True)
+                      .filter(fire_at__lte=now).order_by('fire_at')
+                      .values_list('id', 'ticket_id', 'step')[:batch_size])
+        if not timers:
+            return 0, {}
+        EscalationTimer.objects.filter(id__in=[pk for pk, _, _ in timers]).delete()
+
+        ids_by_step = defaultdict(list)
+        for _, ticket_id, step in timers:
+            ids_by_step[step].append(ticket_id)
+        # timers of resolved or closed tickets are dropped here
+        live = {t.id: t for t in Ticket.objects.filter(
+            id__in={ticket_id for _, ticket_id, _ in timers}, status__in=ACTIVE_STATUSES,
+        ).only('id', 'organization', 'section', 'status', 'assigned_to', 'escalated_to')}
+
+        done, logs, events = {}, [], {}
+        for step in STEPS:  # ladder order, should several steps fall due together
+            tickets = [live[i] for i in ids_by_step.get(step, []) if i in live]
+            if tickets:
+                step_logs, step_events = APPLY[step](tickets, now)
+                logs.extend(step_logs)
+                events.update(step_events)
+                done[step] = len(step_events)
+        TicketLog.objects.bulk_create(logs)
+        for ticket in Ticket.objects.filter(id__in=events).only(
+                'id', 'ticket_no', 'status', 'section', 'assigned_to', 'organization'):
+            publish_ticket_event(events[ticket.id], ticket)
+    return len(timers), done
+
+
+def run_due(batch_size=BATCH_SIZE):
+    """Drain every due timer, batch by batch; returns tickets changed per step."""
+    totals = dict.fromkeys(STEPS, 0)
+    while True:
+        popped, done = run_batch(batch_size)
+        if not popped:
+            return totals
+        for step, count in done.items():
+            totals[step] += count
@@ -0,0 +1,112 @@
+"""
+In-process publish/subscribe for live ticket updates.
+
+The service layer publishes ticket events (created, assigned, status) and
+the SSE view in ``views.py`` streams them to subscribers. Each subscriber
+owns an ``asyncio.Queue`` bound to the event loop it was created on, so an
+idle connection costs one queue and one suspended coroutine, which lets a
+single ASGI worker hold thousands of them.
+
+The default broker fans out inside the current process. A different broker
+(e.g. one backed by a local pub/sub daemon) can be plugged in through the
+``TICKET_EVENTS_BROKER`` setting as long as it exposes ``publish`` and
+``subscribe``/``unsubscribe`` with the same signatures.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """A single listener with optional organization/section/assignee filters."""
+
+    def __init__(self, section=None, assigned_to=None, organization=None, maxsize=100):
+        self.section = section
+        self.assigned_to = assigned_to
+        self.organization = organization
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def matches(self, event):
+        if self.organization is not None and event.get('organization') != self.organization:
+            return False
+        if self.section is not None and event.get('section') != self.section:
+            return False
+        if self.assigned_to is not None and event.get('assigned_to') != self.assigned_to:
+            return False
+        return True
+
+    def _put(self, event):
+        # slow consumers drop events instead of growing memory unbounded
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def deliver(self, event):
+        """Thread-safe hand-off onto the subscriber's event loop."""
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class InProcessBroker:
+    """Fans events out to every subscription in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, section=None, assigned_to=None, organization=None):
+        subscription = Subscription(section=section, assigned_to=assigned_to,
+                                    organization=organization)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.deliver(event)
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the process-wide broker, building it on first use."""
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'TICKET_EVENTS_BROKER', None)
+        _broker = import_string(path)() if path else InProcessBroker()
+    return _broker
+
+
+def ticket_event(event_type, ticket):
+    """Build the payload pushed to subscribers for a ticket change."""
+    return {
+        'event': event_type,
+        'ticket': ticket.id,
+        'ticket_no': ticket.ticket_no,
+        'status': ticket.status,
+        'section': ticket.section_id,
+        'assigned_to': ticket.assigned_to_id,
+        'organization': ticket.organization_id,
+    }
+
+
+def publish_ticket_event(event_type, ticket):
+    """Publish once the surrounding transaction commits."""
+    event = ticket_event(event_type, ticket)
+    transaction.on_commit(lambda: get_broker().publish(event))
@@ -0,0 +1,151 @@
+"""
+``Idempotency-Key`` support for create endpoints.
+
+A POST carrying the header is recorded in ``IdempotencyKey`` before the
+view runs and completed with its response afterwards. A retry with the same
+key is answered from the stored response (one read on the unique
+``(owner, key)`` index) without calling the service again. Only successful
+responses are kept: if the first attempt fails, its row is dropped and the
+client may retry with the same key.
+
+- same key, different request body or endpoint -> 422
+- same key while the first request is still running -> 409; a key left in
+  flight for longer than ``settings.IDEMPOTENCY_IN_FLIGHT_LEASE`` (its
+  worker died) is taken over by the retry
+- rows older than ``settings.IDEMPOTENCY_KEY_TTL`` count as absent and are
+  deleted by ``manage.py purge_idempotency_keys``
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed.'
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def expiry_cutoff():
+    return timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+
+
+def lease_cutoff():
+    return timezone.now() - settings.IDEMPOTENCY_IN_FLIGHT_LEASE
+
+
+def client_address(request):
+    """
+    REMOTE_ADDR, or the address the trusted proxies recorded in
+    X-Forwarded-For when ``REST_FRAMEWORK['NUM_PROXIES']`` says there are
+    any; otherwise the header is client-supplied and could be anything.
+    """
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    num_proxies = api_settings.NUM_PROXIES
+    if num_proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[-min(num_proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR')
+
+
+def request_owner(request):
+    if request.user and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"anon:{client_address(request)}"
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):  # QueryDict from a form post
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def begin(owner, key, fingerprint):
+    """
+    Claim ``key`` for a new request. Returns ``(record, None)`` for a
+    first attempt or ``(None, stored)`` for a replay.
+    """
+    try:
+        stored = IdempotencyKey.objects.get(owner=owner, key=key)
+    except IdempotencyKey.DoesNotExist:
+        stored = None
+    if stored is not None and (
+            stored.created_at < expiry_cutoff()
+            # in flight past its lease: the worker running it is gone
+            or stored.status_code is None and stored.created_at < lease_cutoff()):
+        stored.delete()
+        stored = None
+    if stored is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    owner=owner, key=key, fingerprint=fingerprint), None
+        except IntegrityError:
+            # a concurrent retry claimed it first
+            stored = IdempotencyKey.objects.get(owner=owner, key=key)
+    if stored.fingerprint != fingerprint:
+        raise KeyReused()
+    if stored.status_code is None:
+        raise KeyInUse()
+    return None, stored
+
+
+def finish(record, response):
+    record.status_code = response.status_code
+    record.body = json.dumps(response.data, cls=JSONEncoder, separators=(',', ':'))
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=record.status_code, body=record.body)
+
+
+def replay(stored):
+    data = json.loads(stored.body) if stored.body else None
+    return Response(data, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+class IdempotentCreateMixin:
+    """
+    Honour ``Idempotency-Key`` on POST. Wraps ``post`` rather than
+    ``create`` so a view's own ``create`` override is covered too.
+    """
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return super().post(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f'Must be at most {MAX_KEY_LENGTH} characters.'})
+
+        record, stored = begin(request_owner(request), key, request_fingerprint(request))
+        if stored is not None:
+            return replay(stored)
+        try:
+            response = super().post(request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if status.is_success(response.status_code):
+            finish(record, response)
+        else:
+            record.delete()
+        return response
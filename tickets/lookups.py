@@ -0,0 +1,101 @@
+"""
+Process-local lookup maps for the relations ticket writes validate.
+
+``TicketSerializer`` resolves ``section_id``, ``facility_id`` and
+``assigned_to_id`` (a technician's username) from these maps instead of one
+query each. A map holds every row of its kind for one tenant (see
+``tenancy.py``; unscoped code gets a map of all rows) and is built with a
+single query the first time it is needed. ``warm()`` builds all of them up
+front and is called when a WSGI/ASGI worker starts.
+
+Invalidation works like the section cache in ``permissions.py``: every kind
+has a version token in Django's cache, and each map remembers the token it
+was built under. ``signals.py`` replaces the token when a section, facility
+or user is saved or deleted, so every process rebuilds that kind on its
+next lookup. Checking the token is one cache read, never a query. The
+token only reaches other processes through a shared cache (``CACHES`` in
+settings, enforced by the ``tickets.E001`` check). As a backstop for
+changes no signal sees (``bulk_create``, ``update()``, raw SQL), a map is
+also rebuilt once it is older than ``settings.LOOKUP_MAP_TTL`` seconds.
+
+Lookups return copies, so requests never share model instances.
+"""
+import copy
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from .models import CustomUser, Facility, Section
+from .tenancy import current_tenant
+
+# kind -> (model, key field, filter)
+KINDS = {
+    'section': (Section, 'pk', {}),
+    'facility': (Facility, 'pk', {}),
+    'technician': (CustomUser, 'username', {'role': 'technician', 'is_active': True}),
+}
+
+# (kind, tenant id or None) -> (version token, built at, {key: instance})
+_maps = {}
+
+
+def _version_key(kind):
+    return f'tickets:lookups-version:{kind}'
+
+
+def _version(kind):
+    return cache.get_or_set(_version_key(kind), uuid.uuid4().hex, None)
+
+
+def _index(kind, rows):
+    field = KINDS[kind][1]
+    return {getattr(row, field): row for row in rows}
+
+
+def _fresh(entry, version):
+    return (entry is not None and entry[0] == version
+            and time.monotonic() - entry[1] < settings.LOOKUP_MAP_TTL)
+
+
+def get(kind, key):
+    """The ``kind`` row with ``key`` in the current tenant, or None."""
+    tenant = current_tenant()
+    slot = (kind, tenant.pk if tenant is not None else None)
+    version = _version(kind)
+    entry = _maps.get(slot)
+    if not _fresh(entry, version):
+        model, _, filters = KINDS[kind]
+        # the default manager scopes this to the current tenant
+        entry = _maps[slot] = (version, time.monotonic(),
+                               _index(kind, model.objects.filter(**filters)))
+    row = entry[2].get(key)
+    return copy.copy(row) if row is not None else None
+
+
+def invalidate(kind):
+    """Make every process rebuild ``kind`` on its next lookup."""
+    cache.set(_version_key(kind), uuid.uuid4().hex, None)
+
+
+def warm():
+    """Build every map, for every tenant, with one query per kind."""
+    for kind, (model, _, filters) in KINDS.items():
+        version = _version(kind)
+        try:
+            rows = list(model.unscoped.filter(**filters))
+        except DatabaseError:
+            # e.g. not migrated yet: maps are then built on first use
+            return
+        built = time.monotonic()
+        by_tenant = defaultdict(list)
+        for row in rows:
+            by_tenant[row.organization_id].append(row)
+        # tenants without rows are built on first use
+        for organization_id, tenant_rows in by_tenant.items():
+            if organization_id is not None:
+                _maps[(kind, organization_id)] = (version, built, _index(kind, tenant_rows))
+        _maps[(kind, None)] = (version, built, _index(kind, rows))
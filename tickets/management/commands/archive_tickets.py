@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# models and the archive mover only, like sweep_overdue
+from tickets.archive import BATCH_SIZE, archive_closed
+from tickets.slowlog import recording
+
+
+class Command(BaseCommand):
+    help = (
+        "Move tickets closed longer than TICKET_ARCHIVE_AFTER, with their comments, "
+        "feedback and logs, to the archive tables in batched transactions."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float,
+                            default=settings.TICKET_ARCHIVE_AFTER.total_seconds() / 86400,
+                            help="Archive tickets closed more than this many days ago.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with recording('archive_tickets'):
+            archived = archive_closed(timedelta(days=options['days']), options['batch_size'])
+        self.stdout.write(f"{archived} closed tickets archived "
+                          f"in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from tickets import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the vectorized analytics kernels on synthetic columns "
+        "(default 1M tickets), against a plain Python loop for reference."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=1_000_000)
+        parser.add_argument('--sections', type=int, default=20)
+        parser.add_argument('--technicians', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _time(self, label, func):
+        started = time.perf_counter()
+        func()
+        self.stdout.write(f"{label:<40}{(time.perf_counter() - started) * 1000:>10.1f} ms")
+
+    def handle(self, *args, **options):
+        n = options['tickets']
+        rng = np.random.default_rng(options['seed'])
+        end = time.time() // analytics.DAY * analytics.DAY
+        start = end - 365 * analytics.DAY
+        created = rng.uniform(start, end, n)
+        resolved = created + rng.exponential(36 * 3600, n)
+        resolved[rng.random(n) < 0.1] = np.nan  # still open
+        sections = rng.integers(0, options['sections'], n)
+        assignees = rng.integers(0, options['technicians'], n)
+        ratings = rng.integers(1, 6, n).astype(np.float64)
+        seconds = resolved - created
+
+        self.stdout.write(f"{n} synthetic tickets")
+        self._time("percentiles by section", lambda: analytics.grouped_percentiles(seconds, sections))
+        self._time("percentiles by technician", lambda: analytics.grouped_percentiles(seconds, assignees))
+        self._time("daily backlog (365 days)", lambda: analytics.daily_backlog(created, resolved, start, end))
+        self._time("rating histograms by technician", lambda: analytics.grouped_histograms(ratings, assignees))
+
+        def python_loop():
+            by_section = {}
+            for section, value in zip(sections.tolist(), seconds.tolist()):
+                if value == value:  # skip NaN
+                    by_section.setdefault(section, []).append(value)
+            for values in by_section.values():
+                values.sort()
+                values[len(values) // 2]
+
+        self._time("reference: python median by section", python_loop)
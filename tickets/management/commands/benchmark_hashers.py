@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers, make_password
+from django.core.management.base import BaseCommand
+
+from tickets import services
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure accounts/second for each hasher in settings.PASSWORD_HASHERS, "
+        "for the unusable-password (invite) path and for process-pool hashing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50,
+                            help="Passwords hashed per measurement.")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Process pool size for the parallel measurement.")
+
+    def _rate(self, count, func):
+        started = time.perf_counter()
+        func()
+        return count / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        passwords = [f"correct-horse-{i}" for i in range(count)]
+        self.stdout.write(f"{'hasher':<45}{'accounts/s':>12}")
+
+        for hasher in get_hashers():
+            try:
+                make_password('warm-up', hasher=hasher.algorithm)
+            except ValueError:
+                # optional library (argon2-cffi, bcrypt) not installed
+                self.stdout.write(f"{hasher.algorithm:<45}{'unavailable':>12}")
+                continue
+            rate = self._rate(count, lambda: [
+                make_password(p, hasher=hasher.algorithm) for p in passwords])
+            self.stdout.write(f"{hasher.algorithm:<45}{rate:>12.1f}")
+
+        workers = options['workers']
+        rate = self._rate(count, lambda: services.hash_passwords(passwords, workers=workers))
+        label = f"{settings.PASSWORD_HASHERS[0].rsplit('.', 1)[-1]} x{workers} processes"
+        self.stdout.write(f"{label:<45}{rate:>12.1f}")
+
+        rate = self._rate(count, lambda: services.hash_passwords([None] * count, workers=1))
+        self.stdout.write(f"{'unusable password (invite)':<45}{rate:>12.1f}")
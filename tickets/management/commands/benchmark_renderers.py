@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from tickets import renderers
+
+
+def ticket_payload(i, rng, now):
+    """One row shaped like TicketSerializer output, with a few comments."""
+    created = now - timedelta(minutes=rng.randrange(60 * 24 * 90))
+    ticket = {'id': i, 'ticket_no': f"TKT-{i:06d}"}
+    technician = {'id': 1000 + i % 50, 'username': f"tech.{i % 50}", 'first_name': 'Tech',
+                  'last_name': str(i % 50), 'email': f"tech{i % 50}@example.com",
+                  'role': 'technician'}
+    return {
+        **ticket,
+        'title': f"Leaking pipe in block {chr(ord('A') + i % 26)}",
+        'description': "Water is leaking from the pipe under the sink " * 3,
+        'status': rng.choice(['open', 'assigned', 'in_progress', 'resolved']),
+        'section': f"Section {i % 20}",
+        'facility': f"Facility {i % 40}",
+        'raised_by': f"user.{i % 500}",
+        'assigned_to': technician,
+        'created_at': created.isoformat(),
+        'updated_at': (created + timedelta(hours=3)).isoformat(),
+        'comments': [{'id': i * 10 + c, 'ticket': ticket, 'text': "Checked, parts ordered.",
+                      'author': technician['username'], 'created_at': created.isoformat()}
+                     for c in range(rng.randrange(4))],
+        'feedback': None,
+        'version': rng.randrange(5),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare render time and payload size of DRF's JSON renderer, the "
+        "orjson renderer and the MessagePack renderer on ticket-list payloads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        candidates = [('drf json', JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(('orjson', renderers.ORJSONRenderer()))
+        else:
+            self.stdout.write("orjson not installed: skipping ORJSONRenderer")
+        if renderers.msgpack is not None:
+            candidates.append(('msgpack', renderers.MessagePackRenderer()))
+        else:
+            self.stdout.write("msgpack not installed: skipping MessagePackRenderer")
+
+        rng = random.Random(options['seed'])
+        now = datetime.now(timezone.utc)
+        self.stdout.write(f"{'rows':>7}  {'renderer':<10}{'median ms':>11}{'bytes':>12}{'vs drf':>9}")
+        for rows in options['rows']:
+            data = ReturnList([ticket_payload(i, rng, now) for i in range(1, rows + 1)],
+                              serializer=None)
+            baseline = None
+            for name, renderer in candidates:
+                timings = []
+                for _ in range(max(1, options['repeat'])):
+                    started = time.perf_counter()
+                    body = renderer.render(data, renderer.media_type, {})
+                    timings.append(time.perf_counter() - started)
+                median = statistics.median(timings) * 1000
+                baseline = baseline or median
+                self.stdout.write(f"{rows:>7}  {name:<10}{median:>11.2f}{len(body):>12}"
+                                  f"{baseline / median:>8.1f}x")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from tickets import dedup
+from tickets.models import Ticket
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute duplicate-detection signatures for tickets that have none "
+        "(tickets created before tickets/dedup.py, or by bulk imports)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute every signature, not just missing ones.")
+
+    def handle(self, *args, **options):
+        tickets = Ticket.objects.order_by('id').only('id', 'title', 'description')
+        if not options['all']:
+            tickets = tickets.filter(signature__isnull=True)
+        batch, done = [], 0
+        for ticket in tickets.iterator(chunk_size=options['batch_size']):
+            ticket.signature = dedup.signature(ticket.title, ticket.description)
+            batch.append(ticket)
+            if len(batch) == options['batch_size']:
+                Ticket.objects.bulk_update(batch, ['signature'])
+                done += len(batch)
+                batch = []
+        Ticket.objects.bulk_update(batch, ['signature'])
+        done += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"{done} ticket signatures written"))
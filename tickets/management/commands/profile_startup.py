@@ -0,0 +1,75 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def parse_importtime(stderr):
+    """Yield ``(module, self_us, cumulative_us)`` from ``-X importtime`` output."""
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        yield module.strip(), int(self_us), int(cumulative_us)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the cold start of another management command and show where "
+        "its import time goes, using `python -X importtime`. "
+        "Example: manage.py profile_startup sweep_overdue --dry-run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Cold starts to time; the median is reported.")
+        parser.add_argument('--top', type=int, default=15,
+                            help="Packages/modules to list.")
+        parser.add_argument('target', help="Management command to start.")
+        parser.add_argument('target_args', nargs=argparse.REMAINDER,
+                            help="Arguments passed to the command.")
+
+    def _run(self, argv, importtime=False):
+        flags = ['-X', 'importtime'] if importtime else []
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, *flags, str(settings.BASE_DIR / 'manage.py'), *argv],
+            capture_output=True, text=True, env=os.environ.copy())
+        elapsed = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise CommandError(completed.stderr.strip().splitlines()[-1:] or completed.returncode)
+        return elapsed, completed.stderr
+
+    def handle(self, *args, **options):
+        argv = [options['target'], *options['target_args']]
+        timings = [self._run(argv)[0] for _ in range(max(1, options['repeat']))]
+        _, stderr = self._run(argv, importtime=True)
+
+        modules = list(parse_importtime(stderr))
+        by_package = defaultdict(int)
+        for module, self_us, _ in modules:
+            by_package[module.split('.')[0]] += self_us
+
+        top = options['top']
+        self.stdout.write(f"cold start of `{' '.join(argv)}`: "
+                          f"median {statistics.median(timings) * 1000:.0f} ms, "
+                          f"min {min(timings) * 1000:.0f} ms over {len(timings)} runs")
+        self.stdout.write(f"{len(modules)} modules imported, "
+                          f"{sum(by_package.values()) / 1000:.0f} ms total import time")
+
+        self.stdout.write("\nimport time by top-level package:")
+        for package, self_us in sorted(by_package.items(), key=lambda i: -i[1])[:top]:
+            self.stdout.write(f"  {self_us / 1000:>8.1f} ms  {package}")
+
+        self.stdout.write("\nslowest modules (cumulative, including their imports):")
+        project = {'tickets', 'resolver'}
+        slowest = sorted((m for m in modules if m[0].split('.')[0] in project),
+                         key=lambda m: -m[2])[:top]
+        for module, _, cumulative_us in slowest:
+            self.stdout.write(f"  {cumulative_us / 1000:>8.1f} ms  {module}")
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+# models and the escalation ladder only, like sweep_overdue
+from tickets.escalation import BATCH_SIZE, STEPS, reschedule, run_due
+from tickets.models import EscalationPolicy, EscalationTimer
+from tickets.slowlog import recording
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply due SLA escalation timers (notify, reassign, escalate) in batches. "
+        "Runs as a worker polling every --interval seconds, or once with --once. "
+        "--reschedule first rebuilds every section's timers from its policy."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the due timers once and exit (for cron).")
+        parser.add_argument('--interval', type=float, default=60,
+                            help="Seconds to sleep when no timer is due.")
+        parser.add_argument('--reschedule', action='store_true',
+                            help="Rebuild all timers from the policies first, e.g. after "
+                                 "policies were changed with bulk updates.")
+
+    def handle(self, *args, **options):
+        if options['reschedule']:
+            # sections with a policy, and those left with timers of a deleted one
+            sections = {*EscalationPolicy.objects.values_list('section_id', flat=True),
+                        *EscalationTimer.objects.values_list('ticket__section_id', flat=True)
+                        .distinct()}
+            written = sum(reschedule(section_id) for section_id in sections)
+            self.stdout.write(f"{written} timers rescheduled")
+        while True:
+            started = time.perf_counter()
+            with recording('run_escalations'):
+                done = run_due(options['batch_size'])
+            if any(done.values()) or options['once']:
+                summary = ', '.join(f"{done[step]} {step}" for step in STEPS)
+                self.stdout.write(f"{summary} in {time.perf_counter() - started:.2f}s")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
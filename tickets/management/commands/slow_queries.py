@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+# models only, like sweep_overdue
+from tickets.models import SlowQuery
+
+ORDERINGS = {
+    'total': F('total_ms').desc(),
+    'max': F('max_ms').desc(),
+    'calls': F('calls').desc(),
+    'recent': F('last_seen').desc(),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the slow queries recorded by tickets.slowlog, aggregated by normalized SQL. "
+        "Pass a fingerprint (or a prefix of one) to see that query in full with its plan."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('fingerprint', nargs='?',
+                            help="Show one query with its EXPLAIN plan.")
+        parser.add_argument('--order', choices=sorted(ORDERINGS), default='total')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--reset', action='store_true',
+                            help="Delete every recorded query.")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(f"{deleted} recorded queries deleted")
+            return
+        if options['fingerprint']:
+            self.show(options['fingerprint'])
+            return
+
+        rows = SlowQuery.objects.order_by(ORDERINGS[options['order']])[:options['limit']]
+        self.stdout.write(f"{'fingerprint':<12}  {'calls':>6}  {'total ms':>10}  "
+                          f"{'avg ms':>8}  {'max ms':>8}  source / caller / sql")
+        for row in rows:
+            self.stdout.write(
+                f"{row.fingerprint[:12]:<12}  {row.calls:>6}  {row.total_ms:>10.1f}  "
+                f"{row.total_ms / row.calls:>8.1f}  {row.max_ms:>8.1f}  "
+                f"{row.source} / {row.caller or '-'}\n{'':>52}{row.sql[:120]}")
+
+    def show(self, prefix):
+        matches = list(SlowQuery.objects.filter(fingerprint__startswith=prefix)[:2])
+        if len(matches) != 1:
+            raise CommandError(f"{'No' if not matches else 'More than one'} "
+                               f"recorded query matches '{prefix}'.")
+        row = matches[0]
+        self.stdout.write(f"{row.fingerprint}\n"
+                          f"calls {row.calls}, total {row.total_ms:.1f} ms, "
+                          f"max {row.max_ms:.1f} ms, last seen {row.last_seen:%Y-%m-%d %H:%M}\n"
+                          f"last run by {row.source} in {row.caller or '-'}\n\n"
+                          f"{row.sql}\n\nplan:\n{row.plan or '(none captured)'}")
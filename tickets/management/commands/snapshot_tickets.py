@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Append tickets, comments, feedback and logs created since the last run "
+        "to a columnar snapshot directory (see tickets/snapshots.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Snapshot directory; created if missing.")
+        parser.add_argument('--batch-size', type=int, default=snapshots.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        added = snapshots.write_snapshot(options['path'], batch_size=options['batch_size'])
+        for table, rows in added.items():
+            self.stdout.write(f"{table:<12} +{rows} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot updated in {time.perf_counter() - started:.2f}s"))
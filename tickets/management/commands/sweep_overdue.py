@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+# models and the state machine only: keeps this cron command's cold start
+# free of DRF, serializers and views
+from tickets.models import Ticket
+from tickets.transitions import transition_many
+
+
+class Command(BaseCommand):
+    help = "Move open tickets older than the overdue window to 'pending' in one UPDATE."
+    # system checks load the URLconf and with it every view; `manage.py check`
+    # covers them, a cron job does not need to
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float,
+            default=Ticket.OVERDUE_AFTER.total_seconds() / 3600,
+            help="Age after which an open ticket is overdue.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many tickets are overdue.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        overdue = Ticket.objects.filter(status='open', created_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{overdue.count()} overdue tickets")
+            return
+        results = transition_many(overdue, 'pending')
+        moved = sum(result['ok'] for result in results)
+        self.stdout.write(f"{moved} of {len(results)} overdue tickets moved to pending")
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tickets import analytics
+from tickets.models import Ticket
+
+
+class Command(BaseCommand):
+    help = (
+        "Print resolution-time percentiles, daily backlog and rating "
+        "histograms per section and technician as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help="Length of the backlog window in days.")
+        parser.add_argument('--section', type=int, help="Only tickets of this section id.")
+
+    def handle(self, *args, **options):
+        queryset = Ticket.objects.all()
+        if options['section']:
+            queryset = queryset.filter(section_id=options['section'])
+        summary = analytics.summarize(queryset, days=options['days'])
+        self.stdout.write(json.dumps(summary, indent=2))
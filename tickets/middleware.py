@@ -0,0 +1,138 @@
+"""
+Response compression negotiated by ``Accept-Encoding``.
+
+zstd and brotli are used when the optional ``zstandard`` / ``brotli``
+packages are installed; gzip (stdlib) is always available. Among the
+encodings the client accepts, the highest q-value wins and ties go to
+zstd, then br, then gzip.
+
+Only API payload types (``COMPRESSIBLE_TYPES``) are compressed, never HTML:
+admin pages embed CSRF tokens, and compressing secrets next to reflected
+input is what BREACH exploits. Server-sent event streams are also skipped,
+because they must reach the client unbuffered. Streaming responses (sync
+or async) are compressed chunk by chunk with a flush after each one, so
+clients still get the first rows early.
+
+Like Django's ``GZipMiddleware``, compression weakens strong ETags
+(``W/"..."``): the compressed bytes differ from the identity ones.
+``tickets/conditional.py`` still accepts them in ``If-Match``.
+"""
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'text/csv')
+_ACCEPT_ENCODING = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*')
+
+
+# each codec returns (compress chunk, flush, finish) for one response
+def _gzip():
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return z.compress, lambda: z.flush(zlib.Z_SYNC_FLUSH), z.flush
+
+
+def _brotli():
+    c = brotli.Compressor(quality=4)
+    return c.process, c.flush, c.finish
+
+
+def _zstd():
+    c = zstandard.ZstdCompressor(level=3).compressobj()
+    return c.compress, lambda: c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), c.flush
+
+
+CODECS = {'gzip': _gzip}
+if brotli is not None:
+    CODECS['br'] = _brotli
+if zstandard is not None:
+    CODECS['zstd'] = _zstd
+# tie-break order, best ratio/speed first
+PREFERENCE = ('zstd', 'br', 'gzip')
+
+
+def choose_encoding(accept_encoding):
+    """Best supported coding for an ``Accept-Encoding`` header, or None."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = _ACCEPT_ENCODING.fullmatch(part)
+        if not match:
+            continue
+        coding, q = match.group(1).lower(), match.group(2)
+        try:
+            weights[coding] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+    wildcard = weights.get('*', 0.0)
+    ranked = [(weights.get(coding, wildcard), -PREFERENCE.index(coding), coding)
+              for coding in PREFERENCE if coding in CODECS]
+    q, _, coding = max(ranked)
+    return coding if q > 0 else None
+
+
+def compress(coding, data):
+    process, _, finish = CODECS[coding]()
+    return process(data) + finish()
+
+
+def compress_stream(coding, chunks):
+    process, flush, finish = CODECS[coding]()
+    for chunk in chunks:
+        out = process(chunk) + flush()
+        if out:
+            yield out
+    yield finish()
+
+
+async def acompress_stream(coding, chunks):
+    process, flush, finish = CODECS[coding]()
+    async for chunk in chunks:
+        out = process(chunk) + flush()
+        if out:
+            yield out
+    yield finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """gzip / br / zstd for API responses above ``RESPONSE_COMPRESSION_MIN_SIZE`` bytes."""
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES or response.has_header('Content-Encoding'):
+            return response
+        if (not response.streaming
+                and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            compressor = acompress_stream if response.is_async else compress_stream
+            response.streaming_content = compressor(coding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = compress(coding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
@@ -1,12 +1,60 @@
+from datetime import timedelta
+
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.conf import settings
+from django.utils import timezone
+
+from .tenancy import TenantManager, TenantUserManager, current_tenant
 
 
 # Create your models here.
 
+# ORGANIZATIONS (tenants)
+class Organization(models.Model):
+    """A client organization; requests are scoped to one (tickets/tenancy.py)"""
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TenantModel(models.Model):
+    """Rows owned by an organization: ``objects`` only sees the current tenant's rows"""
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        editable=False,
+        related_name='+'
+    )
+
+    objects = TenantManager()
+    unscoped = models.Manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        tenant = current_tenant()
+        if self.organization_id is None and tenant is not None:
+            self.organization_id = tenant.pk
+        super().save(*args, **kwargs)
+
+
+def unique_per_tenant(field, name):
+    """``field`` unique within each organization, and among rows without one"""
+    return [
+        models.UniqueConstraint(fields=['organization', field], name=name),
+        models.UniqueConstraint(fields=[field], condition=models.Q(organization__isnull=True),
+                                name=f'{name}_untenanted'),
+    ]
+
+
 # Custom User Model
-class CustomUser(AbstractUser):
+class CustomUser(TenantModel, AbstractUser):
     """Extends Django's AbstractUser class to include additional fields"""
     ROLE_CHOICES = [
         ('user', 'User'),
@@ -25,21 +73,32 @@ class CustomUser(AbstractUser):
         help_text='Sections the technician is specialized in.'
     )
 
+    # usernames stay unique across organizations: they are the login
+    objects = TenantUserManager()
+    unscoped = UserManager()
+
+    class Meta(AbstractUser.Meta):
+        # technician / manager lookups within one organization
+        indexes = [models.Index(fields=['organization', 'role'])]
+
     def __str__(self):
         return f"{self.username}"
 
 
 # SECTIONS MODEL
-class Section(models.Model):
+class Section(TenantModel):
     """Maintenance sections e.g. IT, Plumbing, Electrical e.t.c."""
-    name = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
     description = models.TextField(max_length=200, blank=True)
 
+    class Meta:
+        constraints = unique_per_tenant('name', 'unique_section_name')
+
     def __str__(self):
         return f"{self.name}\n"
 
 # FACILITY MODEL
-class Facility(models.Model):
+class Facility(TenantModel):
     """Facilities e.g. Building, ICT Equipment, Kitchen Equipment, Residential, e.t.c """
     FACILITY_CHOICES = [
         ('building', 'Building'),
@@ -48,7 +107,7 @@ class Facility(models.Model):
         ('kitchen', 'Kitchen Equipment'),
         ('residential', 'Residential'),
     ]
-    name = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
     type = models.CharField(
         max_length=50,
         choices=FACILITY_CHOICES,
@@ -58,12 +117,15 @@ class Facility(models.Model):
     status = models.CharField(max_length=50, default="active")
     location = models.CharField(max_length=100, blank=True, null=True)
 
+    class Meta:
+        constraints = unique_per_tenant('name', 'unique_facility_name')
+
     def __str__(self):
         return f"{self.name}\n"
 
 
 # TICKETS MODEL
-class Ticket(models.Model):
+class Ticket(TenantModel):
     """Tickets: maintenance issues such as leaking pipe...e.t.c"""
     STATUS_CHOICES = [
         ('open', 'Open'),
@@ -75,7 +137,7 @@ class Ticket(models.Model):
     ]
 
     ticket_no = models.CharField(max_length=10, unique=True, editable=False)
-    title = models.CharField(max_length=100)
+    title = models.CharField(max_length=100, db_index=True)
     description = models.TextField(max_length=200)
     section = models.ForeignKey(Section, on_delete=models.CASCADE)
     facility = models.ForeignKey(Facility, on_delete=models.CASCADE)
@@ -90,7 +152,7 @@ class Ticket(models.Model):
         default="open"
     )
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     assigned_to = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -98,15 +160,60 @@ class Ticket(models.Model):
         null=True,
         related_name='assigned_tickets'
     )
+    # bumped on every service-layer update; used for compare-and-swap writes
+    version = models.PositiveIntegerField(default=0)
+    # MinHash of title + description for duplicate detection (tickets/dedup.py)
+    signature = models.BinaryField(null=True, editable=False)
+    # manager the SLA ladder escalated this ticket to (tickets/escalation.py)
+    escalated_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='escalated_tickets'
+    )
+
+    # open tickets older than this are overdue
+    OVERDUE_AFTER = timedelta(hours=24)
+
+    class Meta:
+        indexes = [
+            # duplicate candidates: recent tickets on one facility and section
+            models.Index(fields=['organization', 'facility', 'section', 'created_at']),
+            # the ticket list, newest first, optionally by status
+            models.Index(fields=['organization', 'created_at']),
+            models.Index(fields=['organization', 'status', 'created_at']),
+        ]
 
     def save(self, *args, **kwargs):
         """auto generate the ticket_no if not set"""
         if not self.ticket_no:
-            last_ticket = Ticket.objects.all().order_by('-id').first()
-            next_id = 1 if not last_ticket else last_ticket.id + 1
+            # archived tickets keep their numbers, so they count too; numbers
+            # are global, not per organization
+            next_id = 1 + max(
+                model.unscoped.order_by('-id').values_list('id', flat=True).first() or 0
+                for model in (Ticket, ArchivedTicket))
             self.ticket_no = f"TKT-{next_id:06d}"
+        if not self._state.adding:
+            # plain saves (e.g. the admin) must change the ETag too
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
         super(Ticket, self).save(*args, **kwargs)
 
+    def is_overdue(self):
+        """still open (unassigned) more than OVERDUE_AFTER after creation"""
+        return self.status == 'open' and timezone.now() - self.created_at > self.OVERDUE_AFTER
+
+    def set_to_pending(self, user=None):
+        """move an overdue ticket to pending through the state machine (version, log, event)"""
+        # transitions imports this module
+        from .transitions import TransitionError, transition_many
+        result, = transition_many(Ticket.objects.filter(pk=self.pk), 'pending', user)
+        if not result['ok']:
+            raise TransitionError(result['error'])
+        self.refresh_from_db(fields=['status', 'assigned_to', 'updated_at', 'version'])
+
     def __str__(self):
         return (f"{self.ticket_no}\n"
                 f"{self.title}\n"
@@ -129,6 +236,9 @@ class Comment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['ticket', 'created_at'])]
+
     def __str__(self):
         return (f"Comment by: {self.author.username}\n"
                 f"on ticket: {self.ticket.title}\n")
@@ -155,6 +265,50 @@ class Feedback(models.Model):
                 f"by:  {self.rated_by.username}\n")
 
 
+# SLA ESCALATION MODELS
+class EscalationPolicy(models.Model):
+    """
+    A section's SLA ladder, measured from ticket creation: notify after
+    ``notify_after``, reassign to another technician after ``reassign_after``,
+    escalate to a manager after ``escalate_after``. Empty steps are skipped.
+    """
+    section = models.OneToOneField(
+        Section,
+        on_delete=models.CASCADE,
+        related_name='escalation_policy'
+    )
+    notify_after = models.DurationField(blank=True, null=True)
+    reassign_after = models.DurationField(blank=True, null=True)
+    escalate_after = models.DurationField(blank=True, null=True)
+
+    def __str__(self):
+        return f"SLA for {self.section.name}"
+
+
+class EscalationTimer(models.Model):
+    """One pending step of a ticket's ladder; the worker pops rows by ``fire_at``."""
+    STEP_CHOICES = [
+        ('notify', 'Notify'),
+        ('reassign', 'Reassign'),
+        ('escalate', 'Escalate'),
+    ]
+    ticket = models.ForeignKey(
+        Ticket,
+        on_delete=models.CASCADE,
+        related_name='escalation_timers'
+    )
+    step = models.CharField(max_length=10, choices=STEP_CHOICES)
+    fire_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ticket', 'step'], name='unique_escalation_step'),
+        ]
+
+    def __str__(self):
+        return f"{self.step} {self.ticket_id} at {self.fire_at}"
+
+
 # TicketLog Model
 class TicketLog(models.Model):
     """Logs every action on a ticket for auditing purposes"""
@@ -172,5 +326,113 @@ class TicketLog(models.Model):
     )
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['ticket', 'timestamp'])]
+
+    def __str__(self):
+        return f"{self.timestamp}: {self.action} (Ticket: {self.ticket.title})"
+
+# IDEMPOTENCY KEY MODEL
+class IdempotencyKey(models.Model):
+    """
+    First response to a POST sent with an ``Idempotency-Key`` header, so a
+    retried request is answered from here instead of creating again.
+    Rows expire after ``settings.IDEMPOTENCY_KEY_TTL``.
+    """
+    owner = models.CharField(max_length=64)  # "user:<pk>" or "anon:<ip>"
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of method, path and body
+    status_code = models.PositiveSmallIntegerField(null=True)  # null while in flight
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner} {self.key}"
+
+
+# SLOW QUERY LOG
+class SlowQuery(models.Model):
+    """
+    Statements slower than ``settings.SLOW_QUERY_THRESHOLD_MS``, aggregated
+    by normalized SQL (tickets/slowlog.py); reported by ``manage.py slow_queries``.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)  # sha1 of the normalized SQL
+    sql = models.TextField()
+    source = models.CharField(max_length=255, blank=True)  # last view or command
+    caller = models.CharField(max_length=255, blank=True)  # last function of this app
+    calls = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    plan = models.TextField(blank=True)  # EXPLAIN output, captured once
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = 'slow queries'
+
+    def __str__(self):
+        return f"{self.fingerprint[:12]} ({self.calls}x)"
+
+
+# ARCHIVE MODELS
+# Closed (after settings.TICKET_ARCHIVE_AFTER) and deleted tickets are moved
+# here with their comments, feedback and logs by tickets/archive.py, keeping
+# their ids and ticket numbers. Same columns as the live tables, read-only.
+class ArchivedTicket(TenantModel):
+    ARCHIVE_REASONS = [
+        ('closed', 'Closed'),
+        ('deleted', 'Deleted'),
+    ]
+
+    id = models.IntegerField(primary_key=True)
+    ticket_no = models.CharField(max_length=10, unique=True)
+    title = models.CharField(max_length=100)
+    description = models.TextField(max_length=200)
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name='+')
+    facility = models.ForeignKey(Facility, on_delete=models.CASCADE, related_name='+')
+    raised_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Ticket.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    assigned_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    escalated_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    version = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(db_index=True)
+    archive_reason = models.CharField(max_length=10, choices=ARCHIVE_REASONS)
+
     def __str__(self):
-        return f"{self.timestamp}: {self.action} (Ticket: {self.ticket.title})"
\ No newline at end of file
+        return f"{self.ticket_no} (archived)"
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    ticket = models.ForeignKey(ArchivedTicket, on_delete=models.CASCADE, related_name='comments')
+    text = models.TextField(max_length=500)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+
+class ArchivedFeedback(models.Model):
+    id = models.IntegerField(primary_key=True)
+    ticket = models.OneToOneField(ArchivedTicket, on_delete=models.CASCADE, related_name='feedback')
+    rated_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    rating = models.FloatField()
+    comment = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+
+
+class ArchivedTicketLog(models.Model):
+    id = models.IntegerField(primary_key=True)
+    ticket = models.ForeignKey(ArchivedTicket, on_delete=models.CASCADE, related_name='logs')
+    action = models.CharField(max_length=255)
+    performed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    timestamp = models.DateTimeField()
@@ -0,0 +1,76 @@
+"""
+Role-based access rules for tickets.
+
+- admins, managers and superusers see every ticket
+- technicians see tickets in the sections they specialize in, plus tickets
+  assigned to or raised by them
+- plain users see the tickets they raised
+
+A technician's section set lives in the M2M table, so it is cached twice:
+on the user object for the rest of the request, and in Django's cache
+under a per-user version number. ``m2m_changed`` (see ``signals.py``)
+bumps the version, which orphans the stale entry instead of racing to
+delete it. The version must be seen by every worker process, so the cache
+has to be shared (see ``CACHES`` in settings and the ``tickets.E001``
+check); a per-process cache would keep serving a technician's old sections.
+
+Anonymous requests stay unrestricted until ``IsAuthenticated`` is switched
+on in the views.
+"""
+from django.core.cache import cache
+from django.db.models import Q
+
+UNRESTRICTED_ROLES = ('admin', 'manager')
+SECTION_CACHE_TIMEOUT = 60 * 60
+
+
+def _version_key(user_id):
+    return f'tickets:user-sections-version:{user_id}'
+
+
+def is_unrestricted(user):
+    return (not user.is_authenticated
+            or user.is_superuser
+            or user.role in UNRESTRICTED_ROLES)
+
+
+def user_section_ids(user):
+    """Ids of the sections ``user`` specializes in, memoized per request."""
+    section_ids = getattr(user, '_section_ids', None)
+    if section_ids is not None:
+        return section_ids
+
+    version = cache.get_or_set(_version_key(user.pk), 1, None)
+    key = f'tickets:user-sections:{user.pk}:{version}'
+    section_ids = cache.get(key)
+    if section_ids is None:
+        section_ids = frozenset(
+            user.sections_specialized_in.values_list('id', flat=True))
+        cache.set(key, section_ids, SECTION_CACHE_TIMEOUT)
+
+    user._section_ids = section_ids
+    return section_ids
+
+
+def invalidate_user_sections(user_ids):
+    """Bump the cache version of each user so the next read reloads."""
+    for user_id in user_ids:
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            # nothing cached for this user yet
+            pass
+
+
+def scope_tickets(user, queryset):
+    """Restrict a ticket queryset to what ``user`` may see, in SQL."""
+    if is_unrestricted(user):
+        return queryset
+    if user.role == 'technician':
+        return queryset.filter(
+            Q(section_id__in=user_section_ids(user))
+            | Q(assigned_to=user)
+            | Q(raised_by=user)
+        )
+    return queryset.filter(raised_by=user)
+
@@ -0,0 +1,131 @@
+"""
+Faster renderers and parsers, chosen by content negotiation.
+
+- ``ORJSONRenderer`` / ``ORJSONParser``: same ``application/json`` media
+  type as DRF's JSON classes, encoded with orjson (a C extension) instead
+  of the stdlib ``json`` module.
+- ``MessagePackRenderer`` / ``MessagePackParser``: ``application/msgpack``,
+  a compact binary encoding, for clients sending ``Accept: application/msgpack``
+  (or ``?format=msgpack``).
+
+``StreamingJSONRenderer`` (``?format=jsonstream``) is for list views that
+hand it a queryset: rows are serialized a chunk at a time from a database
+iterator and written out as one JSON array, so neither time to first
+byte nor memory grows with the size of the list. Under ASGI, Django would
+read a sync iterator to the end before sending anything, so views hand
+out ``astream`` there instead.
+
+Both libraries are optional. ``resolver/settings.py`` only registers the
+classes whose library is installed, so without them the API keeps DRF's
+stock JSON.
+"""
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+# Decimal, UUID, lazy translations, querysets...: whatever DRF's JSON encoder knows
+_fallback = JSONEncoder().default
+# datetimes go to _fallback too, so they are formatted like DRF does them
+# (millisecond precision, 'Z' for UTC) rather than orjson's own way
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None  # orjson always emits UTF-8 bytes
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=_fallback, option=_ORJSON_OPTIONS)
+
+
+class ORJSONParser(BaseParser):
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_fallback, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+def dumps(data):
+    """JSON bytes, via orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_fallback, option=_ORJSON_OPTIONS)
+    return JSONRenderer().render(data)
+
+
+class StreamingJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'jsonstream'
+    charset = None
+    chunk_size = 500
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # non-list responses (errors, creates) are rendered in one piece
+        if data is None:
+            return b''
+        return dumps(data)
+
+    def stream(self, queryset, serializer_class, context):
+        """Yield a JSON array of ``queryset`` serialized ``chunk_size`` rows at a time."""
+        yield b'['
+        chunk, first = [], True
+        # prefetch_related is honoured per chunk by iterator(chunk_size=...)
+        for obj in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(obj)
+            if len(chunk) == self.chunk_size:
+                yield self._encode(chunk, serializer_class, context, first)
+                chunk, first = [], False
+        if chunk:
+            yield self._encode(chunk, serializer_class, context, first)
+        yield b']'
+
+    async def astream(self, queryset, serializer_class, context):
+        """``stream`` as an async iterator; each chunk is built in the sync thread."""
+        chunks = self.stream(queryset, serializer_class, context)
+        next_chunk = sync_to_async(next, thread_sensitive=True)
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+
+    def _encode(self, chunk, serializer_class, context, first):
+        rows = serializer_class(chunk, many=True, context=context).data
+        body = b','.join(dumps(row) for row in rows)
+        return body if first else b',' + body
@@ -1,21 +1,31 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from .models import *
+from . import lookups, services
 from django.contrib.auth import get_user_model
 
 # User = get_user_model()
 
 
+# names are unique per organization; the managers scope these checks to the
+# current one (tickets/tenancy.py)
 class FacilitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Facility
         fields = ['id', 'name', 'type', 'status', 'location']
+        extra_kwargs = {'name': {'validators': [UniqueValidator(
+            queryset=Facility.objects.all(),
+            message="facility with this name already exists.")]}}
 
 
 class SectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Section
-        fields = "__all__"
+        fields = ['id', 'name', 'description']
+        extra_kwargs = {'name': {'validators': [UniqueValidator(
+            queryset=Section.objects.all(),
+            message="section with this name already exists.")]}}
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -28,30 +38,22 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name', 'email', 'password', 'role']
 
     def create(self, validated_data):
-        first_name = validated_data.get('first_name')
-        last_name = validated_data.get('last_name')
-        email = validated_data.get('email', '')
-        password = validated_data['password']
-        role = validated_data.get('role', 'user')
-
-        base_username = f"{first_name.lower()}.{last_name.lower()}"
-        username = base_username
-        counter = 1
-
-        # to ensure the username is unique lets add a digit
-        while CustomUser.objects.filter(username=username).exists():
-            username = f"{username}-{counter}"
-            counter += 1
-
-        user = CustomUser.objects.create_user(
-            username=username,
-            email=email,
-            first_name=first_name,
-            last_name=last_name,
-            password=password,
-            role=role,
-        )
-        return user
+        # username is first.last, suffixed -1, -2... when already taken
+        return services.create_user(validated_data)
+
+
+class BulkUserSerializer(UserSerializer):
+    """
+    One row of a bulk import. Password is optional: users imported
+    without one get an unusable password and must reset it.
+    """
+    password = serializers.CharField(write_only=True, required=False)
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            'first_name': {'required': True, 'allow_blank': False},
+            'last_name': {'required': True, 'allow_blank': False},
+        }
 
 # minimal serializer for ticket to avoid circular dependency during nested serialization
 class TinyTicketSerializer(serializers.ModelSerializer):
@@ -110,6 +112,40 @@ class FeedbackSerializer(serializers.ModelSerializer):
         fields = ['id', 'ticket', 'rated_by', 'rating', 'comment', 'created_at']
 
 
+# related fields resolved from the process-local maps in tickets/lookups.py
+# instead of a query each; the queryset only feeds the browsable API's choices
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = lookups.get(self.lookup, pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        obj = lookups.get(self.lookup, data)
+        if obj is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+        return obj
+
+
 # main  ticket serializer
 class TicketSerializer(serializers.ModelSerializer):
     # write only field for IDS
@@ -119,7 +155,8 @@ class TicketSerializer(serializers.ModelSerializer):
     no longer set raised_by_id. to be done by the views using context
     """
 
-    assigned_to_id = serializers.SlugRelatedField(
+    assigned_to_id = CachedSlugRelatedField(
+        'technician',
         slug_field='username',
         queryset=CustomUser.objects.filter(role='technician'),
         source='assigned_to',
@@ -128,11 +165,11 @@ class TicketSerializer(serializers.ModelSerializer):
         write_only=True
     )
 
-    section_id = serializers.PrimaryKeyRelatedField(
-        queryset=Section.objects.all(), source='section', write_only=True)
+    section_id = CachedPrimaryKeyRelatedField(
+        'section', queryset=Section.objects.all(), source='section', write_only=True)
 
-    facility_id = serializers.PrimaryKeyRelatedField(
-        queryset=Facility.objects.all(), source='facility', write_only=True)
+    facility_id = CachedPrimaryKeyRelatedField(
+        'facility', queryset=Facility.objects.all(), source='facility', write_only=True)
 
     # read only fields for related names
     section = serializers.StringRelatedField(read_only=True)
@@ -142,6 +179,12 @@ class TicketSerializer(serializers.ModelSerializer):
     assigned_to = UserSerializer(read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
     feedback = FeedbackSerializer(read_only=True)
+    # manager the SLA ladder escalated the ticket to (tickets/escalation.py)
+    escalated_to = serializers.StringRelatedField(read_only=True)
+    # optional on update: the version the client last saw
+    version = serializers.IntegerField(required=False, min_value=0)
+    # on create: skip duplicate detection and always open a new ticket
+    allow_duplicate = serializers.BooleanField(required=False, write_only=True)
 
     class Meta:
         model = Ticket
@@ -155,8 +198,32 @@ class TicketSerializer(serializers.ModelSerializer):
             'facility_id', 'facility',
             'raised_by',
             'assigned_to_id', 'assigned_to',
+            'escalated_to',
             'created_at',
             'updated_at',
             'comments',
             'feedback',
+            'version',
+            'allow_duplicate',
         ]
+
+
+# read-only serializers for tickets moved to the archive (tickets/archive.py);
+# same shape as the live ones plus when and why the ticket was archived
+class ArchivedCommentSerializer(CommentSerializer):
+    class Meta(CommentSerializer.Meta):
+        model = ArchivedComment
+
+
+class ArchivedFeedbackSerializer(FeedbackSerializer):
+    class Meta(FeedbackSerializer.Meta):
+        model = ArchivedFeedback
+
+
+class ArchivedTicketSerializer(TicketSerializer):
+    comments = ArchivedCommentSerializer(many=True, read_only=True)
+    feedback = ArchivedFeedbackSerializer(read_only=True)
+
+    class Meta(TicketSerializer.Meta):
+        model = ArchivedTicket
+        fields = TicketSerializer.Meta.fields + ['archived_at', 'archive_reason']
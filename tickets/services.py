@@ -1,7 +1,28 @@
-from django.shortcuts import get_object_or_404
-from rest_framework.exceptions import ValidationError, PermissionDenied
+from concurrent.futures import ProcessPoolExecutor
 
-from .models import Ticket, TicketLog
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError, PermissionDenied
+
+from .models import Comment, CustomUser, Ticket, TicketLog
+from .events import publish_ticket_event
+from .permissions import user_section_ids
+from . import archive, dedup, escalation, lookups, transitions
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Ticket was modified by someone else. Reload and try again.'
+    default_code = 'conflict'
 
 # ---------------------
 # TICKET SERVICES
@@ -9,19 +30,109 @@ from .models import Ticket, TicketLog
 
 def create_ticket(serializer, user):
     """Logic for creating a ticket."""
-    ticket = serializer.save(raised_by=user)
+    # new tickets always start at version 0
+    serializer.validated_data.pop('version', None)
+    serializer.validated_data.pop('allow_duplicate', None)
+    data = serializer.validated_data
+    ticket = serializer.save(raised_by=user, signature=dedup.signature(
+        data['title'], data.get('description')))
 
     TicketLog.objects.create(
         ticket=ticket,
         performed_by=user,
         action=f"Ticket created by {user.username}"
     )
+    escalation.schedule(ticket)
+    publish_ticket_event('created', ticket)
+    return ticket
+
+
+def report_ticket(serializer, user):
+    """
+    Create a ticket unless it duplicates a recent active ticket on the same
+    facility and section. A duplicate report is merged into that ticket as
+    a comment instead. Returns ``(ticket, created)``.
+    """
+    data = serializer.validated_data
+    if not data.get('allow_duplicate'):
+        sig = dedup.signature(data['title'], data.get('description'))
+        duplicate_id = dedup.find_duplicate(data['facility'], data['section'].id, sig)
+        if duplicate_id is not None:
+            return merge_duplicate_report(duplicate_id, data, user), False
+    return create_ticket(serializer, user), True
+
+
+def merge_duplicate_report(ticket_id, data, user):
+    """Attach a duplicate report to the existing ticket instead of opening a new one."""
+    ticket = Ticket.objects.get(pk=ticket_id)
+    text = f"Duplicate report: {data['title']}\n{data.get('description') or ''}"
+    Comment.objects.create(ticket=ticket, author=user,
+                           text=text[:Comment._meta.get_field('text').max_length])
+    touch_ticket(ticket)
+    TicketLog.objects.create(
+        ticket=ticket,
+        performed_by=user,
+        action=f"Duplicate report by {user.username} merged"
+    )
+    return ticket
+
+
+def delete_ticket(ticket, user):
+    """Soft delete: log it, then move the ticket and its history to the archive."""
+    TicketLog.objects.create(
+        ticket=ticket,
+        performed_by=user,
+        action=f"Ticket deleted by {user.username}"
+    )
+    archive.archive_tickets(Ticket.objects.filter(pk=ticket.pk), reason='deleted')
+
+
+def touch_ticket(ticket):
+    """
+    Bump updated_at and version without a full save so ETags embedding the
+    ticket's comments and feedback change when those are added.
+    """
+    Ticket.objects.filter(pk=ticket.pk).update(updated_at=timezone.now(),
+                                               version=F('version') + 1)
+
+
+def save_ticket_changes(ticket, changes, expected_version):
+    """
+    Compare-and-swap write: UPDATE ... WHERE id = ? AND version = ?.
+    Only the changed columns are written. If another request bumped the
+    version first, nothing is written and Conflict (409) is raised.
+    """
+    if ticket.version != expected_version:
+        raise Conflict()
+    if not changes:
+        return ticket
+
+    now = timezone.now()
+    updated = Ticket.objects.filter(pk=ticket.pk, version=expected_version).update(
+        **changes, updated_at=now, version=F('version') + 1
+    )
+    if not updated:
+        raise Conflict()
+
+    for field, value in changes.items():
+        setattr(ticket, field, value)
+    ticket.updated_at = now
+    ticket.version = expected_version + 1
     return ticket
 
 
-def update_ticket(serializer, user):
-    """Logic for updating a ticket (assignments, status, etc.)"""
+def update_ticket(serializer, user, expected_version=None):
+    """
+    Logic for updating a ticket (assignments, status, etc.)
+
+    ``expected_version`` is the version an ``If-Match`` precondition
+    matched; a ``version`` in the body must agree with it.
+    """
     ticket = serializer.instance
+    if expected_version is None:
+        expected_version = ticket.version
+    if serializer.validated_data.pop('version', expected_version) != expected_version:
+        raise Conflict()
     old_assigned_to = ticket.assigned_to
     old_status = ticket.status
 
@@ -29,7 +140,8 @@ def update_ticket(serializer, user):
     new_assigned_to = serializer.validated_data.get('assigned_to', old_assigned_to)
     new_status = serializer.validated_data.get('status', old_status)
 
-    if new_assigned_to:
+    assignment_changed = new_assigned_to != old_assigned_to
+    if new_assigned_to and assignment_changed:
         # 1. Check if the assigned user's role is 'technician'
         # Assuming your User model has a 'role' field
         if new_assigned_to.role != 'technician':
@@ -38,7 +150,7 @@ def update_ticket(serializer, user):
             )
 
         # 2. Check section consistency (existing logic)
-        if ticket.section != new_assigned_to.section:
+        if ticket.section_id not in user_section_ids(new_assigned_to):
             raise ValidationError(
                 f"Technician {new_assigned_to.username} does not belong to section {ticket.section.name}."
             )
@@ -51,40 +163,65 @@ def update_ticket(serializer, user):
         new_status = 'assigned'
         serializer.validated_data['status'] = 'assigned'
 
-    #prevent assignment if ticket is closed or resolved
-    if new_assigned_to and old_status in ["resolved", "closed"]:
-        raise ValidationError("Cannot assign a ticket that is resolved or closed.")
+    # Status changes must follow the transition table
+    if new_status != old_status:
+        try:
+            transition = transitions.validate(old_status, new_status, new_assigned_to is not None)
+        except transitions.TransitionError as exc:
+            raise ValidationError({'status': str(exc)})
+        serializer.validated_data.update(transition.sets)
+        new_assigned_to = serializer.validated_data.get('assigned_to', old_assigned_to)
 
-    # Save updated fields
-    updated_ticket = serializer.save()
+    # Save only the fields that actually changed, guarded by the version
+    serializer.validated_data.pop('allow_duplicate', None)
+    changes = {
+        field: value for field, value in serializer.validated_data.items()
+        if getattr(ticket, field) != value
+    }
+    if 'title' in changes or 'description' in changes:
+        changes['signature'] = dedup.signature(
+            changes.get('title', ticket.title), changes.get('description', ticket.description))
+    # the write and its audit logs commit together or not at all
+    with transaction.atomic():
+        updated_ticket = save_ticket_changes(ticket, changes, expected_version)
 
-    # Log assignment changes
-    if old_assigned_to != new_assigned_to:
-        TicketLog.objects.create(
-            ticket=updated_ticket,
-            performed_by=user,
-            action=f"Assigned to {new_assigned_to or 'None'}"
-        )
+        # Log assignment changes
+        if old_assigned_to != new_assigned_to:
+            TicketLog.objects.create(
+                ticket=updated_ticket,
+                performed_by=user,
+                action=f"Assigned to {new_assigned_to or 'None'}"
+            )
+            publish_ticket_event('assigned', updated_ticket)
 
-    # Log status changes
-    if old_status != new_status:
-        TicketLog.objects.create(
-            ticket=updated_ticket,
-            performed_by=user,
-            action=f"Status changed from {old_status} to {new_status}"
-        )
+        # Log status changes
+        if old_status != new_status:
+            TicketLog.objects.create(
+                ticket=updated_ticket,
+                performed_by=user,
+                action=f"Status changed from {old_status} to {new_status}"
+            )
+            publish_ticket_event('status', updated_ticket)
 
     return updated_ticket
+
+
+def transition_tickets(queryset, to_status, user):
+    """Bulk status change; see transitions.transition_many."""
+    try:
+        return transitions.transition_many(queryset, to_status, user)
+    except transitions.TransitionError as exc:
+        raise ValidationError({'status': str(exc)})
 # ---------------------------------------------
 #  COMMENT SERVICES
 # ---------------------------------------------
-def create_comment(serializer, user, ticket_id):
+def create_comment(serializer, user, ticket):
     """
     Attach author and ticket to a new comment.
     Log the action under TicketLog.
     """
-    ticket = get_object_or_404(Ticket, id=ticket_id)
     comment = serializer.save(author=user, ticket=ticket)
+    touch_ticket(ticket)
 
     TicketLog.objects.create(
         ticket=ticket,
@@ -98,17 +235,16 @@ def create_comment(serializer, user, ticket_id):
 # ---------------------------------------------
 #  FEEDBACK SERVICES
 # ---------------------------------------------
-def create_feedback(serializer, user, ticket_id):
+def create_feedback(serializer, user, ticket):
     """
     Ensure only the ticket raiser can provide feedback.
     Attach user and ticket, log the action.
     """
-    ticket = get_object_or_404(Ticket, id=ticket_id)
-
-    if ticket.raised_by != user:
+    if ticket.raised_by_id != user.id:
         raise PermissionDenied("Only the ticket raiser can give feedback.")
 
     feedback = serializer.save(rated_by=user, ticket=ticket)
+    touch_ticket(ticket)
 
     TicketLog.objects.create(
         ticket=ticket,
@@ -116,4 +252,180 @@ def create_feedback(serializer, user, ticket_id):
         action=f"Feedback ({serializer.validated_data.get('rating', '?')}/5) added by {user.username}"
     )
 
-    return feedback
\ No newline at end of file
+    return feedback
+
+# ---------------------------------------------
+#  USER SERVICES
+# ---------------------------------------------
+USERNAME_RETRIES = 5
+
+
+def base_username(first_name, last_name):
+    return f"{first_name.lower()}.{last_name.lower()}"
+
+
+def _taken_usernames(bases):
+    """One query for every existing 'base' or 'base-N' username."""
+    query = Q()
+    for base in bases:
+        query |= Q(username=base) | Q(username__startswith=f"{base}-")
+    # usernames are unique across organizations
+    return CustomUser.unscoped.filter(query).values_list('username', flat=True)
+
+
+def _highest_suffixes(bases, taken):
+    """
+    Map each base to the highest suffix in use: -1 when the base is free,
+    0 when only the bare base exists, N for 'base-N'.
+    """
+    highest = {base: -1 for base in bases}
+    for username in taken:
+        base, sep, suffix = username.rpartition('-')
+        if username in highest:
+            highest[username] = max(highest[username], 0)
+        elif sep and suffix.isdigit() and base in highest:
+            highest[base] = max(highest[base], int(suffix))
+    return highest
+
+
+def resolve_usernames(bases):
+    """
+    Pick a unique username for every base in ``bases`` (duplicates allowed)
+    with a single query. Returns usernames in the same order.
+    """
+    highest = _highest_suffixes(set(bases), _taken_usernames(set(bases)))
+    usernames = []
+    for base in bases:
+        highest[base] += 1
+        suffix = highest[base]
+        usernames.append(base if suffix == 0 else f"{base}-{suffix}")
+    return usernames
+
+
+def _with_username_retry(create):
+    """
+    Run ``create`` in a savepoint, retrying when a concurrent request took
+    the same username between our lookup and the insert.
+    """
+    for attempt in range(USERNAME_RETRIES):
+        try:
+            with transaction.atomic():
+                return create()
+        except IntegrityError:
+            if attempt == USERNAME_RETRIES - 1:
+                raise
+
+
+def create_user(validated_data):
+    """Create one user with a generated first.last[-N] username."""
+    first_name = validated_data.get('first_name')
+    last_name = validated_data.get('last_name')
+    base = base_username(first_name, last_name)
+
+    def create():
+        username, = resolve_usernames([base])
+        return CustomUser.objects.create_user(
+            username=username,
+            email=validated_data.get('email', ''),
+            first_name=first_name,
+            last_name=last_name,
+            password=validated_data['password'],
+            role=validated_data.get('role', 'user'),
+        )
+
+    return _with_username_retry(create)
+
+
+def _init_hash_worker():
+    # spawned (non-forked) workers start without configured settings
+    import django
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hash ``passwords`` in order. ``None`` entries become unusable
+    passwords (no hashing). With ``workers`` > 1 the hashing is spread
+    over a process pool, since PBKDF2 and friends are CPU bound.
+    """
+    if workers is None:
+        workers = getattr(settings, 'PROVISIONING_HASH_WORKERS', 1)
+    to_hash = [(i, password) for i, password in enumerate(passwords) if password is not None]
+    hashed = [make_password(None) for _ in passwords]
+    if workers <= 1 or len(to_hash) < 2:
+        for i, password in to_hash:
+            hashed[i] = make_password(password)
+        return hashed
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_hash_worker) as pool:
+        results = pool.map(make_password, [password for _, password in to_hash],
+                           chunksize=max(1, len(to_hash) // (workers * 4)))
+        for (i, _), encoded in zip(to_hash, results):
+            hashed[i] = encoded
+    return hashed
+
+
+def bulk_create_users(rows, hash_workers=None):
+    """
+    Create many users at once: one username query, one INSERT.
+    Rows without a password get an unusable one, which skips the
+    password hasher entirely; the rest are hashed by ``hash_passwords``.
+    """
+    hashed = hash_passwords([row.get('password') for row in rows], workers=hash_workers)
+
+    def create():
+        bases = [base_username(row['first_name'], row['last_name']) for row in rows]
+        users = [
+            CustomUser(
+                username=username,
+                email=CustomUser.objects.normalize_email(row.get('email', '')),
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                role=row.get('role', 'user'),
+                password=password,
+            )
+            for row, username, password in zip(rows, resolve_usernames(bases), hashed)
+        ]
+        users = CustomUser.objects.bulk_create(users)
+        # bulk_create sends no post_save
+        if any(user.role == 'technician' for user in users):
+            lookups.invalidate('technician')
+        return users
+
+    return _with_username_retry(create)
+
+
+def make_invite(user):
+    """
+    Return ``(uid, token)`` letting ``user`` choose their own password.
+    The token is Django's password-reset token, so it needs no table and
+    stops working once a password is set or PASSWORD_RESET_TIMEOUT passes.
+    """
+    return urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)
+
+
+def provision_users(rows):
+    """
+    Onboard users without hashing anything: every account gets an unusable
+    password plus an invite token. Returns ``[(user, uid, token), ...]``.
+    """
+    users = bulk_create_users([{**row, 'password': None} for row in rows])
+    return [(user, *make_invite(user)) for user in users]
+
+
+def accept_invite(uid, token, password):
+    """Set the first password of an invited user; returns the user."""
+    try:
+        user = CustomUser.objects.get(pk=urlsafe_base64_decode(uid).decode())
+    except (ValueError, TypeError, OverflowError, CustomUser.DoesNotExist):
+        user = None
+    if user is None or not default_token_generator.check_token(user, token):
+        raise ValidationError({'token': 'Invalid or expired invite.'})
+
+    try:
+        validate_password(password, user)
+    except DjangoValidationError as exc:
+        raise ValidationError({'password': list(exc.messages)})
+    user.set_password(password)
+    user.save(update_fields=['password'])
+    return user
@@ -0,0 +1,71 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .lookups import invalidate
+from .models import CustomUser, EscalationPolicy, Facility, Organization, Section
+from .tenancy import invalidate_organization
+
+
+@receiver(m2m_changed, sender=CustomUser.sections_specialized_in.through)
+def sections_specialized_in_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate cached section sets when a technician's sections change."""
+    # imported here: permissions pulls in DRF, which app loading should not
+    from .permissions import invalidate_user_sections
+
+    if not reverse:
+        # instance is the user
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_user_sections([instance.pk])
+        return
+
+    # instance is the section; pk_set holds user ids
+    if action == 'pre_clear':
+        instance._cleared_technician_ids = list(
+            instance.technicians.values_list('id', flat=True))
+    elif action == 'post_clear':
+        invalidate_user_sections(getattr(instance, '_cleared_technician_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_sections(pk_set)
+
+
+@receiver([post_save, post_delete], sender=Organization)
+def organization_changed(sender, instance, **kwargs):
+    """Drop the cached organization lookups of TenantMixin."""
+    invalidate_organization(instance)
+
+
+@receiver([post_save, post_delete], sender=Section)
+def section_changed(sender, **kwargs):
+    invalidate('section')
+
+
+@receiver([post_save, post_delete], sender=Facility)
+def facility_changed(sender, **kwargs):
+    invalidate('facility')
+
+
+# fields the technician lookup map depends on; a login only writes last_login
+TECHNICIAN_FIELDS = {'username', 'role', 'organization', 'is_active'}
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created and instance.role != 'technician':
+        return
+    if update_fields is not None and not TECHNICIAN_FIELDS & set(update_fields):
+        return
+    invalidate('technician')
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    if instance.role == 'technician':
+        invalidate('technician')
+
+
+@receiver([post_save, post_delete], sender=EscalationPolicy)
+def escalation_policy_changed(sender, instance, **kwargs):
+    """Move the section's open tickets onto the new ladder."""
+    from .escalation import reschedule
+
+    reschedule(instance.section_id)
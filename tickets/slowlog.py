@@ -0,0 +1,202 @@
+"""
+Slow-query log.
+
+``recording()`` hooks ``execute_wrapper`` on every database connection and
+times each statement. Statements slower than
+``settings.SLOW_QUERY_THRESHOLD_MS`` are kept with the code that ran them:
+the view (or command) and the innermost function of this app on the call
+stack, e.g. ``tickets.services.create_ticket``. Fast statements only cost
+a timer.
+
+When the block ends, the slow statements are logged (logger
+``tickets.slowlog``) and aggregated into ``SlowQuery`` by fingerprint, a
+hash of the SQL with its literals and ``IN`` lists normalized, so one row
+counts every run of the same query shape. The first time a SELECT shape
+is seen, its ``EXPLAIN`` plan (``EXPLAIN QUERY PLAN`` on SQLite) is
+captured as well. All of this happens after the block, outside the
+caller's transaction, and its own queries are not timed.
+
+``SlowQueryMiddleware`` records every request, sync or async; under ASGI
+it does not force the rest of the middleware chain into sync mode.
+Long-running commands
+(``run_escalations``, ``archive_tickets``) record their work too.
+Streamed response bodies are produced after the middleware returns and
+are not covered. ``manage.py slow_queries`` prints the report.
+"""
+import hashlib
+import logging
+import re
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(\.\d+)?\b'), '?'),
+    (re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)'), '(...)'),
+]
+_SELECT = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+# frames of these modules are never "the caller": model methods are attributed
+# to the service or view that called them
+_SKIP_MODULES = ('tickets.slowlog', 'tickets.tenancy', 'tickets.middleware', 'tickets.models')
+
+
+def normalize_sql(sql):
+    """Replace literals and placeholders so queries that differ only by parameters match."""
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()
+
+
+def _caller():
+    """``module.function`` of the innermost frame of this app, or ''."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('tickets.') and module not in _SKIP_MODULES:
+            return f"{module}.{frame.f_code.co_qualname}"
+        frame = frame.f_back
+    return ''
+
+
+class Recorder:
+    """``execute_wrapper`` that keeps statements slower than ``threshold_ms``."""
+
+    def __init__(self, threshold_ms, source=''):
+        self.threshold = threshold_ms / 1000
+        self.source = source
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.threshold:
+            self.slow.append({
+                'alias': context['connection'].alias, 'sql': sql, 'params': params,
+                'many': many, 'ms': elapsed * 1000, 'caller': _caller(),
+            })
+        return result
+
+
+def _recorder(source):
+    threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+    return None if threshold is None else Recorder(threshold, source)
+
+
+def _install(stack, recorder):
+    """Hook ``recorder`` on this thread's connections until ``stack`` closes."""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+
+
+@contextmanager
+def recording(source=''):
+    """Record the slow queries run inside the block; yields the ``Recorder`` (or None)."""
+    recorder = _recorder(source)
+    if recorder is None:
+        yield None
+        return
+    with ExitStack() as stack:
+        _install(stack, recorder)
+        yield recorder
+    if recorder.slow:
+        save(recorder.slow, recorder.source)
+
+
+def explain(alias, sql, params):
+    """The database's plan for a SELECT, or '' when it cannot be had."""
+    connection = connections[alias]
+    if not connection.features.supports_explaining_query_execution:
+        return ''
+    try:
+        # a savepoint keeps a failed EXPLAIN from breaking an open transaction
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return ''
+    # SQLite: (id, parent, notused, detail); PostgreSQL: one text column per line
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def save(slow, source):
+    """Log ``slow`` statements and add them to the ``SlowQuery`` aggregates."""
+    from .models import SlowQuery
+
+    now = timezone.now()
+    for entry in slow:
+        logger.warning("slow query (%.1f ms) in %s [%s]: %s", entry['ms'], source,
+                       entry['caller'], normalize_sql(entry['sql']))
+        key = fingerprint(entry['sql'])
+        changes = {'calls': F('calls') + 1, 'total_ms': F('total_ms') + entry['ms'],
+                   'max_ms': Greatest('max_ms', entry['ms']), 'last_seen': now,
+                   'source': source, 'caller': entry['caller']}
+        if SlowQuery.objects.filter(fingerprint=key).update(**changes):
+            continue
+        plan = ''
+        if getattr(settings, 'SLOW_QUERY_EXPLAIN', True) and not entry['many'] \
+                and _SELECT.match(entry['sql']):
+            plan = explain(entry['alias'], entry['sql'], entry['params'])
+        _, created = SlowQuery.objects.get_or_create(fingerprint=key, defaults={
+            'sql': normalize_sql(entry['sql']), 'source': source, 'caller': entry['caller'],
+            'calls': 1, 'total_ms': entry['ms'], 'max_ms': entry['ms'], 'plan': plan,
+            'last_seen': now})
+        if not created:  # another process inserted it first
+            SlowQuery.objects.filter(fingerprint=key).update(**changes)
+
+
+class SlowQueryMiddleware:
+    """Records each request's slow queries under its method and URL name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def source(request):
+        match = request.resolver_match
+        return f"{request.method} {match.view_name if match else request.path}"
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with recording() as recorder:
+            response = self.get_response(request)
+            if recorder is not None:
+                recorder.source = self.source(request)
+        return response
+
+    async def __acall__(self, request):
+        recorder = _recorder('')
+        if recorder is None:
+            return await self.get_response(request)
+        # connections are per thread: hook the one the request's sync code
+        # (views, the async ORM) runs its queries in
+        stack = ExitStack()
+        await sync_to_async(_install)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        recorder.source = self.source(request)
+        if recorder.slow:
+            await sync_to_async(save)(recorder.slow, recorder.source)
+        return response
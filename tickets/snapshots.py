@@ -0,0 +1,263 @@
+"""
+Columnar on-disk snapshots of tickets, comments, feedback and logs for
+offline analysis, so analysts stop querying the production database.
+
+Layout of a snapshot directory::
+
+    manifest.json            row counts, last exported id, dictionaries
+    tickets/id.bin           one raw little-endian array per column
+    tickets/status.bin       dictionary codes (int32)
+    tickets/title.offsets    int64 end offset of each row's text
+    tickets/title.data       concatenated UTF-8 text
+    ...
+
+- low-cardinality strings (status, section, facility) are dictionary
+  encoded: codes index the lists stored in ``manifest.json``. Section and
+  facility names are only unique per organization, so their entries are
+  ``[organization id, name]`` pairs
+- timestamps are int64 microseconds since the epoch
+- ids are int64, with -1 for NULL foreign keys
+
+Runs are incremental: rows with an id above the last exported one are
+appended, then the manifest is replaced atomically. Ids are handed out
+at insert time but rows only become visible at commit, so a row can
+commit after one with a higher id was exported; each run therefore
+re-reads the last ``ID_LAG`` ids and skips those already exported (kept
+in the manifest), and rows are in export order, not strictly id order.
+Readers size
+every array from the manifest, so a half-finished append is never seen,
+and ``Snapshot`` hands out ``np.memmap`` views without copying.
+Rows edited after export (e.g. a later status change) keep their
+snapshot-time values.
+"""
+import json
+import os
+
+import numpy as np
+
+from .models import Comment, Feedback, Ticket, TicketLog
+
+MANIFEST = 'manifest.json'
+BATCH_SIZE = 10000
+# ids below the last exported one that may still commit
+ID_LAG = 1000
+
+# column name -> (values_list path or tuple of paths, kind); kind is a numpy
+# dtype, 'time', 'text' or ('dict', dictionary name)
+TABLES = {
+    'tickets': (Ticket, {
+        'id': ('id', 'int64'),
+        'organization': ('organization_id', 'int64'),
+        'ticket_no': ('ticket_no', 'text'),
+        'title': ('title', 'text'),
+        'description': ('description', 'text'),
+        'status': ('status', ('dict', 'status')),
+        'section': (('section__organization_id', 'section__name'), ('dict', 'section')),
+        'facility': (('facility__organization_id', 'facility__name'), ('dict', 'facility')),
+        'raised_by': ('raised_by_id', 'int64'),
+        'assigned_to': ('assigned_to_id', 'int64'),
+        'created_at': ('created_at', 'time'),
+        'updated_at': ('updated_at', 'time'),
+    }),
+    'comments': (Comment, {
+        'id': ('id', 'int64'),
+        'ticket': ('ticket_id', 'int64'),
+        'author': ('author_id', 'int64'),
+        'created_at': ('created_at', 'time'),
+        'text': ('text', 'text'),
+    }),
+    'feedback': (Feedback, {
+        'id': ('id', 'int64'),
+        'ticket': ('ticket_id', 'int64'),
+        'rated_by': ('rated_by_id', 'int64'),
+        'rating': ('rating', 'float64'),
+        'created_at': ('created_at', 'time'),
+        'comment': ('comment', 'text'),
+    }),
+    'ticket_logs': (TicketLog, {
+        'id': ('id', 'int64'),
+        'ticket': ('ticket_id', 'int64'),
+        'performed_by': ('performed_by_id', 'int64'),
+        'timestamp': ('timestamp', 'time'),
+        'action': ('action', 'text'),
+    }),
+}
+
+
+def _files(column, kind):
+    """Column name -> {role: (file name, dtype)}."""
+    if kind == 'text':
+        return {'offsets': (f'{column}.offsets', '<i8'), 'data': (f'{column}.data', 'u1')}
+    if kind == 'time':
+        return {'values': (f'{column}.bin', '<i8')}
+    if isinstance(kind, tuple):
+        return {'values': (f'{column}.bin', '<i4')}
+    return {'values': (f'{column}.bin', np.dtype(kind).newbyteorder('<').str)}
+
+
+def _load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'tables': {}, 'dictionaries': {}}
+
+
+def _save_manifest(path, manifest):
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+
+def _paths(path):
+    return path if isinstance(path, tuple) else (path,)
+
+
+def _encode(values, kind, dictionaries, text_end):
+    """Turn one batch of Python values into ``{role: ndarray}``."""
+    if kind == 'text':
+        blobs = [(v or '').encode('utf-8') for v in values]
+        ends = text_end + np.cumsum([len(b) for b in blobs], dtype=np.int64)
+        return {'offsets': ends, 'data': np.frombuffer(b''.join(blobs), dtype=np.uint8)}
+    if kind == 'time':
+        return {'values': np.fromiter((int(v.timestamp() * 1_000_000) for v in values),
+                                      dtype=np.int64, count=len(values))}
+    if isinstance(kind, tuple):
+        dictionary = dictionaries.setdefault(kind[1], [])
+        # JSON turns tuple entries into lists
+        index = {tuple(value) if isinstance(value, list) else value: code
+                 for code, value in enumerate(dictionary)}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value not in index:
+                index[value] = len(dictionary)
+                dictionary.append(list(value) if isinstance(value, tuple) else value)
+            codes[i] = index[value]
+        return {'values': codes}
+    if kind == 'int64':
+        return {'values': np.fromiter((-1 if v is None else v for v in values),
+                                      dtype=np.int64, count=len(values))}
+    return {'values': np.array(values, dtype=kind)}
+
+
+def _export_table(path, name, manifest, batch_size):
+    model, columns = TABLES[name]
+    table_dir = os.path.join(path, name)
+    os.makedirs(table_dir, exist_ok=True)
+    state = manifest['tables'].setdefault(
+        name, {'rows': 0, 'last_id': 0, 'recent_ids': [], 'text_bytes': {}})
+    recent = set(state['recent_ids'])
+    dictionaries = manifest['dictionaries']
+
+    # drop bytes past the manifest left behind by an interrupted run
+    for column, (_, kind) in columns.items():
+        for role, (filename, dtype) in _files(column, kind).items():
+            file_path = os.path.join(table_dir, filename)
+            if role == 'data':
+                size = state['text_bytes'].get(column, 0)
+            else:
+                size = state['rows'] * np.dtype(dtype).itemsize
+            with open(file_path, 'ab') as f:
+                f.truncate(size)
+
+    names = list(columns)
+    fields = [path for column in names for path in _paths(columns[column][0])]
+    # where each column's values sit in a values_list row
+    slices, start = {}, 0
+    for column in names:
+        width = len(_paths(columns[column][0]))
+        slices[column] = (start, width)
+        start += width
+    rows = (model.objects.filter(id__gt=state['last_id'] - ID_LAG).order_by('id')
+            .values_list(*fields))
+    id_position = fields.index('id')
+
+    def values(batch, column):
+        start, width = slices[column]
+        if width == 1:
+            return [row[start] for row in batch]
+        return [row[start:start + width] for row in batch]
+
+    def flush(batch):
+        for column in names:
+            kind = columns[column][1]
+            encoded = _encode(values(batch, column), kind, dictionaries,
+                              state['text_bytes'].get(column, 0))
+            for role, (filename, dtype) in _files(column, kind).items():
+                with open(os.path.join(table_dir, filename), 'ab') as f:
+                    encoded[role].astype(dtype, copy=False).tofile(f)
+            if kind == 'text':
+                state['text_bytes'][column] = int(encoded['offsets'][-1])
+        state['rows'] += len(batch)
+        state['last_id'] = max(state['last_id'], batch[-1][id_position])
+        recent.update(row[id_position] for row in batch)
+
+    batch, added = [], 0
+    for row in rows.iterator(chunk_size=batch_size):
+        if row[id_position] in recent:
+            continue  # exported by an earlier run
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush(batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        added += len(batch)
+    state['recent_ids'] = sorted(pk for pk in recent if pk > state['last_id'] - ID_LAG)
+    return added
+
+
+def write_snapshot(path, batch_size=BATCH_SIZE):
+    """Append rows added since the last run; returns ``{table: rows added}``."""
+    os.makedirs(path, exist_ok=True)
+    manifest = _load_manifest(path)
+    added = {name: _export_table(path, name, manifest, batch_size) for name in TABLES}
+    _save_manifest(path, manifest)
+    return added
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = _load_manifest(path)
+        self.dictionaries = self.manifest['dictionaries']
+
+    def rows(self, table):
+        return self.manifest['tables'].get(table, {}).get('rows', 0)
+
+    def _map(self, table, filename, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, table, filename),
+                         dtype=dtype, mode='r', shape=(length,))
+
+    def column(self, table, column):
+        """Raw column: ids, int64 timestamps, floats or dictionary codes."""
+        kind = TABLES[table][1][column][1]
+        if kind == 'text':
+            raise ValueError(f"{table}.{column} is text; use text() instead")
+        (filename, dtype), = _files(column, kind).values()
+        return self._map(table, filename, dtype, self.rows(table))
+
+    def dictionary(self, table, column):
+        """Values that the codes of a dictionary-encoded column index into."""
+        kind = TABLES[table][1][column][1]
+        return self.dictionaries.get(kind[1], [])
+
+    def text(self, table, column):
+        """``(offsets, data)``: row i is ``data[offsets[i-1]:offsets[i]]``."""
+        files = _files(column, 'text')
+        offsets = self._map(table, *files['offsets'], self.rows(table))
+        size = self.manifest['tables'].get(table, {}).get('text_bytes', {}).get(column, 0)
+        return offsets, self._map(table, *files['data'], size)
+
+    def text_value(self, table, column, row):
+        offsets, data = self.text(table, column)
+        start = offsets[row - 1] if row else 0
+        return bytes(data[start:offsets[row]]).decode('utf-8')
@@ -0,0 +1,223 @@
+"""
+Multi-tenant scoping by organization.
+
+``Section``, ``Facility``, ``Ticket`` (and its archive) and ``CustomUser``
+carry an ``organization`` foreign key. ``TenantMixin`` resolves the
+request's organization right after DRF has authenticated the user: it is
+the user's own organization. An organization named by the
+``X-Organization`` header or a subdomain of ``TENANT_BASE_DOMAIN`` must be
+that one; only superusers, who belong to none, may pick one that way. The
+organization is the current tenant for the rest of the request. While a
+tenant is current:
+
+- ``Model.objects`` of those models only returns the tenant's rows. This
+  also covers querysets built at import time (``queryset = ...`` on views,
+  related fields on serializers): the filter is added when they are cloned
+  for the request, which DRF and Django always do before running them.
+- new rows are saved (or bulk-created) into the tenant.
+
+Without a current tenant (management commands, workers, the admin, and
+single-tenant deployments) nothing is filtered. Once any organization
+exists, an API request must resolve to one (see ``tenant_required``) and
+is rejected otherwise, so it is never left unscoped. ``Model.unscoped``
+never is. Related object access (``ticket.section``) uses Django's plain
+base manager and is not filtered either; it only follows keys that were
+read from tenant-filtered rows.
+
+Every tenant-filtered query therefore has an ``organization_id = X``
+predicate, and the composite indexes of these tables lead with that column
+so a tenant's queries only touch its own slice of the index, however many
+tenants share the tables.
+"""
+import contextvars
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import UserManager
+from django.core.cache import cache
+from django.db import models
+
+_current = contextvars.ContextVar('tickets_tenant', default=None)
+ORGANIZATION_CACHE_TIMEOUT = 60 * 60
+_SLUG = re.compile(r'^[-a-zA-Z0-9_]+$')
+
+
+def current_tenant():
+    """The organization requests are scoped to right now, or None."""
+    return _current.get()
+
+
+@contextmanager
+def use_tenant(organization):
+    """Scope the ORM to ``organization`` (None: unscoped) inside the block."""
+    token = _current.set(organization)
+    try:
+        yield organization
+    finally:
+        _current.reset(token)
+
+
+class TenantQuerySet(models.QuerySet):
+    _tenant_filtered = False
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._tenant_filtered = self._tenant_filtered
+        return clone._for_current_tenant()
+
+    def _for_current_tenant(self):
+        tenant = current_tenant()
+        if (tenant is None or self._tenant_filtered
+                or self.query.is_sliced or self.query.combinator):
+            return self
+        self.query.add_q(models.Q(organization=tenant.pk))
+        self._tenant_filtered = True
+        return self
+
+    def bulk_create(self, objs, *args, **kwargs):
+        tenant = current_tenant()
+        if tenant is not None:
+            for obj in objs:
+                if obj.organization_id is None:
+                    obj.organization_id = tenant.pk
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class TenantManager(models.Manager.from_queryset(TenantQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset()._for_current_tenant()
+
+
+class TenantUserManager(UserManager.from_queryset(TenantQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset()._for_current_tenant()
+
+
+# --------------------------------
+# RESOLVING THE TENANT
+# ----------------------------------
+
+_EXISTS_KEY = 'tickets:organizations-exist'
+
+
+def _cache_key(slug):
+    return f'tickets:organization:{slug}'
+
+
+def _id_cache_key(pk):
+    return f'tickets:organization-id:{pk}'
+
+
+def get_organization(slug):
+    """Organization by slug, cached; None when there is none."""
+    from .models import Organization
+
+    key = _cache_key(slug)
+    organization = cache.get(key)
+    if organization is None:
+        # cache misses as False so unknown slugs do not hit the database each time
+        organization = Organization.objects.filter(slug=slug).first() or False
+        cache.set(key, organization, ORGANIZATION_CACHE_TIMEOUT)
+    return organization or None
+
+
+def get_organization_by_id(pk):
+    """Organization by primary key, cached: a user's organization costs no query."""
+    from .models import Organization
+
+    return cache.get_or_set(_id_cache_key(pk), lambda: Organization.objects.filter(pk=pk).first(),
+                            ORGANIZATION_CACHE_TIMEOUT)
+
+
+def organizations_exist():
+    from .models import Organization
+
+    return cache.get_or_set(_EXISTS_KEY, Organization.objects.exists, ORGANIZATION_CACHE_TIMEOUT)
+
+
+def invalidate_organization(organization):
+    cache.delete_many([_cache_key(organization.slug), _id_cache_key(organization.pk),
+                       _EXISTS_KEY])
+
+
+def tenant_required():
+    """
+    ``settings.TENANT_REQUIRED``; None (the default) means "as soon as any
+    organization exists", so adding the first one closes unscoped access.
+    """
+    required = settings.TENANT_REQUIRED
+    return organizations_exist() if required is None else required
+
+
+def requested_slug(request):
+    """The organization slug a request names, if any: header first, then subdomain."""
+    slug = request.headers.get(settings.TENANT_HEADER)
+    if slug:
+        return slug.strip().lower()
+    base = settings.TENANT_BASE_DOMAIN
+    if base:
+        host = request.get_host().split(':')[0].lower()
+        if host.endswith(f'.{base}'):
+            return host[:-len(base) - 1]
+    return None
+
+
+class TenantError(Exception):
+    """The request cannot be given a tenant; ``status`` is the HTTP answer."""
+
+    def __init__(self, detail, status):
+        super().__init__(detail)
+        self.detail, self.status = detail, status
+
+
+def resolve_tenant(request, user):
+    """
+    The organization ``user``'s request is scoped to, or None for an
+    unscoped one. Raises ``TenantError`` when the request names an
+    organization the user may not use, or names none although one is
+    required.
+    """
+    slug = requested_slug(request)
+    if user.is_authenticated and user.organization_id is not None:
+        organization = get_organization_by_id(user.organization_id)
+        if slug and slug != organization.slug:
+            # same answer as for a slug that does not exist: no probing
+            raise TenantError('Unknown organization.', 404)
+        return organization
+    if slug:
+        organization = get_organization(slug) if _SLUG.match(slug) else None
+        if organization is None or not (user.is_authenticated and user.is_superuser):
+            raise TenantError('Unknown organization.', 404)
+        return organization
+    if tenant_required():
+        raise TenantError('This request must belong to an organization.', 403)
+    return None
+
+
+class TenantMixin:
+    """
+    For API views: makes the authenticated user's organization the current
+    tenant (``request.tenant``) before permissions, throttles and the
+    handler run, and restores the previous one afterwards.
+    """
+
+    def perform_authentication(self, request):
+        super().perform_authentication(request)
+        try:
+            organization = resolve_tenant(request, request.user)
+        except TenantError as exc:
+            # DRF is imported here: this module loads with the models
+            from rest_framework.exceptions import NotFound, PermissionDenied
+
+            raise (NotFound if exc.status == 404 else PermissionDenied)(exc.detail)
+        request.tenant = organization
+        self._tenant_token = _current.set(organization)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            token = self.__dict__.pop('_tenant_token', None)
+            if token is not None:
+                _current.reset(token)
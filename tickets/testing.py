@@ -0,0 +1,58 @@
+"""
+Helpers for query-count regression tests.
+
+Every API route is exercised at several table sizes. Its query count must
+not grow with the data (no N+1) and must not exceed the budget recorded in
+``query_budgets.json``. After an intentional change, rewrite the budgets
+with::
+
+    UPDATE_QUERY_BUDGETS=1 python manage.py test tickets.tests.QueryBudgetTests
+"""
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .slowlog import normalize_sql
+
+BUDGET_FILE = Path(__file__).with_name('query_budgets.json')
+
+
+def duplicate_queries(queries):
+    """``[(count, normalized sql), ...]`` for statements run more than once."""
+    counts = Counter(normalize_sql(q['sql']) for q in queries)
+    return [(n, sql) for sql, n in counts.most_common() if n > 1]
+
+
+def capture_queries(func):
+    """Run ``func`` and return ``(result, captured queries)``."""
+    with CaptureQueriesContext(connection) as ctx:
+        result = func()
+    return result, ctx.captured_queries
+
+
+def load_budgets():
+    if BUDGET_FILE.exists():
+        return json.loads(BUDGET_FILE.read_text())
+    return {}
+
+
+def save_budgets(budgets):
+    BUDGET_FILE.write_text(json.dumps(dict(sorted(budgets.items())), indent=2) + '\n')
+
+
+def updating_budgets():
+    return bool(os.environ.get('UPDATE_QUERY_BUDGETS'))
+
+
+def describe(name, captured_by_scale):
+    """Failure message: counts per scale plus the duplicated SQL at the largest."""
+    counts = ', '.join(f'{scale} rows: {len(q)}' for scale, q in captured_by_scale.items())
+    largest = captured_by_scale[max(captured_by_scale)]
+    lines = [f'{name} query count is not constant ({counts})']
+    for n, sql in duplicate_queries(largest):
+        lines.append(f'  {n}x {sql}')
+    return '\n'.join(lines)
@@ -7,12 +7,58 @@ from .models import *
 from .serializers import *
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.management import CommandError, call_command
+
+from django.contrib.auth.hashers import check_password, is_password_usable
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from . import (
+    analytics, archive, dedup, escalation, idempotency, lookups, renderers, services, slowlog,
+    snapshots, tenancy, throttling, transitions, views,
+)
+from .events import InProcessBroker
+from .permissions import user_section_ids
+from .services import resolve_usernames
+from .management.commands.profile_startup import parse_importtime
+from .testing import capture_queries, describe, load_budgets, save_budgets, updating_budgets
+from . import middleware as compression
+from . import urls as ticket_urls
+from .middleware import choose_encoding
 
 
 # Create your tests here.
 User = get_user_model()
 
+# tests clear the cache, so they get one of their own instead of the project's
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'tickets-tests'}}
 
+
+@override_settings(CACHES=TEST_CACHES)
 class ModelTests(TestCase):
 
     def setUp(self):
@@ -108,6 +154,13 @@ class ModelTests(TestCase):
             old_ticket.set_to_pending()
 
         self.assertEqual(old_ticket.status, 'pending')
+        self.assertEqual(old_ticket.version, 2)  # the save above counts too
+        self.assertTrue(old_ticket.logs.filter(action='Status changed from open to pending').exists())
+        # closed is terminal
+        old_ticket.status = 'closed'
+        old_ticket.save()
+        with self.assertRaises(transitions.TransitionError):
+            old_ticket.set_to_pending()
 
     def test_ticket_status_after_assignment(self):
         """test ticket status after assignment"""
@@ -159,6 +212,7 @@ class ModelTests(TestCase):
         self.assertEqual(self.ticket.comments_count(), 2)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class SerializerTests(TestCase):
 
     def setUp(self):
@@ -295,6 +349,7 @@ class SerializerTests(TestCase):
         self.assertEqual(feedback.comment, 'Good service.')
 
 
+@override_settings(CACHES=TEST_CACHES)
 class APITests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -368,3 +423,1805 @@ class APITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['title'], 'New Ticket')
         self.assertEqual(response.data['status'], 'open')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TicketEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+
+    def test_broker_filters_by_section(self):
+        """ subscribers only receive events for their section"""
+        async def run():
+            broker = InProcessBroker()
+            it = broker.subscribe(section=1)
+            plumbing = broker.subscribe(section=2)
+            broker.publish({'event': 'created', 'section': 1, 'assigned_to': None})
+            event = await it.get(timeout=1)
+            self.assertEqual(event['event'], 'created')
+            self.assertTrue(plumbing.queue.empty())
+
+        asyncio.run(run())
+
+    def test_create_ticket_publishes_event(self):
+        """ creating a ticket through the API publishes a 'created' event"""
+        received = []
+
+        class RecordingBroker:
+            def publish(self, event):
+                received.append(event)
+
+        self.client.force_login(self.user)
+        with mock.patch('tickets.events.get_broker', return_value=RecordingBroker()):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('ticket-list'), {
+                    'title': 'Leaking pipe',
+                    'description': 'Kitchen sink.',
+                    'section_id': self.section.id,
+                    'facility_id': self.facility.id,
+                })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['event'], 'created')
+        self.assertEqual(received[0]['section'], self.section.id)
+
+    def test_event_stream_rejects_bad_filter(self):
+        response = self.client.get(reverse('ticket-events'), {'section': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        self.ticket = Ticket.objects.create(
+            title='Faulty Printer',
+            description='Printer jammed.',
+            section=self.section,
+            facility=self.facility,
+            raised_by=self.user,
+        )
+        self.url = reverse('ticket-detail', args=[self.ticket.id])
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_etag_changes_on_create(self):
+        url = reverse('ticket-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        Ticket.objects.create(title='Another', description='x', section=self.section,
+                              facility=self.facility, raised_by=self.user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_200_OK)
+
+    def test_patch_with_stale_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'title': 'First edit'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.patch(self.url, {'title': 'Second edit'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.title, 'First edit')
+
+        # the weakened ETag of a compressed GET names the same ticket state
+        etag = 'W/' + self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'title': 'Third edit'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+    def test_if_match_version_guards_the_write(self):
+        etag = self.client.get(self.url)['ETag']
+        get_object = views.TicketDetailView.get_object
+
+        def racing_get_object(view):
+            # another client with the same ETag writes after our If-Match passed
+            Ticket.objects.filter(pk=self.ticket.pk).update(
+                title='Their edit', version=F('version') + 1)
+            return get_object(view)
+
+        with mock.patch.object(views.TicketDetailView, 'get_object', racing_get_object):
+            response = self.client.patch(self.url, {'title': 'My edit'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.title, 'Their edit')
+
+        # comments change the ticket's representation, so its ETag too
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('ticket-comments', args=[self.ticket.id]), {'text': 'Hi'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OptimisticConcurrencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.ticket = Ticket.objects.create(
+            title='Faulty Printer',
+            description='Printer jammed.',
+            section=Section.objects.create(name='IT'),
+            facility=Facility.objects.create(name='Main Block'),
+            raised_by=self.user,
+        )
+        self.url = reverse('ticket-detail', args=[self.ticket.id])
+
+    def test_update_bumps_version_and_logs(self):
+        response = self.client.patch(self.url, {'status': 'pending'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(
+            TicketLog.objects.filter(ticket=self.ticket).last().action,
+            'Status changed from open to pending'
+        )
+
+    def test_stale_version_conflicts(self):
+        self.client.patch(self.url, {'title': 'First edit', 'version': 0})
+        response = self.client.patch(self.url, {'status': 'pending', 'version': 0})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, 'open')
+        self.assertFalse(TicketLog.objects.filter(ticket=self.ticket).exists())
+
+    def test_concurrent_write_conflicts(self):
+        """ a write landing between read and save makes the CAS fail"""
+        stale = Ticket.objects.get(pk=self.ticket.pk)
+        Ticket.objects.filter(pk=self.ticket.pk).update(version=F('version') + 1)
+        serializer = TicketSerializer(stale, data={'status': 'pending'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(services.Conflict):
+            services.update_ticket(serializer, self.user)
+
+    def test_failed_log_rolls_back_the_write(self):
+        with mock.patch.object(TicketLog.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                serializer = TicketSerializer(self.ticket, data={'status': 'pending'},
+                                              partial=True)
+                serializer.is_valid(raise_exception=True)
+                services.update_ticket(serializer, self.user)
+        self.ticket.refresh_from_db()
+        self.assertEqual((self.ticket.status, self.ticket.version), ('open', 0))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TicketTimelineTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.ticket = Ticket.objects.create(
+            title='Faulty Printer',
+            description='Printer jammed.',
+            section=Section.objects.create(name='IT'),
+            facility=Facility.objects.create(name='Main Block'),
+            raised_by=self.user,
+        )
+        self.url = reverse('ticket-timeline', args=[self.ticket.id])
+        TicketLog.objects.create(ticket=self.ticket, performed_by=self.user, action='Ticket created')
+        for i in range(3):
+            Comment.objects.create(ticket=self.ticket, author=self.user, text=f'comment {i}')
+            TicketLog.objects.create(ticket=self.ticket, performed_by=self.user, action=f'log {i}')
+        Feedback.objects.create(ticket=self.ticket, rated_by=self.user, rating=4)
+
+    def test_timeline_is_chronological(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 8)
+        self.assertEqual([e['type'] for e in results[:3]], ['log', 'comment', 'log'])
+        self.assertEqual(results[-1]['type'], 'feedback')
+        timestamps = [e['timestamp'] for e in results]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertIsNone(response.data['next'])
+
+    def test_timeline_cursor_pagination(self):
+        seen = []
+        url = self.url + '?limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend((e['type'], e['id']) for e in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_timeline_rejects_bad_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # well-formed JSON, wrong contents
+        for position in (["2024-01-01T00:00:00Z", "x", "1"], ["2024-01-01T00:00:00Z", 1],
+                         {"a": 1, "b": 2, "c": 3}, ["2024-01-01T00:00:00Z", None, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, position)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PermissionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.technician = User.objects.create_user(
+            username='techuser', password='techpass', role='technician')
+        self.it = Section.objects.create(name='IT')
+        self.plumbing = Section.objects.create(name='Plumbing')
+        self.technician.sections_specialized_in.add(self.it)
+        facility = Facility.objects.create(name='Main Block')
+        self.it_ticket = Ticket.objects.create(
+            title='Printer', description='x', section=self.it,
+            facility=facility, raised_by=self.user)
+        self.plumbing_ticket = Ticket.objects.create(
+            title='Pipe', description='x', section=self.plumbing,
+            facility=facility, raised_by=self.user)
+
+    def test_technician_sees_only_their_sections(self):
+        self.client.force_authenticate(self.technician)
+        response = self.client.get(reverse('ticket-list'))
+        self.assertEqual([t['id'] for t in response.data], [self.it_ticket.id])
+        response = self.client.get(reverse('ticket-detail', args=[self.plumbing_ticket.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_section_set_is_cached_and_invalidated(self):
+        user = User.objects.get(pk=self.technician.pk)
+        self.assertEqual(user_section_ids(user), {self.it.id})
+        # a new request (fresh user object) is served from the shared cache
+        fresh = User.objects.get(pk=self.technician.pk)
+        with self.assertNumQueries(0):
+            user_section_ids(fresh)
+            user_section_ids(fresh)
+
+        self.plumbing.technicians.add(self.technician)
+        fresh = User.objects.get(pk=self.technician.pk)
+        self.assertEqual(user_section_ids(fresh), {self.it.id, self.plumbing.id})
+
+    def test_assignment_requires_section_specialization(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('ticket-detail', args=[self.plumbing_ticket.id])
+        response = self.client.patch(url, {'assigned_to_id': 'techuser'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse('ticket-detail', args=[self.it_ticket.id])
+        response = self.client.patch(url, {'assigned_to_id': 'techuser'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'assigned')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UsernameGenerationTests(APITestCase):
+    def test_suffixes_are_not_cumulative(self):
+        for _ in range(4):
+            user = services.create_user({
+                'first_name': 'Jane', 'last_name': 'Doe', 'password': 'secret-pass'})
+        self.assertEqual(user.username, 'jane.doe-3')
+        self.assertTrue(user.check_password('secret-pass'))
+
+    def test_username_lookup_is_one_query(self):
+        User.objects.create_user(username='jane.doe')
+        User.objects.create_user(username='jane.doe-7')
+        User.objects.create_user(username='jane.doesmith')
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_usernames(['jane.doe', 'jane.doe', 'john.roe']),
+                             ['jane.doe-8', 'jane.doe-9', 'john.roe'])
+
+    def test_bulk_import(self):
+        User.objects.create_user(username='jane.doe')
+        rows = [
+            {'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jd@example.com'},
+            {'first_name': 'Jane', 'last_name': 'Doe', 'password': 'secret-pass'},
+            {'first_name': 'Ann', 'last_name': 'Lee', 'role': 'technician'},
+        ]
+        response = self.client.post(reverse('user-bulk-create'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([u['username'] for u in response.data],
+                         ['jane.doe-1', 'jane.doe-2', 'ann.lee'])
+        self.assertFalse(User.objects.get(username='jane.doe-1').has_usable_password())
+        self.assertTrue(User.objects.get(username='jane.doe-2').check_password('secret-pass'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProvisioningTests(APITestCase):
+    def test_provisioned_user_accepts_invite(self):
+        (user, uid, token), = services.provision_users(
+            [{'first_name': 'Ann', 'last_name': 'Lee', 'role': 'technician'}])
+        self.assertFalse(user.has_usable_password())
+
+        url = reverse('user-invite-accept')
+        response = self.client.post(url, {'uid': uid, 'token': token, 'password': 'Xk2!plumbing'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('Xk2!plumbing'))
+
+        # token is single use: it is bound to the old password hash
+        response = self.client.post(url, {'uid': uid, 'token': token, 'password': 'Other!pass9'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_hash_passwords_keeps_order(self):
+        hashed = services.hash_passwords(['first-pass', None, 'second-pass'], workers=2)
+        self.assertTrue(check_password('first-pass', hashed[0]))
+        self.assertFalse(is_password_usable(hashed[1]))
+        self.assertTrue(check_password('second-pass', hashed[2]))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReportTests(TestCase):
+    def test_generate_reports_merges_shards_per_facility(self):
+        user = User.objects.create_user(username='testuser')
+        it = Section.objects.create(name='IT')
+        plumbing = Section.objects.create(name='Plumbing')
+        main = Facility.objects.create(name='Main Block')
+        annex = Facility.objects.create(name='Annex')
+        for section, facility in [(it, main), (plumbing, main), (it, annex)]:
+            ticket = Ticket.objects.create(title='t', description='d', section=section,
+                                           facility=facility, raised_by=user)
+            Comment.objects.create(ticket=ticket, author=user, text='c')
+
+        month = timezone.now().strftime('%Y-%m')
+        with tempfile.TemporaryDirectory() as out_dir:
+            call_command('generate_reports', month, output_dir=out_dir, workers=1,
+                         stdout=io.StringIO())
+            self.assertEqual(len(os.listdir(out_dir)), 2)
+            with open(os.path.join(out_dir, f'tickets-{month}-facility-{main.id}.csv')) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['comments'], '1')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AnalyticsTests(APITestCase):
+    def test_grouped_percentiles_match_numpy(self):
+        rng = np.random.default_rng(1)
+        values = rng.random(500)
+        values[::7] = np.nan
+        groups = rng.integers(0, 4, 500)
+        keys, counts, table = analytics.grouped_percentiles(values, groups)
+        for key, count, row in zip(keys, counts, table):
+            selected = values[(groups == key) & ~np.isnan(values)]
+            self.assertEqual(count, len(selected))
+            np.testing.assert_allclose(row, np.percentile(selected, analytics.PERCENTILES))
+
+    def test_daily_backlog(self):
+        day = analytics.DAY
+        created = np.array([0.5, 1.5, 1.6, 3.5]) * day
+        done = np.array([2.5, np.nan, 1.7, np.nan]) * day
+        _, backlog = analytics.daily_backlog(created, done, day, 4 * day)
+        self.assertEqual(backlog.tolist(), [2, 1, 2])
+
+    def test_analytics_endpoint(self):
+        user = User.objects.create_user(username='testuser')
+        section = Section.objects.create(name='IT')
+        ticket = Ticket.objects.create(title='t', description='d', section=section,
+                                       facility=Facility.objects.create(name='Main'),
+                                       raised_by=user)
+        log = TicketLog.objects.create(ticket=ticket, action='Status changed from open to resolved')
+        TicketLog.objects.filter(pk=log.pk).update(timestamp=ticket.created_at + timedelta(hours=3))
+        Feedback.objects.create(ticket=ticket, rated_by=user, rating=4)
+
+        response = self.client.get(reverse('ticket-analytics'), {'days': 7})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['resolution_by_section'][0]['p50_hours'], 3.0)
+        self.assertEqual(response.data['rating_histogram_by_section'][0]['ratings'], [0, 0, 0, 1, 0])
+        self.assertEqual(len(response.data['backlog']), 7)
+
+
+    def test_closed_tickets_leave_the_backlog(self):
+        user = User.objects.create_user(username='testuser')
+        ticket = Ticket.objects.create(title='t', description='d',
+                                       section=Section.objects.create(name='IT'),
+                                       facility=Facility.objects.create(name='Main'),
+                                       raised_by=user)
+        Ticket.objects.filter(pk=ticket.pk).update(
+            created_at=timezone.now() - timedelta(days=5))
+        # open -> closed, never resolved
+        [result] = transitions.transition_many(Ticket.objects.all(), 'closed', user)
+        self.assertTrue(result['ok'])
+
+        summary = analytics.summarize(days=7)
+        counts = [day['open'] for day in summary['backlog']]
+        self.assertEqual(counts[-1], 0)
+        self.assertIn(1, counts)
+        self.assertEqual(summary['resolution_by_section'], [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+
+    def make_ticket(self, title, status='open'):
+        return Ticket.objects.create(title=title, description='d', status=status,
+                                     section=self.section, facility=self.facility,
+                                     raised_by=self.user)
+
+    def test_incremental_snapshot_roundtrip(self):
+        first = self.make_ticket('Leaking pipé')
+        Comment.objects.create(ticket=first, author=self.user, text='on it')
+        with tempfile.TemporaryDirectory() as path:
+            added = snapshots.write_snapshot(path)
+            self.assertEqual(added['tickets'], 1)
+            self.assertEqual(added['comments'], 1)
+
+            self.make_ticket('Broken window', status='closed')
+            self.make_ticket('Flickering light')
+            self.assertEqual(snapshots.write_snapshot(path, batch_size=1)['tickets'], 2)
+            self.assertEqual(snapshots.write_snapshot(path)['tickets'], 0)
+
+            snapshot = snapshots.Snapshot(path)
+            self.assertEqual(snapshot.rows('tickets'), 3)
+            status_column = snapshot.column('tickets', 'status')
+            self.assertIsInstance(status_column, np.memmap)
+            statuses = snapshot.dictionary('tickets', 'status')
+            self.assertEqual([statuses[c] for c in status_column], ['open', 'closed', 'open'])
+            self.assertEqual(snapshot.text_value('tickets', 'title', 0), 'Leaking pipé')
+            self.assertEqual(snapshot.text_value('tickets', 'title', 2), 'Flickering light')
+            self.assertEqual(snapshot.column('tickets', 'assigned_to').tolist(), [-1, -1, -1])
+            self.assertEqual(snapshot.column('comments', 'ticket').tolist(), [first.id])
+
+
+    def test_rows_committed_late_are_not_skipped(self):
+        first = self.make_ticket('First')
+        second = self.make_ticket('Second')
+        with tempfile.TemporaryDirectory() as path:
+            # 'second' committed first; 'first' was still in flight
+            with mock.patch.object(Ticket.objects, 'filter',
+                                   lambda **kw: Ticket.objects.exclude(pk=first.pk).filter(**kw)):
+                self.assertEqual(snapshots.write_snapshot(path)['tickets'], 1)
+            self.assertEqual(snapshots.write_snapshot(path)['tickets'], 1)
+            self.assertEqual(snapshots.write_snapshot(path)['tickets'], 0)
+            ids = snapshots.Snapshot(path).column('tickets', 'id').tolist()
+        self.assertEqual(ids, [second.id, first.id])
+
+    def test_same_names_in_different_organizations_get_own_codes(self):
+        self.make_ticket('Ours')
+        other = Organization.objects.create(name='Globex', slug='globex')
+        with tenancy.use_tenant(other):
+            Ticket.objects.create(title='Theirs', description='d',
+                                  section=Section.objects.create(name='IT'),
+                                  facility=Facility.objects.create(name='Main Block'),
+                                  raised_by=self.user)
+        with tempfile.TemporaryDirectory() as path:
+            snapshots.write_snapshot(path)
+            snapshot = snapshots.Snapshot(path)
+            self.assertEqual(snapshot.column('tickets', 'section').tolist(), [0, 1])
+            self.assertEqual(snapshot.dictionary('tickets', 'section'),
+                             [[None, 'IT'], [other.id, 'IT']])
+            self.assertEqual(snapshot.column('tickets', 'organization').tolist(), [-1, other.id])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_login(self.admin)
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+
+    def add_tickets(self, n):
+        for i in range(n):
+            tech = User.objects.create_user(username=f'tech{Ticket.objects.count()}', role='technician')
+            ticket = Ticket.objects.create(title=f'Ticket {i}', description='d', section=self.section,
+                                           facility=self.facility, raised_by=tech, assigned_to=tech)
+            Comment.objects.create(ticket=ticket, author=tech, text='c')
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def test_ticket_changelist_query_count_is_constant(self):
+        url = reverse('admin:tickets_ticket_changelist')
+        self.add_tickets(2)
+        few = self.changelist_queries(url)
+        self.add_tickets(10)
+        self.assertEqual(self.changelist_queries(url), few)
+
+    def test_comment_changelist_query_count_is_constant(self):
+        url = reverse('admin:tickets_comment_changelist')
+        self.add_tickets(2)
+        few = self.changelist_queries(url)
+        self.add_tickets(10)
+        self.assertEqual(self.changelist_queries(url), few)
+
+    def test_username_input_filter(self):
+        self.add_tickets(3)
+        url = reverse('admin:tickets_ticket_changelist')
+        response = self.client.get(url, {'assigned_to': 'tech1', 'q': 'Ticket'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(response, 'name="q" value="Ticket"')
+
+    def test_search_uses_case_sensitive_lookups(self):
+        self.add_tickets(3)
+        for model in ('ticket', 'comment', 'feedback'):
+            url = reverse(f'admin:tickets_{model}_changelist')
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, {'q': 'Ticket'})
+            self.assertEqual(response.status_code, 200)
+            # UPPER(...) LIKE cannot use the indexes
+            self.assertFalse([q for q in ctx.captured_queries if 'UPPER(' in q['sql']], model)
+        response = self.client.get(reverse('admin:tickets_ticket_changelist'), {'q': 'Ticket'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(reverse('admin:tickets_comment_changelist'), {'q': 'tech1'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StatusTransitionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.technician = User.objects.create_user(username='techuser', role='technician')
+        self.client.force_authenticate(self.technician)
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        self.technician.sections_specialized_in.add(self.section)
+
+    def make_ticket(self, status, assigned_to=None):
+        return Ticket.objects.create(title='t', description='d', status=status,
+                                     section=self.section, facility=self.facility,
+                                     raised_by=self.user, assigned_to=assigned_to)
+
+    def test_closed_ticket_cannot_be_reopened(self):
+        ticket = self.make_ticket('closed')
+        response = self.client.patch(reverse('ticket-detail', args=[ticket.id]),
+                                     {'status': 'in_progress'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('status', response.data)
+
+    def test_guard_requires_assignee(self):
+        with self.assertRaises(transitions.TransitionError):
+            transitions.validate('open', 'in_progress', has_assignee=False)
+        self.assertEqual(transitions.validate('resolved', 'closed', False).target, 'closed')
+
+    def test_resolved_ticket_can_be_closed_by_assignee(self):
+        ticket = self.make_ticket('resolved', assigned_to=self.technician)
+        response = self.client.patch(reverse('ticket-detail', args=[ticket.id]),
+                                     {'status': 'closed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_transition_many(self):
+        open_ticket = self.make_ticket('open')
+        assigned = self.make_ticket('assigned', assigned_to=self.technician)
+        closed = self.make_ticket('closed')
+        pending = self.make_ticket('pending', assigned_to=self.technician)
+
+        with self.assertNumQueries(7):
+            results = transitions.transition_many(Ticket.objects.all(), 'open', self.user)
+        by_id = {r['id']: r for r in results}
+        self.assertFalse(by_id[open_ticket.id]['ok'])
+        self.assertTrue(by_id[assigned.id]['ok'])
+        self.assertTrue(by_id[pending.id]['ok'])
+        self.assertIn('Cannot change status', by_id[closed.id]['error'])
+
+        assigned.refresh_from_db()
+        self.assertEqual((assigned.status, assigned.assigned_to, assigned.version), ('open', None, 1))
+        self.assertEqual(TicketLog.objects.filter(ticket=assigned).count(), 2)
+        closed.refresh_from_db()
+        self.assertEqual(closed.status, 'closed')
+
+    def test_transition_many_skips_tickets_changed_after_reading(self):
+        ticket = self.make_ticket('assigned', assigned_to=self.technician)
+        validate = transitions.validate
+
+        def another_writer(*args):
+            # moves the ticket after transition_many read it as assigned/v0
+            Ticket.objects.filter(pk=ticket.pk).update(status='in_progress', version=7)
+            return validate(*args)
+
+        with mock.patch.object(transitions, 'validate', side_effect=another_writer):
+            [result] = transitions.transition_many(Ticket.objects.all(), 'resolved', self.user)
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['error'], "Ticket was modified concurrently.")
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.status, ticket.version), ('in_progress', 7))
+        self.assertFalse(TicketLog.objects.filter(ticket=ticket).exists())
+
+    def test_bulk_transition_endpoint(self):
+        ticket = self.make_ticket('assigned', assigned_to=self.technician)
+        response = self.client.post(reverse('ticket-bulk-transition'),
+                                    {'ids': [ticket.id], 'status': 'resolved'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data[0]['ok'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StartupTests(TestCase):
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   numpy.core\n"
+                  "import time:        30 |        150 | numpy\n")
+        self.assertEqual(list(parse_importtime(stderr)),
+                         [('numpy.core', 120, 120), ('numpy', 30, 150)])
+
+    def test_cron_command_skips_heavy_imports(self):
+        """ loading the overdue sweep must not import DRF, views or NumPy"""
+        code = (
+            "import django, sys; django.setup();"
+            "import tickets.management.commands.sweep_overdue;"
+            "print(sorted(m for m in ('rest_framework.serializers', 'tickets.views',"
+            " 'tickets.admin', 'numpy') if m in sys.modules))"
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'resolver.settings'}
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, env=env, cwd=settings.BASE_DIR, check=True).stdout
+        self.assertEqual(out.strip(), '[]')
+
+    def test_sweep_overdue(self):
+        user = User.objects.create_user(username='testuser')
+        ticket = Ticket.objects.create(title='t', description='d', raised_by=user,
+                                       section=Section.objects.create(name='IT'),
+                                       facility=Facility.objects.create(name='Main'))
+        Ticket.objects.filter(pk=ticket.pk).update(created_at=timezone.now() - timedelta(hours=25))
+        call_command('sweep_overdue', stdout=io.StringIO())
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.status, 'pending')
+
+
+@override_settings(CACHES=TEST_CACHES,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTests(APITestCase):
+    """
+    Every route in tickets/urls.py at 1, 10 and 100 rows: the query count
+    must be constant and within tickets/query_budgets.json.
+    """
+    scales = (1, 10, 100)
+    # endless server-sent event stream; nothing to count
+    skipped_routes = {'ticket-events'}
+
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='manager', role='manager')
+        self.client.force_authenticate(self.manager)
+        self.section = Section.objects.create(name='Section 0')
+        self.facility = Facility.objects.create(name='Facility 0')
+        self.ticket = None
+        self.size = 0
+        self.counter = 0
+
+    def grow_to(self, size):
+        """Add rows until every table (and one ticket's history) has ``size`` entries."""
+        new = range(self.size, size)
+        users = User.objects.bulk_create(
+            [User(username=f'tech{i}', role='technician', password='!') for i in new])
+        Section.objects.bulk_create([Section(name=f'Section {i + 1}') for i in new])
+        Facility.objects.bulk_create([Facility(name=f'Facility {i + 1}') for i in new])
+        for user in users:
+            user.sections_specialized_in.add(self.section)
+            ticket = Ticket.objects.create(
+                title=f'Ticket {user.username}', description='d', section=self.section,
+                facility=self.facility, raised_by=user, assigned_to=user, status='assigned')
+            Comment.objects.create(ticket=ticket, author=user, text='c')
+            Feedback.objects.create(ticket=ticket, rated_by=user, rating=4)
+            TicketLog.objects.create(ticket=ticket, performed_by=user, action='Ticket created')
+            self.ticket = self.ticket or ticket
+            if ticket != self.ticket:
+                Comment.objects.create(ticket=self.ticket, author=user, text='c')
+                TicketLog.objects.create(ticket=self.ticket, performed_by=user, action='x')
+        self.size = size
+
+    def next_id(self):
+        self.counter += 1
+        return self.counter
+
+    def new_assigned_ticket(self):
+        tech = User.objects.filter(role='technician').first()
+        return Ticket.objects.create(title='t', description='d', section=self.section,
+                                     facility=self.facility, raised_by=tech,
+                                     assigned_to=tech, status='assigned')
+
+    def new_own_ticket(self):
+        """a ticket raised by the client's user, which may give it feedback"""
+        return Ticket.objects.create(title='t', description='d', section=self.section,
+                                     facility=self.facility, raised_by=self.manager)
+
+    def routes(self):
+        """
+        route name -> list of (method, url or url factory, payload factory or None);
+        GETs have no payload factory
+        """
+        ticket, user = self.ticket, self.ticket.raised_by
+
+        def invite():
+            (_, uid, token), = services.provision_users(
+                [{'first_name': 'Invited', 'last_name': f'User{self.next_id()}'}])
+            return {'uid': uid, 'token': token, 'password': 'Xk2!plumbing'}
+
+        return {
+            'section-list': [('get', reverse('section-list'), None)],
+            'section-detail': [('get', reverse('section-detail', args=[self.section.id]), None)],
+            'facility-list': [('get', reverse('facility-list'), None)],
+            'facility-detail': [('get', reverse('facility-detail', args=[self.facility.id]), None)],
+            'ticket-list': [
+                ('get', reverse('ticket-list'), None),
+                ('post', reverse('ticket-list'), lambda: {
+                    # unrelated text each time so duplicate detection never merges
+                    'title': uuid.uuid4().hex, 'description': uuid.uuid4().hex,
+                    'section_id': self.section.id, 'facility_id': self.facility.id}),
+            ],
+            'ticket-detail': [
+                ('get', reverse('ticket-detail', args=[ticket.id]), None),
+                ('patch', reverse('ticket-detail', args=[ticket.id]),
+                 lambda: {'title': f'Edit {self.next_id()}'}),
+                ('put', reverse('ticket-detail', args=[ticket.id]), lambda: {
+                    'title': f'Edit {self.next_id()}', 'description': 'd',
+                    'section_id': self.section.id, 'facility_id': self.facility.id}),
+                # archives the ticket, so each call deletes a new one
+                ('delete', lambda: reverse('ticket-detail', args=[self.new_assigned_ticket().id]),
+                 lambda: None),
+            ],
+            'ticket-by-number': [
+                ('get', reverse('ticket-by-number', args=[ticket.ticket_no]), None)],
+            'ticket-timeline': [('get', reverse('ticket-timeline', args=[ticket.id]), None)],
+            'ticket-bulk-transition': [
+                ('post', reverse('ticket-bulk-transition'), lambda: {
+                    'ids': [self.new_assigned_ticket().id], 'status': 'in_progress'}),
+            ],
+            'comment-list': [
+                ('get', reverse('comment-list'), None),
+                ('post', reverse('comment-list'), lambda: {'ticket': ticket.id, 'text': 'c'}),
+            ],
+            'feedback-list': [
+                ('get', reverse('feedback-list'), None),
+                ('post', reverse('feedback-list'), lambda: {
+                    'ticket': self.new_own_ticket().id, 'rating': 4}),
+            ],
+            'ticket-analytics': [('get', reverse('ticket-analytics'), None)],
+            'user-list': [('get', reverse('user-list'), None)],
+            'user-bulk-create': [
+                ('post', reverse('user-bulk-create'), lambda: [
+                    {'first_name': 'Bulk', 'last_name': f'User{self.next_id()}'},
+                    {'first_name': 'Bulk', 'last_name': f'User{self.next_id()}'}]),
+            ],
+            'user-invite-accept': [('post', reverse('user-invite-accept'), invite)],
+            'user-detail': [('get', reverse('user-detail', args=[user.id]), None)],
+            'ticket-comments': [
+                ('get', reverse('ticket-comments', args=[ticket.id]), None),
+                ('post', reverse('ticket-comments', args=[ticket.id]), lambda: {'text': 'c'}),
+            ],
+            'ticket-feedback': [
+                ('get', reverse('ticket-feedback', args=[ticket.id]), None),
+                ('post', lambda: reverse('ticket-feedback', args=[self.new_own_ticket().id]),
+                 lambda: {'rating': 4}),
+            ],
+        }
+
+    def call(self, method, url, payload):
+        if callable(url):
+            url = url()
+        if payload is None:
+            # warm per-process caches so only per-request queries are counted
+            self.client.get(url)
+            response, queries = capture_queries(lambda: self.client.get(url))
+        else:
+            data = payload()
+            lookups.warm()
+            response, queries = capture_queries(
+                lambda: getattr(self.client, method)(url, data, format='json'))
+        self.assertLess(response.status_code, 400, f'{method.upper()} {url}: {response.status_code}')
+        return queries
+
+    def test_every_route_is_covered(self):
+        self.grow_to(1)
+        names = {p.name for p in ticket_urls.urlpatterns}
+        self.assertEqual(names - self.skipped_routes, set(self.routes()))
+
+    def test_query_counts_are_constant_and_within_budget(self):
+        captured = {}
+        for scale in self.scales:
+            self.grow_to(scale)
+            for name, calls in self.routes().items():
+                for method, url, payload in calls:
+                    key = f'{name} {method.upper()}'
+                    captured.setdefault(key, {})[scale] = self.call(method, url, payload)
+
+        budgets = load_budgets()
+        if updating_budgets():
+            save_budgets({key: max(len(q) for q in by_scale.values())
+                          for key, by_scale in captured.items()})
+            return
+
+        for key, by_scale in captured.items():
+            with self.subTest(route=key):
+                counts = {len(q) for q in by_scale.values()}
+                self.assertEqual(len(counts), 1, describe(key, by_scale))
+                self.assertIn(key, budgets, f'{key} has no budget; run with UPDATE_QUERY_BUDGETS=1')
+                self.assertLessEqual(
+                    counts.pop(), budgets[key],
+                    f'{key} exceeds its budget of {budgets[key]} queries\n' + '\n'.join(
+                        q['sql'] for q in by_scale[max(by_scale)]))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class NestedRouteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.other = User.objects.create_user(
+            username='otheruser', password='otherpass', role='manager')
+        section = Section.objects.create(name='IT')
+        facility = Facility.objects.create(name='Main Block')
+        self.ticket, self.other_ticket = [
+            Ticket.objects.create(title=title, description='x', section=section,
+                                  facility=facility, raised_by=self.user)
+            for title in ('Printer', 'Projector')]
+        Comment.objects.create(ticket=self.ticket, author=self.user, text='mine')
+        Comment.objects.create(ticket=self.other_ticket, author=self.user, text='other')
+        Feedback.objects.create(ticket=self.other_ticket, rated_by=self.user, rating=3)
+        self.client.force_authenticate(self.user)
+
+    def test_nested_lists_only_show_the_ticket(self):
+        response = self.client.get(reverse('ticket-comments', args=[self.ticket.id]))
+        self.assertEqual([c['text'] for c in response.data], ['mine'])
+        response = self.client.get(reverse('ticket-feedback', args=[self.ticket.id]))
+        self.assertEqual(response.data, [])
+        # the top-level lists are unchanged
+        self.assertEqual(len(self.client.get(reverse('comment-list')).data), 2)
+
+    def test_unknown_ticket_is_404(self):
+        response = self.client.get(reverse('ticket-comments', args=[9999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse('ticket-comments', args=[9999]), {'text': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_under_ticket(self):
+        response = self.client.post(
+            reverse('ticket-comments', args=[self.ticket.id]), {'text': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['ticket']['id'], self.ticket.id)
+
+        url = reverse('ticket-feedback', args=[self.ticket.id])
+        self.client.force_authenticate(self.other)
+        response = self.client.post(url, {'rating': 4})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, {'rating': 4})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.ticket.logs.filter(action__startswith='Feedback').count(), 1)
+
+    def test_top_level_create_takes_ticket_from_body(self):
+        response = self.client.post(reverse('comment-list'), {'text': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('comment-list'),
+                                    {'text': 'x', 'ticket': self.ticket.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.other = User.objects.create_user(username='otheruser', password='otherpass')
+        section = Section.objects.create(name='IT')
+        facility = Facility.objects.create(name='Main Block')
+        self.ticket = Ticket.objects.create(title='Printer', description='x', section=section,
+                                            facility=facility, raised_by=self.user)
+        self.url = reverse('ticket-comments', args=[self.ticket.id])
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        throttling._write_limiter = None
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'comment_writes': '2/min'}})
+    def test_token_bucket_per_user(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+        response = self.client.post(self.url, {'text': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+        # reads are not throttled, other users have their own bucket
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.ticket.raised_by = self.other
+        self.ticket.save()
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'comment_writes': '1/s'}})
+    def test_bucket_refills(self):
+        with mock.patch('tickets.throttling.time.time', return_value=100.0) as now:
+            self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+            self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 429)
+            now.return_value = 101.0
+            self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {
+        'comment_writes': '1/min', 'feedback_writes': '1/min'}})
+    def test_comments_and_feedback_have_separate_buckets(self):
+        self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+        self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 429)
+        url = reverse('ticket-feedback', args=[self.ticket.id])
+        self.assertEqual(self.client.post(url, {'rating': 4}).status_code, 201)
+        self.assertEqual(self.client.post(url, {'rating': 4}).status_code, 429)
+
+    def test_concurrent_writes_are_shed(self):
+        limiter = throttling._write_limiter = throttling.ConcurrencyLimiter(
+            1, queue_timeout=0, retry_after=3)
+        limiter.acquire()
+        response = self.client.post(self.url, {'text': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        limiter.release()
+
+        # the slot is returned after successful and failed writes alike
+        self.assertEqual(self.client.post(self.url, {'text': 'x'}).status_code, 201)
+        self.assertEqual(self.client.post(self.url, {}).status_code, 400)
+        limiter.acquire()
+        limiter.release()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        # identical reports on purpose: keep duplicate detection out of the way
+        self.data = {'title': 'Printer', 'description': 'x', 'allow_duplicate': True,
+                     'section_id': self.section.id, 'facility_id': self.facility.id}
+        self.client.force_authenticate(self.user)
+
+    def post(self, data, key='key-1', url=None):
+        return self.client.post(url or reverse('ticket-list'), data, format='json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        first = self.post(self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with mock.patch('tickets.services.create_ticket') as create, \
+                self.assertNumQueries(1):
+            again = self.post(self.data)
+        create.assert_not_called()
+        self.assertEqual(again.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(TicketLog.objects.count(), 1)
+
+        # without the header, or with a new key, the request runs again
+        self.assertEqual(self.post(self.data, key='key-2').status_code, 201)
+        self.client.post(reverse('ticket-list'), self.data, format='json')
+        self.assertEqual(Ticket.objects.count(), 3)
+
+    def test_key_reuse_and_in_flight(self):
+        self.post(self.data)
+        response = self.post({**self.data, 'title': 'Other'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # the first request with this key has not finished yet
+        IdempotencyKey.objects.filter(key='key-1').update(status_code=None)
+        self.assertEqual(self.post(self.data).status_code, status.HTTP_409_CONFLICT)
+
+        # ... and never will: its worker died, so the lease runs out
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=6))
+        self.assertEqual(self.post(self.data).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(self.post(self.data).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    def test_anonymous_owner_ignores_untrusted_forwarded_for(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='203.0.113.9',
+                                        HTTP_X_FORWARDED_FOR='198.51.100.1, 192.0.2.7')
+        request.user = AnonymousUser()
+        self.assertEqual(idempotency.request_owner(request), 'anon:203.0.113.9')
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(idempotency.request_owner(request), 'anon:192.0.2.7')
+
+    def test_failed_requests_are_not_stored(self):
+        response = self.post({**self.data, 'section_id': 999})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post({**self.data, 'section_id': 999}).status_code, 400)
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.post(self.data).status_code, 201)
+        self.assertEqual(Ticket.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('1 expired', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_comments_honour_the_key(self):
+        ticket = Ticket.objects.create(title='t', description='d', section=self.section,
+                                       facility=self.facility, raised_by=self.user)
+        url = reverse('ticket-comments', args=[ticket.id])
+        self.post({'text': 'hello'}, url=url)
+        self.post({'text': 'hello'}, url=url)
+        self.assertEqual(ticket.comments.count(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DuplicateTicketTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.manager = User.objects.create_user(
+            username='manager', password='managerpass', role='manager')
+        self.section = Section.objects.create(name='Plumbing')
+        self.facility = Facility.objects.create(name='Block A')
+        self.report = {'title': 'Leaking pipe in block A',
+                       'description': 'Water leaking from the pipe under the sink in block A',
+                       'section_id': self.section.id, 'facility_id': self.facility.id}
+        self.client.force_authenticate(self.user)
+        self.original = self.client.post(reverse('ticket-list'), self.report, format='json')
+
+    def test_similar_signatures(self):
+        sig = dedup.signature(self.report['title'], self.report['description'])
+        others = [dedup.signature('Pipe leaking, block A',
+                                  'water leaking from pipe under sink block A'),
+                  dedup.signature('Broken window', 'Window in room 4 is cracked')]
+        close, unrelated = dedup.similarity(sig, others)
+        self.assertGreater(close, settings.TICKET_DUPLICATE_THRESHOLD)
+        self.assertLess(unrelated, 0.1)
+
+    def test_lookup_uses_the_organization_led_index_without_a_tenant(self):
+        sig = dedup.signature(self.report['title'], self.report['description'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(dedup.find_duplicate(self.facility, self.section.id, sig),
+                             self.original.data['id'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+        self.assertIn('organization_id=?', plan.replace(' ', ''))
+
+    def test_duplicate_is_merged_into_original(self):
+        self.client.force_authenticate(self.manager)
+        response = self.client.post(reverse('ticket-list'), {
+            **self.report, 'title': 'Pipe leaking, block A',
+            'description': 'water leaking from pipe under sink block A'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['duplicate_of']['id'], self.original.data['id'])
+        self.assertEqual(Ticket.objects.count(), 1)
+
+        ticket = Ticket.objects.get()
+        comment = ticket.comments.get()
+        self.assertEqual(comment.author, self.manager)
+        self.assertTrue(comment.text.startswith('Duplicate report: Pipe leaking'))
+        self.assertTrue(ticket.logs.filter(action__contains='merged').exists())
+
+    def test_distinct_reports_are_created(self):
+        other_facility = Facility.objects.create(name='Block B')
+        cases = [
+            {**self.report, 'facility_id': other_facility.id},
+            {**self.report, 'title': 'Broken window', 'description': 'Room 4 window cracked'},
+            {**self.report, 'allow_duplicate': True},
+        ]
+        for data in cases:
+            response = self.client.post(reverse('ticket-list'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.count(), 4)
+
+    def test_finished_tickets_do_not_absorb_reports(self):
+        Ticket.objects.update(status='closed')
+        response = self.client.post(reverse('ticket-list'), self.report, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_signature_follows_edits(self):
+        url = reverse('ticket-detail', args=[self.original.data['id']])
+        self.client.patch(url, {'title': 'Broken window', 'description': 'Room 4'})
+        ticket = Ticket.objects.get()
+        self.assertEqual(bytes(ticket.signature), dedup.signature('Broken window', 'Room 4'))
+
+    def test_backfill_command(self):
+        Ticket.objects.update(signature=None)
+        call_command('index_ticket_signatures', stdout=io.StringIO())
+        self.assertEqual(bytes(Ticket.objects.get().signature),
+                         dedup.signature(self.report['title'], self.report['description']))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RendererTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        section = Section.objects.create(name='IT')
+        facility = Facility.objects.create(name='Main Block')
+        self.ticket = Ticket.objects.create(title='Printer ünïcode', description='x',
+                                            section=section, facility=facility,
+                                            raised_by=self.user)
+        Comment.objects.create(ticket=self.ticket, author=self.user, text='c')
+        self.client.force_authenticate(self.user)
+
+    @skipUnless(renderers.orjson, 'orjson not installed')
+    def test_orjson_matches_drf_json(self):
+        data = {'d': Decimal('1.50'), 'u': uuid.UUID(int=1), 'text': 'ünïcode',
+                'nested': [{'n': None, 'b': True}]}
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        response = self.client.get(reverse('ticket-list'))
+        self.assertIsInstance(response.accepted_renderer, renderers.ORJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.post(reverse('ticket-comments', args=[self.ticket.id]),
+                                    data=b'{"text": "via orjson"', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(renderers.orjson, 'orjson not installed')
+    def test_orjson_formats_datetimes_like_drf(self):
+        # timeline entries carry datetime objects straight from values()
+        response = self.client.get(reverse('ticket-timeline', args=[self.ticket.id]))
+        self.assertIsInstance(response.accepted_renderer, renderers.ORJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertTrue(json.loads(response.content)['results'][0]['timestamp'].endswith('Z'))
+        self.assertEqual(renderers.dumps(response.data), JSONRenderer().render(response.data))
+
+    @skipUnless(renderers.msgpack, 'msgpack not installed')
+    def test_msgpack_negotiation(self):
+        url = reverse('ticket-detail', args=[self.ticket.id])
+        as_json = self.client.get(url)
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(as_msgpack.content), as_json.json())
+        self.assertNotEqual(as_msgpack['ETag'], as_json['ETag'])
+
+        body = renderers.msgpack.packb({'text': 'binary'})
+        response = self.client.post(reverse('ticket-comments', args=[self.ticket.id]),
+                                    data=body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_renderers', rows=[10], repeat=1, stdout=out)
+        self.assertIn('drf json', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CompressionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        section = Section.objects.create(name='IT')
+        facility = Facility.objects.create(name='Main Block')
+        for i in range(5):
+            ticket = Ticket.objects.create(title=f'Ticket {i}', description='x' * 150,
+                                           section=section, facility=facility,
+                                           raised_by=self.user)
+            Comment.objects.create(ticket=ticket, author=self.user, text='c' * 100)
+        self.client.force_authenticate(self.user)
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(choose_encoding('deflate'), None)
+        self.assertEqual(choose_encoding('identity'), None)
+        self.assertEqual(choose_encoding('gzip;q=0'), None)
+        self.assertEqual(choose_encoding('*;q=0'), None)
+        best = next(c for c in compression.PREFERENCE if c in compression.CODECS)
+        self.assertEqual(choose_encoding('*'), best)
+        self.assertEqual(choose_encoding('gzip;q=0.5, br'),
+                         'br' if 'br' in compression.CODECS else 'gzip')
+
+    def test_large_api_responses_are_compressed(self):
+        plain = self.client.get(reverse('ticket-list'))
+        self.assertNotIn('Content-Encoding', plain)
+        response = self.client.get(reverse('ticket-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        # the bytes differ, so the ETag is weakened
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        small = self.client.get(reverse('section-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', small)
+
+    def test_streaming_list_matches_regular_list(self):
+        url = reverse('ticket-list')
+        expected = self.client.get(url, {'status': 'open'}).json()
+        with mock.patch.object(renderers.StreamingJSONRenderer, 'chunk_size', 2):
+            response = self.client.get(url, {'status': 'open', 'format': 'jsonstream'})
+            self.assertTrue(response.streaming)
+            with CaptureQueriesContext(connection) as queries:
+                body = b''.join(response.streaming_content)
+        self.assertEqual(json.loads(body), expected)
+        # one ticket query read in 3 chunks, each prefetching comments and their authors
+        self.assertEqual(len(queries), 1 + 3 * 2)
+
+        response = self.client.get(url, {'format': 'jsonstream'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(json.loads(body)), 5)
+
+    def test_streaming_list_is_async_under_asgi(self):
+        url = reverse('ticket-list')
+        expected = self.client.get(url).json()
+
+        async def fetch(**headers):
+            response = await AsyncClient().get(url, {'format': 'jsonstream'}, headers=headers)
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        # an async iterator, so ASGI sends chunks as they are built instead of buffering
+        response, body = async_to_sync(fetch)()
+        self.assertTrue(response.is_async)
+        self.assertEqual(json.loads(body), expected)
+        response, body = async_to_sync(fetch)(accept_encoding='gzip')
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(body)), expected)
+
+    def test_empty_stream_is_valid_json(self):
+        response = self.client.get(reverse('ticket-list'),
+                                   {'status': 'closed', 'format': 'jsonstream'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.technician = User.objects.create_user(
+            username='techuser', password='techpass', role='technician')
+        section = Section.objects.create(name='IT')
+        facility = Facility.objects.create(name='Main Block')
+        self.tickets = [
+            Ticket.objects.create(title=f'Ticket {i}', description='x', section=section,
+                                  facility=facility, raised_by=self.user,
+                                  assigned_to=self.technician, status='closed')
+            for i in range(5)]
+        self.old, self.recent = self.tickets[:4], self.tickets[4]
+        for ticket in self.tickets:
+            Comment.objects.create(ticket=ticket, author=self.user, text='c')
+            TicketLog.objects.create(ticket=ticket, performed_by=self.user, action='Closed')
+        Feedback.objects.create(ticket=self.old[0], rated_by=self.user, rating=5)
+        Ticket.objects.filter(id__in=[t.id for t in self.old]).update(
+            updated_at=timezone.now() - timedelta(days=200))
+        self.open = Ticket.objects.create(title='Open', description='x', section=section,
+                                          facility=facility, raised_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_old_closed_tickets_move_with_their_history(self):
+        before = self.client.get(reverse('ticket-detail', args=[self.old[0].id])).json()
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('archive_tickets', batch_size=3, stdout=out)
+        self.assertIn('4 closed tickets archived', out.getvalue())
+
+        self.assertEqual(set(Ticket.objects.values_list('id', flat=True)),
+                         {self.recent.id, self.open.id})
+        self.assertEqual(ArchivedTicket.objects.count(), 4)
+        self.assertEqual(ArchivedComment.objects.count(), 4)
+        self.assertEqual(ArchivedTicketLog.objects.count(), 4)
+        self.assertEqual(ArchivedFeedback.objects.get().ticket_id, self.old[0].id)
+        self.assertFalse(Comment.objects.filter(ticket_id__in=[t.id for t in self.old]).exists())
+        # two batches, each in its own transaction
+        self.assertEqual(sum('SAVEPOINT' in q['sql'] and 'RELEASE' not in q['sql']
+                             and 'ROLLBACK' not in q['sql'] for q in queries), 2)
+
+        # the same URLs keep working, read-only
+        response = self.client.get(reverse('ticket-detail', args=[self.old[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = response.json()
+        self.assertEqual(after.pop('archive_reason'), 'closed')
+        after.pop('archived_at')
+        self.assertEqual(after, before)
+        response = self.client.get(reverse('ticket-by-number', args=[self.old[1].ticket_no]))
+        self.assertEqual(response.data['id'], self.old[1].id)
+        response = self.client.patch(reverse('ticket-detail', args=[self.old[0].id]),
+                                     {'title': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archive_is_scoped_like_live_tickets(self):
+        archive.archive_closed()
+        stranger = User.objects.create_user(username='stranger', password='x')
+        self.client.force_authenticate(stranger)
+        response = self.client.get(reverse('ticket-detail', args=[self.old[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_archives_and_numbers_are_not_reused(self):
+        response = self.client.delete(reverse('ticket-detail', args=[self.open.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        archived = ArchivedTicket.objects.get(id=self.open.id)
+        self.assertEqual(archived.archive_reason, 'deleted')
+        self.assertTrue(archived.logs.filter(action__startswith='Ticket deleted').exists())
+
+        ticket = Ticket.objects.create(title='Next', description='x', section=self.open.section,
+                                       facility=self.open.facility, raised_by=self.user)
+        self.assertNotEqual(ticket.ticket_no, archived.ticket_no)
+        response = self.client.get(reverse('ticket-by-number', args=[archived.ticket_no]))
+        self.assertEqual(response.data['archive_reason'], 'deleted')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class EscalationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        self.techs = [User.objects.create_user(username=f'tech{i}', password='x',
+                                               role='technician') for i in range(2)]
+        for tech in self.techs:
+            tech.sections_specialized_in.add(self.section)
+        self.manager = User.objects.create_user(username='boss', password='x', role='manager')
+        EscalationPolicy.objects.create(
+            section=self.section, notify_after=timedelta(hours=4),
+            reassign_after=timedelta(hours=8), escalate_after=timedelta(hours=24))
+
+    def make_tickets(self, count, **kwargs):
+        tickets = [Ticket.objects.create(title=f'Ticket {i}', description='x',
+                                         section=self.section, facility=self.facility,
+                                         raised_by=self.user, **kwargs)
+                   for i in range(count)]
+        for ticket in tickets:
+            escalation.schedule(ticket)
+        return tickets
+
+    def test_ticket_creation_schedules_the_ladder(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('ticket-list'), {
+            'title': 'No power', 'description': 'x', 'section_id': self.section.id,
+            'facility_id': self.facility.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ticket = Ticket.objects.get(id=response.data['id'])
+        timers = dict(ticket.escalation_timers.values_list('step', 'fire_at'))
+        self.assertEqual(timers, {'notify': ticket.created_at + timedelta(hours=4),
+                                  'reassign': ticket.created_at + timedelta(hours=8),
+                                  'escalate': ticket.created_at + timedelta(hours=24)})
+
+        other = Section.objects.create(name='Plumbing')
+        response = self.client.post(reverse('ticket-list'), {
+            'title': 'Leak', 'description': 'x', 'section_id': other.id,
+            'facility_id': self.facility.id})
+        self.assertFalse(EscalationTimer.objects.filter(ticket_id=response.data['id']).exists())
+
+    def test_steps_fire_in_order(self):
+        ticket, = self.make_tickets(1, assigned_to=self.techs[0], status='assigned')
+        start = ticket.created_at
+
+        self.assertEqual(escalation.run_batch(now=start + timedelta(hours=1)), (0, {}))
+        self.assertEqual(escalation.run_batch(now=start + timedelta(hours=5)),
+                         (1, {'notify': 1}))
+        self.assertTrue(ticket.logs.filter(action__startswith='SLA: no resolution').exists())
+
+        escalation.run_batch(now=start + timedelta(hours=9))
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.assigned_to, self.techs[1])
+        self.assertEqual(ticket.version, 1)
+
+        escalation.run_batch(now=start + timedelta(hours=25))
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.escalated_to, self.manager)
+        self.assertFalse(ticket.escalation_timers.exists())
+        self.assertEqual(ticket.logs.filter(action__startswith='SLA').count(), 3)
+
+    def test_reassign_spreads_load_and_assigns_open_tickets(self):
+        tickets = self.make_tickets(4)
+        escalation.run_batch(now=tickets[0].created_at + timedelta(hours=9))
+        assignees = list(Ticket.objects.values_list('assigned_to__username', 'status'))
+        self.assertEqual(sorted(assignees), [('tech0', 'assigned')] * 2
+                         + [('tech1', 'assigned')] * 2)
+
+    def test_finished_tickets_drop_their_timers(self):
+        done, live = self.make_tickets(2)
+        Ticket.objects.filter(id=done.id).update(status='resolved')
+        popped, applied = escalation.run_batch(now=done.created_at + timedelta(days=2))
+        self.assertEqual(popped, 6)
+        self.assertEqual(applied, {'notify': 1, 'reassign': 1, 'escalate': 1})
+        self.assertFalse(EscalationTimer.objects.exists())
+        self.assertFalse(done.logs.exists())
+
+    def test_batch_queries_do_not_grow_with_tickets(self):
+        def queries_for(count):
+            Ticket.objects.all().delete()
+            tickets = self.make_tickets(count)
+            with CaptureQueriesContext(connection) as queries:
+                escalation.run_batch(now=tickets[0].created_at + timedelta(days=2))
+            return len(queries)
+
+        self.assertEqual(queries_for(2), queries_for(20))
+
+    def test_reassign_goes_through_the_transition_table(self):
+        ticket, = self.make_tickets(1)
+        with mock.patch.object(escalation.transitions, 'validate',
+                               wraps=transitions.validate) as validate:
+            escalation.run_batch(now=ticket.created_at + timedelta(hours=9))
+        validate.assert_called_with('open', 'assigned', has_assignee=True)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.status, 'assigned')
+        self.assertTrue(ticket.logs.filter(action='Status changed from open to assigned').exists())
+
+    def test_policy_changes_reschedule_open_tickets(self):
+        plumbing = Section.objects.create(name='Plumbing')
+        old, done = [Ticket.objects.create(title='Leak', description='x', section=plumbing,
+                                           facility=self.facility, raised_by=self.user)
+                     for _ in range(2)]
+        Ticket.objects.filter(id=done.id).update(status='closed')
+        # created before the section had a policy
+        policy = EscalationPolicy.objects.create(section=plumbing, notify_after=timedelta(hours=1),
+                                                 escalate_after=timedelta(hours=48))
+        self.assertEqual(dict(old.escalation_timers.values_list('step', 'fire_at')),
+                         {'notify': old.created_at + timedelta(hours=1),
+                          'escalate': old.created_at + timedelta(hours=48)})
+        self.assertFalse(done.escalation_timers.exists())
+
+        escalation.run_batch(now=old.created_at + timedelta(hours=2))
+        policy.notify_after = timedelta(hours=3)
+        policy.escalate_after = timedelta(hours=12)
+        policy.save()
+        # notify already fired and is not repeated
+        self.assertEqual(dict(old.escalation_timers.values_list('step', 'fire_at')),
+                         {'escalate': old.created_at + timedelta(hours=12)})
+
+        policy.delete()
+        self.assertFalse(old.escalation_timers.exists())
+
+    def test_command_reschedules(self):
+        ticket, = self.make_tickets(1)
+        EscalationTimer.objects.all().delete()
+        out = io.StringIO()
+        call_command('run_escalations', once=True, reschedule=True, stdout=out)
+        self.assertIn('3 timers rescheduled', out.getvalue())
+        self.assertEqual(ticket.escalation_timers.count(), 3)
+
+    def test_command_drains_due_timers(self):
+        self.make_tickets(3)
+        EscalationTimer.objects.filter(step='notify').update(
+            fire_at=timezone.now() - timedelta(minutes=1))
+        out = io.StringIO()
+        call_command('run_escalations', once=True, batch_size=2, stdout=out)
+        self.assertIn('3 notify, 0 reassign, 0 escalate', out.getvalue())
+        self.assertEqual(EscalationTimer.objects.count(), 6)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TenantTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # the rolled-back organizations must not stay cached for later tests
+        self.addCleanup(cache.clear)
+        self.acme = Organization.objects.create(name='Acme', slug='acme')
+        self.globex = Organization.objects.create(name='Globex', slug='globex')
+        self.sections, self.facilities, self.users, self.tickets = {}, {}, {}, {}
+        for org in (self.acme, self.globex):
+            with tenancy.use_tenant(org):
+                # same names in both organizations
+                section = Section.objects.create(name='IT')
+                facility = Facility.objects.create(name='Main Block')
+                user = User.objects.create_user(username=f'user-{org.slug}', password='x',
+                                                role='manager')
+                ticket = Ticket.objects.create(title='Broken', description='x',
+                                               section=section, facility=facility,
+                                               raised_by=user)
+            self.sections[org.slug], self.facilities[org.slug] = section, facility
+            self.users[org.slug], self.tickets[org.slug] = user, ticket
+        self.client.force_authenticate(self.users['acme'])
+
+    def test_rows_are_saved_into_the_current_tenant(self):
+        self.assertEqual(self.tickets['globex'].organization, self.globex)
+        self.assertEqual(self.users['acme'].organization, self.acme)
+        self.assertEqual(Ticket.objects.count(), 2)  # no tenant: unscoped
+        with tenancy.use_tenant(self.acme):
+            self.assertEqual(list(Ticket.objects.all()), [self.tickets['acme']])
+            self.assertEqual(Ticket.unscoped.count(), 2)
+
+    def test_requests_only_see_their_organization(self):
+        # the tenant is the user's organization, with or without the header
+        for headers in ({}, {'HTTP_X_ORGANIZATION': 'acme'}):
+            response = self.client.get(reverse('ticket-list'), **headers)
+            self.assertEqual([t['id'] for t in response.data], [self.tickets['acme'].id])
+            response = self.client.get(reverse('section-list'), **headers)
+            self.assertEqual([s['id'] for s in response.data], [self.sections['acme'].id])
+            response = self.client.get(
+                reverse('ticket-detail', args=[self.tickets['globex'].id]), **headers)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cannot_read_another_organization_by_naming_it(self):
+        globex_ticket = reverse('ticket-detail', args=[self.tickets['globex'].id])
+        for url in (reverse('ticket-list'), reverse('section-list'), reverse('user-list'),
+                    globex_ticket):
+            response = self.client.get(url, HTTP_X_ORGANIZATION='globex')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+            self.assertEqual(response.data, {'detail': 'Unknown organization.'})
+        response = self.client.patch(globex_ticket, {'title': 'Mine now'},
+                                     HTTP_X_ORGANIZATION='globex')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.tickets['globex'].refresh_from_db()
+        self.assertEqual(self.tickets['globex'].title, 'Broken')
+
+        # superusers belong to no organization and pick one with the header
+        admin = User.unscoped.create_superuser(username='root', password='x')
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('ticket-list'), HTTP_X_ORGANIZATION='globex')
+        self.assertEqual([t['id'] for t in response.data], [self.tickets['globex'].id])
+
+    def test_cannot_reference_another_organizations_rows(self):
+        response = self.client.post(reverse('ticket-list'), {
+            'title': 'Leak', 'description': 'x',
+            'section_id': self.sections['globex'].id,
+            'facility_id': self.facilities['acme'].id,
+        }, HTTP_X_ORGANIZATION='acme')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('section_id', response.data)
+
+        response = self.client.post(reverse('ticket-list'), {
+            'title': 'Leak', 'description': 'x',
+            'section_id': self.sections['acme'].id,
+            'facility_id': self.facilities['acme'].id,
+        }, HTTP_X_ORGANIZATION='acme')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.get(id=response.data['id']).organization, self.acme)
+
+    def test_top_level_comment_and_feedback_lists_are_scoped(self):
+        for slug in ('acme', 'globex'):
+            ticket = self.tickets[slug]
+            Comment.objects.create(ticket=ticket, author=self.users[slug],
+                                   text=f'secret of {slug}')
+            Feedback.objects.create(ticket=ticket, rated_by=self.users[slug], rating=5,
+                                    comment=f'secret of {slug}')
+        response = self.client.get(reverse('comment-list'))
+        self.assertEqual([c['text'] for c in response.data], ['secret of acme'])
+        response = self.client.get(reverse('feedback-list'))
+        self.assertEqual([f['comment'] for f in response.data], ['secret of acme'])
+        # the ticket filter's choices are scoped too
+        response = self.client.get(reverse('comment-list'),
+                                   {'ticket': self.tickets['globex'].id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # plain users see the rows of the tickets they raised, like ticket lists
+        with tenancy.use_tenant(self.acme):
+            self.client.force_authenticate(User.objects.create_user(username='visitor'))
+        self.assertEqual(self.client.get(reverse('comment-list')).data, [])
+
+    def test_provisioned_users_join_the_named_organization(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('first_name,last_name,email,role\nAda,Lovelace,ada@example.com,user\n')
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaisesMessage(CommandError, '--organization'):
+            call_command('provision_users', f.name, stdout=io.StringIO(),
+                         stderr=io.StringIO())
+        call_command('provision_users', f.name, organization='globex',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(User.unscoped.get(username='ada.lovelace').organization, self.globex)
+
+    def test_names_are_unique_per_organization(self):
+        response = self.client.post(reverse('section-list'), {'name': 'IT'},
+                                    HTTP_X_ORGANIZATION='acme')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        initech = Organization.objects.create(name='Initech', slug='initech')
+        with tenancy.use_tenant(initech):
+            self.client.force_authenticate(User.objects.create_user(username='user-initech'))
+        response = self.client.post(reverse('section-list'), {'name': 'IT'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Section.unscoped.get(id=response.data['id']).organization, initech)
+
+    def test_requests_without_an_organization_are_rejected(self):
+        response = self.client.get(reverse('ticket-list'), HTTP_X_ORGANIZATION='nobody')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # organizations exist, so neither anonymous nor organization-less users are unscoped
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('ticket-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('ticket-list'), HTTP_X_ORGANIZATION='acme')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(User.unscoped.create_user(username='drifter', role='manager'))
+        response = self.client.get(reverse('ticket-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(TENANT_REQUIRED=False):
+            response = self.client.get(reverse('ticket-list'))
+        self.assertEqual(len(response.data), 2)
+
+    @override_settings(TENANT_BASE_DOMAIN='resolver.example.com',
+                       ALLOWED_HOSTS=['.resolver.example.com'])
+    def test_organization_from_subdomain(self):
+        url = reverse('ticket-list')
+        response = self.client.get(url, HTTP_HOST='globex.resolver.example.com')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(self.users['globex'])
+        response = self.client.get(url, HTTP_HOST='globex.resolver.example.com')
+        self.assertEqual([t['id'] for t in response.data], [self.tickets['globex'].id])
+
+    def test_tenant_lookup_is_cached(self):
+        url = reverse('ticket-list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as scoped:
+            self.client.get(url, HTTP_X_ORGANIZATION='acme')
+        self.client.force_authenticate(User.unscoped.create_user(username='drifter', role='manager'))
+        with override_settings(TENANT_REQUIRED=False), \
+                CaptureQueriesContext(connection) as unscoped:
+            self.client.get(url)
+        # one filter more, no query more
+        self.assertEqual(len(scoped), len(unscoped))
+        self.assertIn('"organization_id" =', scoped[0]['sql'])
+        self.assertNotIn('"organization_id" =', unscoped[0]['sql'])
+
+    def test_every_api_view_resolves_the_tenant(self):
+        # the invite is accepted before the user has signed in
+        exempt = {'ticket-events', 'user-invite-accept'}
+        for pattern in ticket_urls.urlpatterns:
+            if pattern.name not in exempt:
+                self.assertTrue(issubclass(pattern.callback.cls, tenancy.TenantMixin),
+                                pattern.name)
+
+    def test_tenant_queries_can_use_organization_led_indexes(self):
+        leading = {index.fields[0] for index in Ticket._meta.indexes}
+        self.assertEqual(leading, {'organization'})
+        with tenancy.use_tenant(self.acme):
+            plan = Ticket.objects.filter(status='open').order_by('-created_at').explain()
+        self.assertIn('organization', plan)
+
+
+@override_settings(CACHES=TEST_CACHES, SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        self.client.force_authenticate(self.user)
+
+    def post_ticket(self, title):
+        return self.client.post(reverse('ticket-list'), {
+            'title': title, 'description': 'x', 'section_id': self.section.id,
+            'facility_id': self.facility.id, 'allow_duplicate': True})
+
+    def test_requests_are_recorded_by_fingerprint(self):
+        with self.assertLogs('tickets.slowlog', 'WARNING'):
+            self.client.get(reverse('ticket-list'))
+        rows = list(SlowQuery.objects.all())
+        self.assertTrue(rows)
+        self.assertTrue(all(row.source == 'GET ticket-list' for row in rows))
+        select = SlowQuery.objects.get(caller='tickets.views.TicketListCreateView.list')
+        self.assertEqual(select.calls, 1)
+        self.assertIn('FROM "tickets_ticket"', select.sql)
+        self.assertIn('tickets_ticket', select.plan)  # EXPLAIN QUERY PLAN output
+
+        with self.assertLogs('tickets.slowlog', 'WARNING'):
+            self.client.get(reverse('ticket-list'))
+        select.refresh_from_db()
+        self.assertEqual(select.calls, 2)
+        self.assertEqual(SlowQuery.objects.count(), len(rows))
+
+    def test_async_requests_are_recorded(self):
+        # async-capable, so ASGI keeps the middleware chain async
+        self.assertTrue(slowlog.SlowQueryMiddleware.async_capable)
+        with self.assertLogs('tickets.slowlog', 'WARNING'):
+            response = async_to_sync(AsyncClient().get)(reverse('ticket-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(SlowQuery.objects.filter(
+            source='GET ticket-list', caller='tickets.views.TicketListCreateView.list').exists())
+
+    def test_service_functions_are_named(self):
+        with self.assertLogs('tickets.slowlog', 'WARNING'):
+            self.post_ticket('No power')
+        callers = set(SlowQuery.objects.filter(source='POST ticket-list')
+                      .values_list('caller', flat=True))
+        self.assertIn('tickets.services.create_ticket', callers)
+
+    def test_parameters_do_not_split_fingerprints(self):
+        self.assertEqual(slowlog.fingerprint('SELECT 1 FROM t WHERE id IN (%s, %s)'),
+                         slowlog.fingerprint("SELECT 2 FROM t WHERE id IN (%s, %s, %s)"))
+        self.assertNotEqual(slowlog.fingerprint('SELECT a FROM t'),
+                            slowlog.fingerprint('SELECT b FROM t'))
+
+    def test_fast_queries_are_not_recorded(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=60_000):
+            self.client.get(reverse('ticket-list'))
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=None):
+            self.client.get(reverse('ticket-list'))
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_report_command(self):
+        with self.assertLogs('tickets.slowlog', 'WARNING'):
+            self.client.get(reverse('ticket-list'))
+        top = SlowQuery.objects.order_by('-total_ms').first()
+        out = io.StringIO()
+        call_command('slow_queries', limit=5, stdout=out)
+        self.assertIn(top.fingerprint[:12], out.getvalue())
+        out = io.StringIO()
+        call_command('slow_queries', top.fingerprint[:10], stdout=out)
+        self.assertIn(top.sql, out.getvalue())
+        call_command('slow_queries', reset=True, stdout=io.StringIO())
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LookupCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.technician = User.objects.create_user(username='techuser', password='x',
+                                                   role='technician')
+        self.section = Section.objects.create(name='IT')
+        self.facility = Facility.objects.create(name='Main Block')
+        self.client.force_authenticate(self.user)
+
+    def post_ticket(self, **data):
+        return self.client.post(reverse('ticket-list'), {
+            'title': f'Ticket {uuid.uuid4()}', 'description': 'x', 'allow_duplicate': True,
+            'section_id': self.section.id, 'facility_id': self.facility.id, **data})
+
+    def test_create_resolves_relations_from_memory(self):
+        lookups.warm()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_ticket(assigned_to_id='techuser')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        lookup_sql = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and (
+            'FROM "tickets_section"' in q['sql'] or 'FROM "tickets_facility"' in q['sql']
+            or '"tickets_customuser"."role"' in q['sql'])]
+        self.assertEqual(lookup_sql, [])
+        ticket = Ticket.objects.get(id=response.data['id'])
+        self.assertEqual((ticket.section, ticket.facility, ticket.assigned_to),
+                         (self.section, self.facility, self.technician))
+
+    def test_maps_follow_changes(self):
+        lookups.warm()
+        plumbing = Section.objects.create(name='Plumbing')
+        self.assertEqual(self.post_ticket(section_id=plumbing.id).status_code,
+                         status.HTTP_201_CREATED)
+
+        facility_id = self.facility.id
+        self.facility.delete()
+        response = self.post_ticket(facility_id=facility_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('facility_id', response.data)
+
+        self.technician.role = 'user'
+        self.technician.save()
+        self.assertIsNone(lookups.get('technician', 'techuser'))
+
+    def test_inactive_technicians_cannot_be_assigned(self):
+        lookups.warm()
+        self.technician.is_active = False
+        self.technician.save(update_fields=['is_active'])
+        self.assertIsNone(lookups.get('technician', 'techuser'))
+        response = self.post_ticket(assigned_to_id='techuser')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_maps_expire_without_signals(self):
+        lookups.get('section', self.section.id)
+        # update() sends no signal
+        Section.objects.filter(id=self.section.id).update(name='Networks')
+        self.assertEqual(lookups.get('section', self.section.id).name, 'IT')
+        with mock.patch('tickets.lookups.time.monotonic',
+                        return_value=time.monotonic() + settings.LOOKUP_MAP_TTL + 1):
+            self.assertEqual(lookups.get('section', self.section.id).name, 'Networks')
+
+    def test_logins_keep_the_technician_map(self):
+        lookups.get('technician', 'techuser')
+        self.technician.last_login = timezone.now()
+        self.technician.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get('technician', 'techuser'), self.technician)
+
+    def test_bulk_created_technicians_are_found(self):
+        lookups.warm()
+        user, = services.bulk_create_users(
+            [{'first_name': 'Ada', 'last_name': 'Byte', 'role': 'technician'}])
+        self.assertEqual(lookups.get('technician', user.username), user)
+
+    def test_lookups_return_copies(self):
+        first = lookups.get('section', self.section.id)
+        first.name = 'Changed'
+        self.assertEqual(lookups.get('section', self.section.id).name, 'IT')
+
+    def test_invalid_values_are_rejected(self):
+        for value in ('abc', True, 999999):
+            response = self.post_ticket(section_id=value)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+        response = self.post_ticket(assigned_to_id='testuser')  # not a technician
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_maps_are_per_tenant(self):
+        self.addCleanup(cache.clear)
+        acme = Organization.objects.create(name='Acme', slug='acme')
+        with tenancy.use_tenant(acme):
+            acme_section = Section.objects.create(name='IT')
+            self.assertIsNone(lookups.get('section', self.section.id))
+            self.assertEqual(lookups.get('section', acme_section.id), acme_section)
+        self.assertEqual(lookups.get('section', self.section.id), self.section)
@@ -0,0 +1,137 @@
+"""
+Admission control for write endpoints.
+
+Two layers, both answering 429 with ``Retry-After`` (via DRF's
+``Throttled``):
+
+- ``WriteRateThrottle``: a token bucket per (endpoint scope, user). A
+  rate of ``'30/min'`` allows a burst of 30 writes, refilled at 30 per
+  minute. Buckets live in Django's default cache, so every worker reads
+  and spends the same bucket (see ``CACHES`` in settings), and they are
+  stamped with wall-clock time: ``time.monotonic()`` has a different
+  origin in every process. Spending a token is a read-modify-write that
+  is serialised only within a process; Django's cache API has no
+  compare-and-swap. Across processes the limit is therefore best-effort:
+  workers racing on one bucket may each spend the same token, so a burst
+  can exceed the capacity by up to one write per concurrent worker.
+- ``WriteAdmissionMixin``: caps in-flight writes per process. A write
+  that finds every slot taken waits up to ``TICKET_WRITE_QUEUE_TIMEOUT``
+  seconds and is then shed, so latency stays bounded under overload
+  instead of piling up behind database locks.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+class WriteRateThrottle(BaseThrottle):
+    """Token bucket on unsafe methods; reads are never throttled."""
+    cache = cache
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+    # buckets are read-modified-written; this serialises that within the
+    # process only (see the module docstring)
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.capacity = self.refill = None
+        self.retry_after = None
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+        return scope, rates.get(scope)
+
+    def parse_rate(self, rate):
+        """``'30/min'`` -> (capacity 30, refill 0.5 tokens per second)."""
+        num, period = rate.split('/')
+        seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(num), int(num) / seconds
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        scope, rate = self.get_rate(view)
+        if rate is None:
+            return True
+        self.capacity, self.refill = self.parse_rate(rate)
+
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        key = self.cache_format % {'scope': scope, 'ident': ident}
+
+        with self.lock:
+            now = time.time()
+            tokens, updated = self.cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # idle buckets expire once they would be full again
+            self.cache.set(key, (tokens, now),
+                           timeout=int((self.capacity - tokens) / self.refill) + 1)
+        self.retry_after = None if allowed else (1 - tokens) / self.refill
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` holders at once; others wait ``queue_timeout`` seconds."""
+
+    def __init__(self, limit, queue_timeout, retry_after):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise Throttled(wait=self.retry_after,
+                            detail="Server is busy with other writes. Try again shortly.")
+
+    def release(self):
+        self._slots.release()
+
+
+_write_limiter = None
+
+
+def get_write_limiter():
+    """Return the process-wide write limiter, building it on first use."""
+    global _write_limiter
+    if _write_limiter is None:
+        _write_limiter = ConcurrencyLimiter(
+            settings.TICKET_WRITE_CONCURRENCY,
+            settings.TICKET_WRITE_QUEUE_TIMEOUT,
+            settings.TICKET_WRITE_RETRY_AFTER)
+    return _write_limiter
+
+
+class WriteAdmissionMixin:
+    """
+    Hold a write slot for the duration of each unsafe request. Slots are
+    taken after authentication, permissions and throttles, so rejected
+    requests never occupy one.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            get_write_limiter().acquire()
+            self._holds_write_slot = True
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if getattr(self, '_holds_write_slot', False):
+                self._holds_write_slot = False
+                get_write_limiter().release()
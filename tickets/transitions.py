@@ -0,0 +1,161 @@
+"""
+Ticket status state machine.
+
+``TRANSITIONS`` declares every legal status change, with an optional guard
+(the ticket must have an assignee) and side effects (fields written along
+with the new status). Everything else is rejected, e.g. ``closed`` is
+terminal. Lookups go through dicts precomputed at import time, so
+validating a change is O(1).
+
+``transition_many`` applies one target status to a whole queryset with a
+single conditional UPDATE plus one bulk insert of TicketLog rows.
+"""
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .events import publish_ticket_event
+from .models import Ticket, TicketLog
+
+
+class Transition(NamedTuple):
+    source: str
+    target: str
+    requires_assignee: bool = False
+    sets: dict = {}
+
+    def guard(self):
+        """SQL twin of the Python guard in ``validate``."""
+        return Q(assigned_to__isnull=False) if self.requires_assignee else Q()
+
+
+TRANSITIONS = [
+    Transition('open', 'assigned', requires_assignee=True),
+    Transition('open', 'in_progress', requires_assignee=True),
+    Transition('open', 'pending'),
+    Transition('open', 'closed'),
+    Transition('assigned', 'open', sets={'assigned_to': None}),
+    Transition('assigned', 'in_progress', requires_assignee=True),
+    Transition('assigned', 'pending'),
+    Transition('assigned', 'resolved', requires_assignee=True),
+    Transition('assigned', 'closed'),
+    Transition('in_progress', 'assigned', requires_assignee=True),
+    Transition('in_progress', 'pending'),
+    Transition('in_progress', 'resolved', requires_assignee=True),
+    Transition('pending', 'open', sets={'assigned_to': None}),
+    Transition('pending', 'assigned', requires_assignee=True),
+    Transition('pending', 'in_progress', requires_assignee=True),
+    Transition('pending', 'resolved', requires_assignee=True),
+    Transition('pending', 'closed'),
+    # reopen after a failed fix
+    Transition('resolved', 'in_progress', requires_assignee=True),
+    Transition('resolved', 'closed'),
+]
+
+STATUSES = {value for value, _ in Ticket.STATUS_CHOICES}
+
+# (source, target) -> Transition, and target -> transitions into it
+TRANSITION_MAP = {(t.source, t.target): t for t in TRANSITIONS}
+TRANSITIONS_INTO = {status: [] for status in STATUSES}
+for _t in TRANSITIONS:
+    TRANSITIONS_INTO[_t.target].append(_t)
+del _t
+
+
+class TransitionError(ValueError):
+    pass
+
+
+def validate(source, target, has_assignee):
+    """Return the Transition for ``source -> target`` or raise TransitionError."""
+    if target not in STATUSES:
+        raise TransitionError(f"Unknown status '{target}'.")
+    transition = TRANSITION_MAP.get((source, target))
+    if transition is None:
+        raise TransitionError(f"Cannot change status from {source} to {target}.")
+    if transition.requires_assignee and not has_assignee:
+        raise TransitionError(f"A ticket must be assigned before it can be {target}.")
+    return transition
+
+
+def _set_expressions(transitions, field):
+    """CASE status WHEN <source> THEN <value> ... ELSE <current value> END."""
+    whens = [When(status=t.source, then=Value(t.sets[field]))
+             for t in transitions if field in t.sets]
+    return Case(*whens, default=F(field), output_field=Ticket._meta.get_field(field))
+
+
+def transition_many(queryset, to_status, user=None):
+    """
+    Move every ticket in ``queryset`` to ``to_status`` where that is legal.
+
+    Returns one result per ticket: ``{'id', 'ticket_no', 'from', 'to',
+    'ok', 'error'}``. Legal tickets are changed by a single UPDATE whose
+    WHERE clause re-checks the version that was read (and source status and
+    guards), so a ticket changed concurrently is skipped rather than
+    overwritten.
+    """
+    if to_status not in STATUSES:
+        raise TransitionError(f"Unknown status '{to_status}'.")
+    rows = list(queryset.order_by('id').values_list(
+        'id', 'ticket_no', 'status', 'assigned_to_id', 'version'))
+
+    results, candidates, assignees = {}, {}, {}
+    for pk, ticket_no, status, assigned_to_id, version in rows:
+        assignees[pk] = assigned_to_id
+        result = {'id': pk, 'ticket_no': ticket_no, 'from': status, 'to': to_status,
+                  'ok': False, 'error': None}
+        try:
+            validate(status, to_status, assigned_to_id is not None)
+        except TransitionError as exc:
+            result['error'] = str(exc)
+        else:
+            candidates[pk] = version
+        results[pk] = result
+
+    if candidates:
+        transitions = TRANSITIONS_INTO[to_status]
+        condition = Q()
+        for t in transitions:
+            condition |= Q(status=t.source) & t.guard()
+        # each ticket must still be at the version read above
+        by_version = {}
+        for pk, version in candidates.items():
+            by_version.setdefault(version, []).append(pk)
+        unchanged = Q()
+        for version, pks in by_version.items():
+            unchanged |= Q(version=version, id__in=pks)
+        fields = {field for t in transitions for field in t.sets}
+        updates = {field: _set_expressions(transitions, field) for field in fields}
+
+        with transaction.atomic():
+            Ticket.objects.filter(condition, unchanged).update(
+                status=to_status, updated_at=timezone.now(),
+                version=F('version') + 1, **updates)
+            # the rows this UPDATE bumped; the others changed under us
+            done = {pk for pk, version in Ticket.objects.filter(
+                id__in=candidates, status=to_status).values_list('id', 'version')
+                if version == candidates[pk] + 1}
+            logs = []
+            for pk in sorted(done):
+                transition = TRANSITION_MAP[(results[pk]['from'], to_status)]
+                if 'assigned_to' in transition.sets and assignees[pk] is not None:
+                    logs.append(TicketLog(ticket_id=pk, performed_by=user,
+                                          action="Assigned to None"))
+                logs.append(TicketLog(
+                    ticket_id=pk, performed_by=user,
+                    action=f"Status changed from {results[pk]['from']} to {to_status}"))
+            TicketLog.objects.bulk_create(logs)
+            for ticket in Ticket.objects.filter(id__in=done).only(
+                    'id', 'ticket_no', 'status', 'section', 'assigned_to', 'organization'):
+                publish_ticket_event('status', ticket)
+
+        for pk in candidates:
+            if pk in done:
+                results[pk]['ok'] = True
+            else:
+                results[pk]['error'] = "Ticket was modified concurrently."
+
+    return [results[pk] for pk, *_ in rows]
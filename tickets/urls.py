@@ -3,10 +3,13 @@ from django.urls import path
 from .views import (
     SectionListCreateView, SectionDetailView,
     FacilityListCreateView, FacilityDetailView,
-    TicketListCreateView, TicketDetailView,
+    TicketListCreateView, TicketDetailView, TicketByNumberView, TicketTimelineView,
+    ticket_events,
+    TicketBulkTransitionView,
     CommentListCreateView,
     FeedbackListCreateView,
-    UserListCreateView, UserDetailView,
+    TicketAnalyticsView,
+    UserListCreateView, UserBulkCreateView, UserInviteAcceptView, UserDetailView,
 )
 
 urlpatterns = [
@@ -22,6 +25,13 @@ urlpatterns = [
     # TICKET
     path('tickets/', TicketListCreateView.as_view(), name='ticket-list'),
     path('tickets/<int:pk>/', TicketDetailView.as_view(), name='ticket-detail'),
+    path('tickets/number/<str:ticket_no>/', TicketByNumberView.as_view(),
+         name='ticket-by-number'),
+    path('tickets/<int:pk>/timeline/', TicketTimelineView.as_view(),
+         name='ticket-timeline'),
+    path('tickets/events/', ticket_events, name='ticket-events'),
+    path('tickets/transition/', TicketBulkTransitionView.as_view(),
+         name='ticket-bulk-transition'),
 
     # COMMENT
     path('comments/', CommentListCreateView.as_view(), name='comment-list'),
@@ -29,8 +39,14 @@ urlpatterns = [
     # FEEDBACK
     path('feedback/', FeedbackListCreateView.as_view(), name='feedback-list'),
 
+    # ANALYTICS
+    path('analytics/', TicketAnalyticsView.as_view(), name='ticket-analytics'),
+
     # USER
     path('users/', UserListCreateView.as_view(), name='user-list'),
+    path('users/bulk/', UserBulkCreateView.as_view(), name='user-bulk-create'),
+    path('users/invite/accept/', UserInviteAcceptView.as_view(),
+         name='user-invite-accept'),
     path('users/<int:pk>/', UserDetailView.as_view(), name='user-detail'),
 
     # NESTED TICKET RESOURCES
@@ -1,8 +1,32 @@
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import (
+    ListCreateAPIView, RetrieveAPIView, RetrieveUpdateDestroyAPIView,
+)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from .serializers import *
 from django_filters.rest_framework import DjangoFilterBackend
 from . import services
+from .conditional import ConditionalDetailMixin, ConditionalListMixin
+from .events import get_broker
+from .idempotency import IdempotentCreateMixin
+from .permissions import scope_tickets
+from .renderers import StreamingJSONRenderer
+from .tenancy import TenantError, TenantMixin, resolve_tenant
+from .throttling import WriteAdmissionMixin, WriteRateThrottle
+from .timeline import InvalidCursor, ticket_timeline
 
 # Create your views here.
 
@@ -10,13 +34,13 @@ from . import services
 # SECTION API
 # ----------------------------------
 
-class SectionListCreateView(ListCreateAPIView):
+class SectionListCreateView(TenantMixin, ListCreateAPIView):
     queryset = Section.objects.all()
     serializer_class = SectionSerializer
     # permission_classes = [IsAuthenticated]
 
 
-class SectionDetailView(RetrieveUpdateDestroyAPIView):
+class SectionDetailView(TenantMixin, RetrieveUpdateDestroyAPIView):
     queryset = Section.objects.all()
     serializer_class = SectionSerializer
     # permission_classes = [IsAuthenticated]
@@ -25,13 +49,13 @@ class SectionDetailView(RetrieveUpdateDestroyAPIView):
 # FACILITY API
 # ----------------------------------
 
-class FacilityListCreateView(ListCreateAPIView):
+class FacilityListCreateView(TenantMixin, ListCreateAPIView):
     queryset = Facility.objects.all()
     serializer_class = FacilitySerializer
     # permission_classes = [IsAuthenticated]
 
 
-class FacilityDetailView(RetrieveUpdateDestroyAPIView):
+class FacilityDetailView(TenantMixin, RetrieveUpdateDestroyAPIView):
     queryset = Facility.objects.all()
     serializer_class = FacilitySerializer
     # permission_classes = [IsAuthenticated]
@@ -40,65 +64,303 @@ class FacilityDetailView(RetrieveUpdateDestroyAPIView):
 # TICKETS API
 # ----------------------------------
 
-class TicketListCreateView(ListCreateAPIView):
-    queryset = Ticket.objects.all().order_by('-created_at')
+# everything TicketSerializer renders, so a page costs a fixed number of queries
+TICKET_RELATED = ('section', 'facility', 'raised_by', 'assigned_to', 'escalated_to',
+                  'feedback__rated_by')
+TICKET_PREFETCH = ('comments__author',)
+
+
+class TicketListCreateView(TenantMixin, WriteAdmissionMixin, IdempotentCreateMixin,
+                           ConditionalListMixin, ListCreateAPIView):
+    queryset = (Ticket.objects.select_related(*TICKET_RELATED)
+                .prefetch_related(*TICKET_PREFETCH).order_by('-created_at'))
     serializer_class = TicketSerializer
+    throttle_classes = [WriteRateThrottle]
+    throttle_scope = 'ticket_writes'
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, StreamingJSONRenderer]
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['status', 'section', 'assigned_to', 'raised_by']
+    filterset_fields = ['status', 'section', 'assigned_to', 'raised_by', 'escalated_to']
     # permission_classes = [IsAuthenticated]
 
-    def perform_create(self, serializer):
-        """Delegate ticket creation to service layer """
-        services.create_ticket(serializer, self.request.user)
+    def get_queryset(self):
+        return scope_tickets(self.request.user, super().get_queryset())
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if isinstance(renderer, StreamingJSONRenderer):
+            # ?format=jsonstream: rows are serialized while the response is sent
+            queryset = self.filter_queryset(self.get_queryset())
+            # ASGI buffers sync iterators whole; give it an async one
+            asgi = isinstance(request._request, ASGIRequest)
+            stream = renderer.astream if asgi else renderer.stream
+            rows = stream(queryset, self.get_serializer_class(), self.get_serializer_context())
+            return StreamingHttpResponse(rows, content_type=renderer.media_type)
+        return super().list(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        """Delegate ticket creation to service layer; duplicates are merged, not created"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ticket, created = services.report_ticket(serializer, request.user)
+        if created:
+            headers = self.get_success_headers(serializer.data)
+            return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        return Response({
+            'detail': f"Already reported as {ticket.ticket_no}; your report was added to it.",
+            'duplicate_of': {'id': ticket.id, 'ticket_no': ticket.ticket_no,
+                             'status': ticket.status},
+        }, status=status.HTTP_200_OK)
+
 
+class ArchiveFallbackMixin:
+    """
+    GET of a ticket missing from the live table is answered from the
+    archive (read-only), so archived tickets stay reachable at their URLs.
+    """
 
-class TicketDetailView(RetrieveUpdateDestroyAPIView):
-    queryset = Ticket.objects.all()
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            archived = (ArchivedTicket.objects.select_related(*TICKET_RELATED)
+                        .prefetch_related(*TICKET_PREFETCH))
+            ticket = get_object_or_404(scope_tickets(request.user, archived),
+                                       **{self.lookup_field: lookup})
+            serializer = ArchivedTicketSerializer(ticket, context=self.get_serializer_context())
+            return Response(serializer.data)
+
+
+class TicketDetailView(TenantMixin, WriteAdmissionMixin, ArchiveFallbackMixin,
+                       ConditionalDetailMixin, RetrieveUpdateDestroyAPIView):
+    queryset = Ticket.objects.select_related(*TICKET_RELATED).prefetch_related(*TICKET_PREFETCH)
     serializer_class = TicketSerializer
     # permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return scope_tickets(self.request.user, super().get_queryset())
+
+    def perform_destroy(self, instance):
+        """ soft delete: the ticket and its history move to the archive """
+        services.delete_ticket(instance, self.request.user)
+
     def perform_update(self, serializer):
         """ delegate ticket update ( assign, update status, etc) """
-        services.update_ticket(serializer, self.request.user)
+        services.update_ticket(serializer, self.request.user, self.matched_version())
+        # DRF drops the prefetch cache after an update; reload with it so the
+        # response does not fall back to one query per comment author
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+
+class TicketByNumberView(TenantMixin, ArchiveFallbackMixin, RetrieveAPIView):
+    """Look a ticket up by its TKT- number, live or archived."""
+    queryset = Ticket.objects.select_related(*TICKET_RELATED).prefetch_related(*TICKET_PREFETCH)
+    serializer_class = TicketSerializer
+    lookup_field = 'ticket_no'
+
+    def get_queryset(self):
+        return scope_tickets(self.request.user, super().get_queryset())
+
+
+class TicketBulkTransitionView(TenantMixin, WriteAdmissionMixin, APIView):
+    """
+    Move many tickets to one status: {"ids": [1, 2], "status": "closed"}.
+    Illegal transitions are reported per ticket rather than failing the batch.
+    """
+    max_batch_size = 1000
+    # permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get('ids')
+        to_status = request.data.get('status')
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            raise ValidationError({'ids': 'Expected a list of ticket ids.'})
+        if len(ids) > self.max_batch_size:
+            raise ValidationError({'ids': f'At most {self.max_batch_size} tickets per request.'})
+
+        queryset = scope_tickets(request.user, Ticket.objects.filter(id__in=ids))
+        user = request.user if request.user.is_authenticated else None
+        return Response(services.transition_tickets(queryset, to_status, user))
+
+
+class TicketTimelineView(TenantMixin, APIView):
+    """
+    Logs, comments and feedback of one ticket as a single chronological
+    stream. Paginate with ?cursor=<next> and ?limit=<n> (max 200).
+    """
+    default_limit = 50
+    max_limit = 200
+    # permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        get_object_or_404(scope_tickets(request.user, Ticket.objects.only('id')), pk=pk)
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be at least 1.'})
+
+        try:
+            entries, cursor = ticket_timeline(
+                pk, cursor=request.query_params.get('cursor'), limit=limit)
+        except InvalidCursor as exc:
+            raise ValidationError({'cursor': str(exc)})
+
+        next_url = None
+        if cursor:
+            next_url = request.build_absolute_uri(
+                f"{request.path}?{urlencode({'cursor': cursor, 'limit': limit})}")
+        return Response({'next': next_url, 'results': entries})
+
+# --------------------------------
+# LIVE TICKET EVENTS (SSE)
+# ----------------------------------
+
+async def ticket_events(request):
+    """
+    Stream ticket create/assign/status events as server-sent events.
+    Optional ?section=<id> and ?assigned_to=<id> narrow the stream.
+    Needs to be served through the ASGI application (resolver/asgi.py).
+    """
+    filters = {}
+    for param in ('section', 'assigned_to'):
+        value = request.GET.get(param)
+        if value is None:
+            continue
+        try:
+            filters[param] = int(value)
+        except ValueError:
+            return HttpResponseBadRequest(f"'{param}' must be an integer id.")
+    # only the requesting user's organization's tickets (tickets/tenancy.py)
+    try:
+        tenant = await sync_to_async(resolve_tenant)(request, await request.auser())
+    except TenantError as exc:
+        return JsonResponse({'detail': exc.detail}, status=exc.status)
+    if tenant is not None:
+        filters['organization'] = tenant.pk
+
+    keepalive = getattr(settings, 'TICKET_EVENTS_KEEPALIVE', 15)
+
+    async def stream():
+        broker = get_broker()
+        # subscribe on the loop that consumes the stream
+        subscription = broker.subscribe(**filters)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await subscription.get(timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 # --------------------------------
 # COMMENTS API
 # ----------------------------------
 
-class CommentListCreateView(ListCreateAPIView):
-    queryset = Comment.objects.all().order_by('created_at')
+class TicketChildMixin:
+    """
+    Comments and feedback are served both at the top level (``/comments/``)
+    and nested under a ticket (``/tickets/<ticket_id>/comments/``). Nested
+    routes list only that ticket's rows through the ``ticket_id`` index and
+    create under it; the ticket is looked up once per request. Top-level
+    lists are limited to the tickets the caller may see in the current
+    tenant, since comments and feedback carry no organization of their own.
+    """
+
+    def get_ticket(self):
+        if not hasattr(self, '_ticket'):
+            ticket_id = self.kwargs.get('ticket_id', self.request.data.get('ticket'))
+            try:
+                ticket_id = int(ticket_id)
+            except (TypeError, ValueError):
+                raise ValidationError({'ticket': 'A valid ticket id is required.'})
+            tickets = scope_tickets(self.request.user, Ticket.objects.all())
+            self._ticket = get_object_or_404(tickets, pk=ticket_id)
+        return self._ticket
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if 'ticket_id' in self.kwargs:
+            queryset = queryset.filter(ticket=self.get_ticket())
+        else:
+            queryset = queryset.filter(
+                ticket__in=scope_tickets(self.request.user, Ticket.objects.all()))
+        return queryset
+
+
+class CommentListCreateView(TenantMixin, WriteAdmissionMixin, IdempotentCreateMixin,
+                            TicketChildMixin, ListCreateAPIView):
+    queryset = Comment.objects.select_related('ticket', 'author').order_by('created_at')
     serializer_class = CommentSerializer
+    throttle_classes = [WriteRateThrottle]
+    throttle_scope = 'comment_writes'
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['author', 'ticket']
     # permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        ticket_id = serializer.validated_data.get('ticket')
-        services.create_comment(serializer, self.request.user, ticket_id)
+        services.create_comment(serializer, self.request.user, self.get_ticket())
 
 
 # --------------------------------
 # FEEDBACK API
 # ----------------------------------
 
-class FeedbackListCreateView(ListCreateAPIView):
-    queryset = Feedback.objects.all().order_by('-created_at')
+class FeedbackListCreateView(TenantMixin, WriteAdmissionMixin, IdempotentCreateMixin,
+                             TicketChildMixin, ListCreateAPIView):
+    queryset = Feedback.objects.select_related('ticket', 'rated_by').order_by('-created_at')
     serializer_class = FeedbackSerializer
+    throttle_classes = [WriteRateThrottle]
+    throttle_scope = 'feedback_writes'
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['rating', 'rated_by', 'ticket']
     # permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        # ticket_id = self.request.data.get('ticket')
-        ticket_id = serializer.validated_data.get('ticket')
-        services.create_feedback(serializer, self.request.user, ticket_id)
+        services.create_feedback(serializer, self.request.user, self.get_ticket())
+
+
+# --------------------------------
+# ANALYTICS API
+# ----------------------------------
+
+class TicketAnalyticsView(TenantMixin, APIView):
+    """
+    Resolution-time percentiles, daily backlog (?days=30) and rating
+    histograms per section and technician, over the tickets the caller
+    can see.
+    """
+    # permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            raise ValidationError({'days': 'Must be an integer.'})
+        if not 1 <= days <= 366:
+            raise ValidationError({'days': 'Must be between 1 and 366.'})
+        # NumPy is only imported once analytics are actually requested
+        from . import analytics
+
+        queryset = scope_tickets(request.user, Ticket.objects.all())
+        return Response(analytics.summarize(queryset, days=days))
 
 
 # --------------------------------
 # USERS API
 # ----------------------------------
 
-class UserListCreateView(ListCreateAPIView):
+class UserListCreateView(TenantMixin, ListCreateAPIView):
     queryset = CustomUser.objects.all().order_by('username')
     serializer_class = UserSerializer
     filter_backends = [DjangoFilterBackend]
@@ -106,7 +368,43 @@ class UserListCreateView(ListCreateAPIView):
     # permission_classes = [IsAuthenticated]
 
 
-class UserDetailView(RetrieveUpdateDestroyAPIView):
+class UserBulkCreateView(TenantMixin, APIView):
+    """
+    Import a list of users in one request. Usernames for the whole batch
+    are resolved with a single query and the rows go in with one INSERT.
+    """
+    max_batch_size = 1000
+    # permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of users.')
+        if len(request.data) > self.max_batch_size:
+            raise ValidationError(f'At most {self.max_batch_size} users per request.')
+
+        serializer = BulkUserSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        users = services.bulk_create_users(serializer.validated_data)
+        return Response(UserSerializer(users, many=True).data, status=status.HTTP_201_CREATED)
+
+
+class UserInviteAcceptView(APIView):
+    """
+    Let a provisioned user set their first password with the uid/token
+    pair issued by `manage.py provision_users`. The caller is not signed in
+    yet, so there is no tenant; the token identifies the user.
+    """
+
+    def post(self, request):
+        missing = [f for f in ('uid', 'token', 'password') if not request.data.get(f)]
+        if missing:
+            raise ValidationError({f: 'This field is required.' for f in missing})
+        user = services.accept_invite(
+            request.data['uid'], request.data['token'], request.data['password'])
+        return Response(UserSerializer(user).data)
+
+
+class UserDetailView(TenantMixin, RetrieveUpdateDestroyAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     # permission_classes = [IsAuthenticated]